@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',
@@ -46,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its latency covers all the other middleware
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,6 +94,71 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Local memory by default, set CACHE_BACKEND/CACHE_LOCATION to memcached
+# (PyMemcacheCache) in production so all uwsgi workers see the same
+# per-user data versions. The file based backend is only fit for tests,
+# its incr/add are not atomic and it culls at 300 entries.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a cached recipe API response is kept
+RECIPE_CACHE_TIMEOUT = int(os.environ.get('RECIPE_CACHE_TIMEOUT', 300))
+
+# Seconds a token lookup is cached, per process and in the cache above.
+# Deleted tokens and changed users are dropped at once, 0 turns it off.
+TOKEN_AUTH_CACHE_TIMEOUT = int(os.environ.get('TOKEN_AUTH_CACHE_TIMEOUT', 300))
+# Token lookups each process keeps in memory
+TOKEN_AUTH_CACHE_SIZE = int(os.environ.get('TOKEN_AUTH_CACHE_SIZE', 1000))
+
+
+# Slow query log
+# Queries slower than the threshold are written with their EXPLAIN plan to a
+# rotating file. A fingerprint is logged at most once per interval, later
+# occurrences are only counted. A threshold of 0 turns the log off.
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 500))
+SLOW_QUERY_EXPLAIN = bool(int(os.environ.get('SLOW_QUERY_EXPLAIN', 1)))
+SLOW_QUERY_LOG_INTERVAL = int(os.environ.get('SLOW_QUERY_LOG_INTERVAL', 60))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'slow_queries': {
+            'format': '%(asctime)s %(message)s',
+        },
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.environ.get('SLOW_QUERY_LOG_FILE', '/tmp/slow_queries.log'),
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            # Only create the file once there is something to write
+            'delay': True,
+            'formatter': 'slow_queries',
+        },
+    },
+    'loggers': {
+        'core.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -109,6 +178,31 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+# PASSWORD_HASHER picks the hasher for new passwords. The others only check
+# existing hashes, a successful login rehashes those with the chosen one.
+
+PASSWORD_HASHER_CHOICES = {
+    'argon2': 'core.hashers.TunedArgon2PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHER = PASSWORD_HASHER_CHOICES[os.environ.get('PASSWORD_HASHER', 'argon2')]
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [
+    hasher for hasher in [
+        *PASSWORD_HASHER_CHOICES.values(),
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    ] if hasher != PASSWORD_HASHER
+]
+
+# Argon2id costs, 19 MiB and 2 passes with one lane by default, see
+# https://cheatsheetseries.owasp.org/cheatsheets/Password_Storage_Cheat_Sheet.html
+# Memory is in KiB and is taken per concurrent login in every worker.
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 19456))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -132,6 +226,21 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Uploaded recipe images are processed by a pool of this many processes in
+# every web worker. 0 processes them in the request thread after commit.
+RECIPE_IMAGE_WORKERS = int(os.environ.get('RECIPE_IMAGE_WORKERS', 2))
+# Longest side in pixels and JPEG quality of processed images
+RECIPE_IMAGE_MAX_SIZE = int(os.environ.get('RECIPE_IMAGE_MAX_SIZE', 2048))
+RECIPE_IMAGE_QUALITY = int(os.environ.get('RECIPE_IMAGE_QUALITY', 85))
+# Widths of the resized copies made of every image
+RECIPE_IMAGE_THUMBNAIL_WIDTHS = [160, 320, 640]
+# Widths recipe.resize makes on request, any other width is a 404
+RECIPE_IMAGE_RESIZE_WIDTHS = [80, 160, 240, 320, 480, 640, 960, 1280, 1920]
+# Bytes of resized copies kept on disk, the least recently read go first
+RECIPE_IMAGE_CACHE_BYTES = int(os.environ.get('RECIPE_IMAGE_CACHE_BYTES', 1024 ** 3))
+# Seconds between checks of the cache size by a worker that keeps writing copies
+RECIPE_IMAGE_CACHE_SWEEP_INTERVAL = int(os.environ.get('RECIPE_IMAGE_CACHE_SWEEP_INTERVAL', 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -22,6 +22,9 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from core import views as core_views
+from recipe import views as recipe_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     # This is the yaml schema file
@@ -36,7 +39,15 @@ urlpatterns = [
         name='api-docs',
     ),
     path('api/user/', include('user.urls')),
-    path('api/recipe/', include('recipe.urls'))
+    path('api/recipe/', include('recipe.urls')),
+    # Scraped by Prometheus, nginx only lets private networks through
+    path('metrics', core_views.metrics, name='metrics'),
+    # Only cache misses get here, nginx serves existing copies from disk
+    path(
+        f'{settings.MEDIA_URL.lstrip("/")}resized/<uuid:stem>/<int:width>.<str:extension>',
+        recipe_views.resized_image,
+        name='resized-image',
+    ),
 ]
 
 # This is for serving media files during development
@@ -0,0 +1,128 @@
+"""
+Token authentication with cached token lookups.
+
+TokenAuthentication joins Token and User on every request. The result is
+kept in two tiers: a small LRU inside each process and the shared cache,
+so a worker that has not seen a token yet still skips the database.
+
+Only the user id and is_active are cached, never the token or user rows,
+so no password hash ends up in memcached. A hit returns a user with just
+those fields loaded, the others are read from the database on first use.
+
+Entries are stored with the user's auth version (see core.versions), a
+random token replaced whenever the user or one of their tokens is saved
+or deleted (see core.signals), or users are updated in bulk (see
+core.models.UserQuerySet). Every hit is checked against the current
+version, so a deleted token or a deactivated user stops authenticating
+on the next request in every process, not when the entry expires.
+"""
+from collections import OrderedDict
+from typing import Any
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.versions import bump_version, get_version
+
+VERSION_PREFIX = 'auth:version'
+TOKEN_KEY = 'auth:token:{digest}'
+
+
+def get_auth_version(user_id: Any) -> str:
+    """Return the current auth version token of a user."""
+    return get_version(VERSION_PREFIX, user_id)
+
+
+def invalidate_auth(user_id: Any):
+    """Stop every cached token lookup of a user from being used."""
+    bump_version(VERSION_PREFIX, user_id)
+
+
+class LocalCache:
+    """Thread safe LRU of versioned values with a time to live."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        """Return the (version, value) of a key, None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, version, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return version, value
+
+    def set(self, key: str, version: str, value: Any, timeout: float, size: int):
+        """Store a value, dropping the least recently used beyond size entries."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalCache()
+
+
+def cached_credentials(key: str, user_id: Any, is_active: bool):
+    """Return a user and token with only the cached fields loaded."""
+    user = get_user_model().from_db(None, ['id', 'is_active'], [user_id, is_active])
+    token = Token.from_db(None, ['key', 'user_id'], [key, user_id])
+    token.user = user
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that caches who a token belongs to."""
+
+    def authenticate_credentials(self, key: str):
+        """Return the user and token of a key, from the cache when possible."""
+        timeout = settings.TOKEN_AUTH_CACHE_TIMEOUT
+        if timeout <= 0:
+            return super().authenticate_credentials(key)
+
+        # Hashed so keys never show up in the shared cache or its logs
+        cache_key = TOKEN_KEY.format(digest=hashlib.sha256(key.encode()).hexdigest())
+        # Only the version lookup reaches the shared cache on a local hit
+        entry = local_cache.get(cache_key)
+        if entry is None or entry[0] != get_auth_version(entry[1][0]):
+            entry = cache.get(cache_key)
+            if entry is not None and entry[0] == get_auth_version(entry[1][0]):
+                local_cache.set(
+                    cache_key, entry[0], entry[1],
+                    timeout, settings.TOKEN_AUTH_CACHE_SIZE,
+                )
+            else:
+                entry = None
+
+        if entry is not None:
+            user_id, is_active = entry[1]
+            if not is_active:
+                raise exceptions.AuthenticationFailed('User inactive or deleted.')
+            return cached_credentials(key, user_id, is_active)
+
+        # Checks the token exists and the user is active, failures are not cached
+        user, token = super().authenticate_credentials(key)
+        version = get_auth_version(user.id)
+        value = (user.id, user.is_active)
+        cache.set(cache_key, (version, value), timeout)
+        local_cache.set(cache_key, version, value, timeout, settings.TOKEN_AUTH_CACHE_SIZE)
+
+        return user, token
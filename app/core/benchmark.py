@@ -0,0 +1,192 @@
+"""
+Helpers for benchmark commands.
+
+Every benchmark seeds its data with seeded_collection(), inside a
+transaction that is rolled back, and times with measure(), so all of them
+report the same percentiles and query counts.
+"""
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Sequence
+import csv
+import io
+import random
+import statistics
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.models import Recipe, Tag, Ingredient, User
+from recipe.counts import refresh_recipe_counts
+
+
+def _reserve_ids(model: Any, count: int) -> int:
+    """Reserve a block of count ids of a model, returning the first one."""
+    with connection.cursor() as cursor:
+        # setval() moves the sequence past the block in the same statement
+        # that takes its first id, so the rows can be copied with their ids
+        cursor.execute(
+            'SELECT setval(seq, nextval(seq) + %s - 1) - %s + 1 '
+            'FROM pg_get_serial_sequence(%s, %s) AS seq',
+            [count, count, model._meta.db_table, 'id'],
+        )
+        return cursor.fetchone()[0]
+
+
+def copy_rows(model: Any, columns: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """Load rows into a model's table with a single COPY."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        # CSV reads an empty field as NULL unless another NULL marker is set
+        cursor.copy_expert(
+            f'COPY {model._meta.db_table} ({", ".join(columns)}) '
+            f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+
+
+def seed_recipe_collection(
+    user: User,
+    recipes: int,
+    tags: int = 50,
+    ingredients: int = 500,
+    per_recipe: int = 3,
+    batch_size: int = 10_000,
+    seed: int = 42,
+) -> Any:
+    """Create a deterministic recipe collection for a user.
+
+    Rows are loaded with COPY, batch_size recipes and their links at a
+    time, which is fast enough to seed millions of recipes. The search
+    vector trigger still runs for every recipe.
+
+    Returns the ids of the created tags and ingredients.
+    """
+    rng = random.Random(seed)
+    first_tag = _reserve_ids(Tag, tags)
+    tag_ids = list(range(first_tag, first_tag + tags))
+    # Django defaults are not database defaults, recipe_count is set here
+    # and filled in once all links are copied
+    copy_rows(Tag, ['id', 'user_id', 'name', 'recipe_count'], (
+        (pk, user.id, f'Tag {i}', 0) for i, pk in enumerate(tag_ids) # type:ignore
+    ))
+    first_ingredient = _reserve_ids(Ingredient, ingredients)
+    ingredient_ids = list(range(first_ingredient, first_ingredient + ingredients))
+    copy_rows(Ingredient, ['id', 'user_id', 'name', 'recipe_count'], (
+        (pk, user.id, f'Ingredient {i}', 0) for i, pk in enumerate(ingredient_ids) # type:ignore
+    ))
+
+    created = 0
+    while created < recipes:
+        count = min(batch_size, recipes - created)
+        first_recipe = _reserve_ids(Recipe, count)
+        recipe_ids = range(first_recipe, first_recipe + count)
+        copy_rows(
+            Recipe,
+            [
+                'id', 'user_id', 'title', 'description', 'time_minutes', 'price', 'link',
+                'image_status', 'image_thumbnails', 'image_placeholder',
+            ],
+            (
+                (
+                    pk, user.id, f'Recipe {created + i}', '', # type:ignore
+                    rng.randint(5, 120), rng.randint(100, 9999) / 100, '',
+                    '', '{}', '',
+                )
+                for i, pk in enumerate(recipe_ids)
+            ),
+        )
+        copy_rows(Recipe.tags.through, ['recipe_id', 'tag_id'], ( # type:ignore
+            (recipe_id, tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tag_ids, per_recipe)
+        ))
+        copy_rows(Recipe.ingredients.through, ['recipe_id', 'ingredient_id'], ( # type:ignore
+            (recipe_id, ingredient_id)
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(ingredient_ids, per_recipe)
+        ))
+        created += count
+
+    # The links were copied, count them in one pass at the end
+    refresh_recipe_counts(Tag, user=user)
+    refresh_recipe_counts(Ingredient, user=user)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    return tag_ids, ingredient_ids
+
+
+@contextmanager
+def seeded_collection(stdout: Any, email: str, recipes: int, **options: Any):
+    """Seed recipes for a throwaway user, rolling everything back afterwards.
+
+    options are passed on to seed_recipe_collection(). Yields the user and
+    the ids of their tags and ingredients.
+    """
+    # Everything is rolled back, the database is left untouched
+    with transaction.atomic():
+        user = User.objects.create_user(email)
+        stdout.write(f'Seeding {recipes} recipes...')
+        tag_ids, ingredient_ids = seed_recipe_collection(user, recipes=recipes, **options)
+        yield user, tag_ids, ingredient_ids
+        transaction.set_rollback(True)
+
+
+def rolled_back(run: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap a callable writing to the database so every call is undone."""
+    def wrapper():
+        with transaction.atomic():
+            run()
+            transaction.set_rollback(True)
+    return wrapper
+
+
+def build_view(viewset: Any, user: User, params: dict, action: str = 'list'):
+    """Return a viewset instance set up as if serving a GET request."""
+    request = Request(APIRequestFactory().get('/', params))
+    request.user = user
+    return viewset(request=request, action=action, args=(), kwargs={}, format_kwarg=None)
+
+
+def percentile(timings: Sequence[float], percent: float) -> float:
+    """Return the nearest-rank percentile of a list of timings."""
+    ordered = sorted(timings)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def measure(run: Callable[[], Any], runs: int, warmup: int = 1) -> dict:
+    """Time a callable, returning percentiles in ms and queries per run."""
+    for _ in range(warmup):
+        run()
+
+    timings = []
+    queries = []
+    for _ in range(runs):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(ctx.captured_queries))
+
+    return {
+        'p50': round(percentile(timings, 50), 3),
+        'p95': round(percentile(timings, 95), 3),
+        'p99': round(percentile(timings, 99), 3),
+        'mean': round(statistics.mean(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    """Return the report line of a measure() result."""
+    return (
+        f'{name:46} p50 {result["p50"]:9.3f}  p95 {result["p95"]:9.3f}  '
+        f'p99 {result["p99"]:9.3f} ms  {result["queries"]:3} queries'
+    )
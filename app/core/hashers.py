@@ -0,0 +1,25 @@
+"""
+Password hashers with parameters from settings.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2id with the costs set by the PASSWORD_ARGON2_* settings.
+
+    Hashes made with other costs still verify, and must_update() tells
+    Django to rehash them with these costs on the next successful login.
+    """
+
+    @property
+    def time_cost(self): # type:ignore
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self): # type:ignore
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self): # type:ignore
+        return settings.PASSWORD_ARGON2_PARALLELISM
@@ -0,0 +1,331 @@
+"""
+Helpers for the load test command.
+
+Every simulated client is a thread with its own keep-alive connection,
+built on http.client so the runner needs nothing outside the standard
+library. Requests are recorded per endpoint and can be written to a
+request log, one JSON object per line:
+
+    {"offset": 0.013, "user": 0, "method": "GET", "path": "/api/recipe/recipes/"}
+
+offset is the seconds since the start of the run and user the index of
+the load test user sending it. Requests with a body add "body", the JSON
+sent, uploads add "upload": true and get a freshly drawn image on replay.
+"""
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+import http.client
+import io
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from core.benchmark import percentile
+
+TOKEN_URL = '/api/user/token/'
+RECIPES_URL = '/api/recipe/recipes/'
+
+# Default share of each scenario in the traffic mix
+DEFAULT_MIX = {
+    'login': 2,
+    'list': 35,
+    'filter': 20,
+    'detail': 25,
+    'create': 5,
+    'patch': 10,
+    'upload': 3,
+}
+
+# Path segments that are ids, replaced so one endpoint is one row of the report
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def parse_mix(value: str) -> dict:
+    """Parse a mix like list=40,detail=20 into scenario weights."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f'Unknown scenario {name!r}, choose from {", ".join(SCENARIOS)}.')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError(f'Weight of {name} must be a number.')
+
+    if sum(mix.values()) <= 0:
+        raise ValueError('The mix needs at least one positive weight.')
+    return mix
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """Return the endpoint of a request, without query string and ids."""
+    return f'{method} {_ID_SEGMENT.sub("/{id}", urlsplit(path).path)}'
+
+
+def image_bytes(rng: random.Random) -> bytes:
+    """Return a small JPEG, a different colour every call."""
+    buffer = io.BytesIO()
+    colour = tuple(rng.randrange(256) for _ in range(3))
+    Image.new('RGB', (64, 64), colour).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def multipart(field: str, filename: str, content: bytes):
+    """Return the body and content type of a single file upload."""
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: image/jpeg\r\n\r\n',
+        content,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Stats:
+    """Latencies and errors per endpoint, shared by every client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings: dict = {}
+        self.errors: dict = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, endpoint: str, status: int, seconds: float):
+        """Record one response, status 0 when the request itself failed."""
+        with self._lock:
+            self.timings.setdefault(endpoint, []).append(seconds * 1000)
+            self.errors.setdefault(endpoint, 0)
+            if not 200 <= status < 400:
+                self.errors[endpoint] += 1
+
+    def summary(self) -> dict:
+        """Return requests, errors, throughput and latency per endpoint."""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        results = {}
+        every = []
+        for endpoint in sorted(self.timings):
+            timings = self.timings[endpoint]
+            every.extend(timings)
+            results[endpoint] = self._summarize(timings, self.errors[endpoint], elapsed)
+        if every:
+            results['total'] = self._summarize(every, sum(self.errors.values()), elapsed)
+        return results
+
+    def _summarize(self, timings: list, errors: int, elapsed: float) -> dict:
+        return {
+            'requests': len(timings),
+            'errors': errors,
+            'rps': round(len(timings) / elapsed, 2) if elapsed else 0,
+            'p50': round(percentile(timings, 50), 3),
+            'p95': round(percentile(timings, 95), 3),
+            'p99': round(percentile(timings, 99), 3),
+        }
+
+
+class LoadClient:
+    """One simulated user with its own keep-alive connection."""
+
+    def __init__(
+        self,
+        base_url: str,
+        stats: Stats,
+        user: dict,
+        rng: random.Random,
+        record: Optional[Callable[[dict], None]] = None,
+    ):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.stats = stats
+        self.user = user
+        self.rng = rng
+        self.record = record
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def close(self):
+        self.connection.close()
+
+    def request(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        body: Any = None,
+        upload: bool = False,
+        auth: bool = True,
+    ):
+        """Send a request and record its latency, returning status and JSON."""
+        headers = {'Accept': 'application/json'}
+        if auth:
+            headers['Authorization'] = f'Token {self.user["token"]}'
+        if upload:
+            payload, headers['Content-Type'] = multipart(
+                'image', 'load-test.jpg', image_bytes(self.rng),
+            )
+        elif body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        else:
+            payload = None
+
+        if self.record:
+            entry = {
+                'offset': round(time.perf_counter() - self.stats.started, 4),
+                'user': self.user['index'],
+                'method': method,
+                'path': path,
+            }
+            if body is not None:
+                entry['body'] = body
+            if upload:
+                entry['upload'] = True
+            self.record(entry)
+
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, socket.timeout, http.client.HTTPException):
+            # The next request opens a new connection
+            self.connection.close()
+            self.stats.record(endpoint, 0, time.perf_counter() - start)
+            return 0, None
+
+        self.stats.record(endpoint, status, time.perf_counter() - start)
+        try:
+            data = json.loads(content) if content else None
+        except ValueError:
+            data = None
+        return status, data
+
+    def recipe_id(self) -> int:
+        """Return the id of a random recipe owned by this client's user."""
+        return self.rng.choice(self.user['recipe_ids'])
+
+
+def login(client: LoadClient):
+    client.request(
+        'login', 'POST', TOKEN_URL,
+        {'email': client.user['email'], 'password': client.user['password']},
+        auth=False,
+    )
+
+
+def list_recipes(client: LoadClient):
+    client.request('list', 'GET', RECIPES_URL)
+
+
+def filter_recipes(client: LoadClient):
+    tags = client.rng.sample(client.user['tag_ids'], min(2, len(client.user['tag_ids'])))
+    client.request('filter', 'GET', f'{RECIPES_URL}?tags={",".join(map(str, tags))}')
+
+
+def recipe_detail(client: LoadClient):
+    client.request('detail', 'GET', f'{RECIPES_URL}{client.recipe_id()}/')
+
+
+def create_recipe(client: LoadClient):
+    status, data = client.request('create', 'POST', RECIPES_URL, {
+        'title': f'Load test recipe {client.rng.randrange(10_000)}',
+        'time_minutes': client.rng.randint(5, 120),
+        'price': '5.00',
+        'tags': [{'name': f'Tag {client.rng.randrange(50)}'}],
+        'ingredients': [{'name': f'Ingredient {client.rng.randrange(500)}'}],
+    })
+    if status == 201 and data:
+        # Patched and uploaded to by every client of the user from now on
+        client.user['recipe_ids'].append(data['id'])
+
+
+def patch_recipe(client: LoadClient):
+    client.request('patch', 'PATCH', f'{RECIPES_URL}{client.recipe_id()}/', {
+        'time_minutes': client.rng.randint(5, 120),
+        'tags': [{'name': f'Tag {client.rng.randrange(50)}'}],
+    })
+
+
+def upload_image(client: LoadClient):
+    client.request(
+        'upload', 'POST', f'{RECIPES_URL}{client.recipe_id()}/upload-image/', upload=True,
+    )
+
+
+SCENARIOS = {
+    'login': login,
+    'list': list_recipes,
+    'filter': filter_recipes,
+    'detail': recipe_detail,
+    'create': create_recipe,
+    'patch': patch_recipe,
+    'upload': upload_image,
+}
+
+
+def run_mix(client: LoadClient, mix: dict, deadline: float, budget: Any):
+    """Send requests drawn from the mix until the deadline or budget is spent."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < deadline and budget.take():
+        SCENARIOS[client.rng.choices(names, weights)[0]](client)
+
+
+def run_replay(client: LoadClient, entries: Any, users: list, speed: float):
+    """Send logged requests at the offsets they were recorded at."""
+    for entry in entries:
+        wait = client.stats.started + entry['offset'] / speed - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        # Logged users map onto the load test users in turn
+        client.user = users[entry.get('user', 0) % len(users)]
+        client.request(
+            endpoint_name(entry['method'], entry['path']),
+            entry['method'],
+            entry['path'],
+            entry.get('body'),
+            upload=entry.get('upload', False),
+            auth=entry['path'] != TOKEN_URL,
+        )
+
+
+class Budget:
+    """Requests left to send by all clients, None for no limit."""
+
+    def __init__(self, total: Optional[int]):
+        self._lock = threading.Lock()
+        self.left = total
+
+    def take(self) -> bool:
+        if self.left is None:
+            return True
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+class ReplayQueue:
+    """Hand out logged requests in order to whichever client is free."""
+
+    def __init__(self, entries: list):
+        self._lock = threading.Lock()
+        self._entries = iter(sorted(entries, key=lambda entry: entry['offset']))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._entries)
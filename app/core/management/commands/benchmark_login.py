@@ -0,0 +1,90 @@
+"""
+Django command to compare login throughput of password hashers.
+"""
+from typing import Any
+import itertools
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from core.benchmark import measure
+from core.models import User
+from user.views import CreateTokenView
+
+PBKDF2 = 'django.contrib.auth.hashers.PBKDF2PasswordHasher'
+PASSWORD = 'benchmark-pass-123'
+
+
+class Command(BaseCommand):
+    """Django command to time the token endpoint with each hasher setup."""
+    help = (
+        'Create throwaway users inside a transaction and time logins through '
+        'the token endpoint with PBKDF2 (the Django default), with the '
+        'configured PASSWORD_HASHERS, and for users whose PBKDF2 hash is '
+        'rehashed on that login, then roll back. One process logs in at a '
+        'time, so logins/s is the throughput of a single worker.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--runs', type=int, default=50)
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        runs = options['runs']
+        configured = settings.PASSWORD_HASHERS
+        pbkdf2_first = [PBKDF2] + [hasher for hasher in configured if hasher != PBKDF2]
+        self.stdout.write(f'Configured hasher: {configured[0]}')
+
+        # Everything is rolled back, the database is left untouched
+        with transaction.atomic():
+            results = {}
+            with override_settings(PASSWORD_HASHERS=pbkdf2_first):
+                results['pbkdf2'] = self._time_logins(self._users('pbkdf2', 1), runs)
+            results['configured'] = self._time_logins(self._users('configured', 1), runs)
+            # A user's hash is only rehashed once, every login needs a new user
+            with override_settings(PASSWORD_HASHERS=pbkdf2_first):
+                stale = self._users('rehash', runs + 1)
+            results['rehash on login'] = self._time_logins(stale, runs)
+            transaction.set_rollback(True)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:16} {1000 / result["mean"]:8.1f} logins/s  '
+                f'p50 {result["p50"]:8.1f}  p95 {result["p95"]:8.1f}  '
+                f'p99 {result["p99"]:8.1f} ms  {result["queries"]} queries'
+            )
+        self.stdout.write(
+            f'Configured vs PBKDF2: '
+            f'{results["pbkdf2"]["mean"] / results["configured"]["mean"]:.1f}x logins/s'
+        )
+
+    def _users(self, name: str, count: int) -> list:
+        """Create users sharing one password hashed by the first hasher."""
+        # Hashed once, hashing per user would take longer than the benchmark
+        password = make_password(PASSWORD)
+        return User.objects.bulk_create([
+            User(email=f'benchmark-login-{name}-{index}@example.com', password=password)
+            for index in range(count)
+        ])
+
+    def _time_logins(self, users: list, runs: int) -> dict:
+        """Time POSTs to the token endpoint, cycling through the users."""
+        view = CreateTokenView.as_view()
+        factory = APIRequestFactory()
+        # measure() logs in once more to warm up
+        remaining = itertools.cycle(users)
+
+        def login():
+            user = next(remaining)
+            request = factory.post(
+                '/api/user/token/', {'email': user.email, 'password': PASSWORD},
+            )
+            response = view(request)
+            if response.status_code != 200:
+                raise CommandError(f'Login failed: {response.data}')
+
+        return measure(login, runs)
@@ -0,0 +1,86 @@
+"""
+Django command to compare recipe filter query plans on a large data set.
+"""
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from core.benchmark import format_result, measure, seeded_collection
+from core.models import Recipe, User
+from recipe.filters import filter_by_related, MATCH_ANY, MATCH_ALL
+
+
+class Command(BaseCommand):
+    """Django command to benchmark JOIN + DISTINCT against EXISTS filters."""
+    help = (
+        'Seed recipes for a throwaway user inside a transaction, time the '
+        'legacy and EXISTS based tag/ingredient filters, then roll back.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--recipes', type=int, default=1_000_000)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--per-recipe', type=int, default=3)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--explain',
+            action='store_true',
+            help='Print EXPLAIN ANALYZE output for every plan.',
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        with seeded_collection(
+            self.stdout,
+            'benchmark-filters@example.com',
+            recipes=options['recipes'],
+            tags=options['tags'],
+            ingredients=options['ingredients'],
+            per_recipe=options['per_recipe'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+        ) as (user, tag_ids, ingredient_ids):
+            self._run(user, tag_ids, ingredient_ids, options)
+
+    def _legacy(self, user: User, tag_ids: list, ingredient_ids: list):
+        """Queryset as built before the EXISTS filters."""
+        return Recipe.objects.filter(
+            tags__id__in=tag_ids,
+        ).filter(
+            ingredients__id__in=ingredient_ids,
+        ).filter(user=user).distinct().order_by('-id')
+
+    def _exists(self, user: User, tag_ids: list, ingredient_ids: list, match: str):
+        """Queryset as built by RecipeViewSet.get_queryset."""
+        queryset = filter_by_related(
+            Recipe.objects.all(), Recipe.tags.through, 'tag_id', tag_ids, match,
+        )
+        queryset = filter_by_related(
+            queryset,
+            Recipe.ingredients.through,
+            'ingredient_id',
+            ingredient_ids,
+            match,
+        )
+        return queryset.filter(user=user).order_by('-id')
+
+    def _run(self, user: User, tag_ids: list, ingredient_ids: list, options: Any):
+        """Time the first page of every plan and print a comparison."""
+        tags = tag_ids[:3]
+        ingredients = ingredient_ids[:3]
+        plans = [
+            ('legacy JOIN + DISTINCT (any)', self._legacy(user, tags, ingredients)),
+            ('EXISTS (any)', self._exists(user, tags, ingredients, MATCH_ANY)),
+            # Same ids as the any plans, with one id all would equal any
+            ('EXISTS (all)', self._exists(user, tags, ingredients, MATCH_ALL)),
+        ]
+
+        for name, queryset in plans:
+            # A fresh slice per run, a sliced queryset caches its rows
+            result = measure(lambda: list(queryset[:51]), options['runs'])
+            self.stdout.write(format_result(name, result))
+            if options['explain']:
+                self.stdout.write(queryset[:51].explain(analyze=True, buffers=True))
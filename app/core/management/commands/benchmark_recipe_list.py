@@ -0,0 +1,78 @@
+"""
+Django command to compare recipe list serialization paths.
+"""
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from core.benchmark import format_result, measure, seeded_collection
+from core.models import Recipe, Tag, Ingredient, User
+from recipe.serializers import RecipeSerializer, RecipeRowSerializer
+
+
+class Command(BaseCommand):
+    """Django command to benchmark RecipeSerializer against RecipeRowSerializer."""
+    help = (
+        'Seed recipes for a throwaway user inside a transaction, time listing '
+        'them with both serializers, check the JSON is identical, then roll back.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--recipes', type=int, default=10_000)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        with seeded_collection(
+            self.stdout,
+            'benchmark-list@example.com',
+            recipes=options['recipes'],
+            seed=options['seed'],
+        ) as (user, _, _):
+            self._run(user, options)
+
+    def _serializer_data(self, user: User):
+        """List recipes the way RecipeViewSet did before the row path."""
+        queryset = Recipe.objects.defer('search_vector').filter(
+            user=user,
+        ).order_by('-id').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch('ingredients', queryset=Ingredient.objects.order_by('id')),
+        )
+        return RecipeSerializer(queryset, many=True).data
+
+    def _row_data(self, user: User):
+        """List recipes the way RecipeViewSet.list does."""
+        fields = RecipeSerializer.Meta.fields
+        queryset = Recipe.objects.filter(user=user).order_by('-id').values(
+            'id', *RecipeRowSerializer.columns(fields),
+        )
+        return RecipeRowSerializer(queryset, fields).data
+
+    def _run(self, user: User, options: Any):
+        """Time both paths and print a comparison."""
+        renderer = JSONRenderer()
+        identical = (
+            renderer.render(self._serializer_data(user))
+            == renderer.render(self._row_data(user))
+        )
+        self.stdout.write(f'Identical JSON: {"yes" if identical else "NO"}')
+
+        rows = options['recipes']
+        # Checking the JSON above already warmed both paths up
+        results = {
+            'RecipeSerializer': measure(
+                lambda: self._serializer_data(user), options['runs'], warmup=0,
+            ),
+            'RecipeRowSerializer': measure(
+                lambda: self._row_data(user), options['runs'], warmup=0,
+            ),
+        }
+        for name, result in results.items():
+            self.stdout.write(format_result(name, result))
+            self.stdout.write(f'{name:46} {rows / result["p50"] * 1000:9.0f} rows/s')
+        speedup = results['RecipeSerializer']['p50'] / results['RecipeRowSerializer']['p50']
+        self.stdout.write(f'{"Speedup":46} {speedup:9.1f}x')
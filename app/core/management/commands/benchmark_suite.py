@@ -0,0 +1,209 @@
+"""
+Django command to benchmark the recipe API hot paths.
+"""
+from typing import Any
+import datetime
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import (
+    build_view,
+    format_result,
+    measure,
+    rolled_back,
+    seeded_collection,
+)
+from core.models import Recipe, User
+from recipe import serializers
+from recipe.views import RecipeViewSet, TagViewSet, IngredientViewSet
+
+# Recipes on one page of the list endpoint
+PAGE_SIZE = 50
+
+
+def current_commit() -> Any:
+    """Return the checked out git commit, None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    """Django command to time querysets and serializers of the recipe API."""
+    help = (
+        'Seed recipes for a throwaway user inside a transaction, time recipe '
+        'filtering, create, update and list serialization and tag and '
+        'ingredient listing, then roll back. Reports p50/p95/p99 in ms and '
+        'queries per run, and can save the results as a JSON baseline or '
+        'compare them against one.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--save', metavar='PATH', help='Write the results to a JSON file.')
+        parser.add_argument(
+            '--compare',
+            metavar='PATH',
+            help='Fail if p50 or the query count regressed against a saved baseline.',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=20,
+            help='Percent p50 may grow over the baseline before it counts as a regression.',
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        # Read first, a missing baseline should not cost a full run
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Cannot read baseline: {error}')
+
+        with seeded_collection(
+            self.stdout,
+            'benchmark-suite@example.com',
+            recipes=options['recipes'],
+            tags=options['tags'],
+            ingredients=options['ingredients'],
+            seed=options['seed'],
+        ) as (user, tag_ids, ingredient_ids):
+            results = {}
+            for name, run in self._cases(user, tag_ids, ingredient_ids):
+                results[name] = measure(run, options['runs'])
+                self.stdout.write(format_result(name, results[name]))
+
+        report = {
+            'meta': {
+                'recipes': options['recipes'],
+                'tags': options['tags'],
+                'ingredients': options['ingredients'],
+                'runs': options['runs'],
+                'seed': options['seed'],
+                'commit': current_commit(),
+                'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            },
+            'results': results,
+        }
+        if options['save']:
+            with open(options['save'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write(f'Saved results to {options["save"]}')
+
+        if baseline is not None:
+            regressions = self._compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError(f'{regressions} benchmarks regressed.')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def _cases(self, user: User, tag_ids: list, ingredient_ids: list):
+        """Return (name, callable) of every benchmark."""
+        tags = ','.join(str(pk) for pk in tag_ids[:3])
+        ingredients = ','.join(str(pk) for pk in ingredient_ids[:3])
+
+        def filtered(params: dict):
+            # One page, the way the paginator slices the queryset
+            def run():
+                view = build_view(RecipeViewSet, user, params)
+                return list(view.get_queryset()[:PAGE_SIZE + 1])
+            return run
+
+        def listed(viewset: Any, params: dict):
+            def run():
+                view = build_view(viewset, user, params)
+                return view.get_serializer(view.get_queryset(), many=True).data
+            return run
+
+        # Loaded once, the serializer benchmarks time serialization only
+        fields = serializers.RecipeSerializer.Meta.fields
+        page = list(build_view(RecipeViewSet, user, {}).get_queryset()[:PAGE_SIZE])
+        rows = list(Recipe.objects.filter(
+            id__in=[recipe.id for recipe in page],
+        ).order_by('-id').values('id', *serializers.RecipeRowSerializer.columns(fields)))
+        payload = {
+            'title': 'Benchmark recipe',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [{'name': 'Tag 0'}, {'name': 'Tag 1'}, {'name': 'New tag'}],
+            'ingredients': [{'name': 'Ingredient 0'}, {'name': 'New ingredient'}],
+        }
+
+        def create():
+            view = build_view(RecipeViewSet, user, {}, action='create')
+            serializer = serializers.RecipeDetailSerializer(
+                data=payload, context=view.get_serializer_context(),
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save(user=user)
+
+        def update():
+            view = build_view(RecipeViewSet, user, {}, action='update')
+            recipe = view.get_queryset().get(id=page[0].id)
+            serializer = serializers.RecipeDetailSerializer(
+                recipe, data=payload, context=view.get_serializer_context(),
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        return [
+            ('recipes queryset', filtered({})),
+            ('recipes queryset by tags', filtered({'tags': tags})),
+            (
+                'recipes queryset by all tags and ingredients',
+                filtered({'tags': tags, 'ingredients': ingredients, 'match': 'all'}),
+            ),
+            ('recipes queryset search', filtered({'search': 'recipe 1'})),
+            ('recipe create', rolled_back(create)),
+            ('recipe update', rolled_back(update)),
+            (
+                'recipe page RecipeSerializer',
+                lambda: serializers.RecipeSerializer(page, many=True).data,
+            ),
+            (
+                'recipe page RecipeRowSerializer',
+                lambda: serializers.RecipeRowSerializer(rows, fields).data,
+            ),
+            ('tags list', listed(TagViewSet, {})),
+            ('tags assigned only', listed(TagViewSet, {'assigned_only': '1'})),
+            ('tags typeahead', listed(TagViewSet, {'q': 'tag 1'})),
+            ('ingredients list', listed(IngredientViewSet, {})),
+            ('ingredients assigned only', listed(IngredientViewSet, {'assigned_only': '1'})),
+            ('ingredients typeahead', listed(IngredientViewSet, {'q': 'ingredient 1'})),
+        ]
+
+    def _compare(self, results: dict, baseline: dict, tolerance: float) -> int:
+        """Print the change against a baseline, returning the regressions."""
+        self.stdout.write(f'Compared with {baseline["meta"].get("commit") or "baseline"}:')
+        regressions = 0
+        for name, result in results.items():
+            before = baseline['results'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:46} new')
+                continue
+
+            change = (result['p50'] - before['p50']) / before['p50'] * 100 if before['p50'] else 0
+            regressed = change > tolerance or result['queries'] > before['queries']
+            line = (
+                f'{name:46} p50 {change:+7.1f}%  queries '
+                f'{before["queries"]} -> {result["queries"]}'
+            )
+            if regressed:
+                regressions += 1
+                line = self.style.ERROR(f'{line}  REGRESSED')
+            self.stdout.write(line)
+
+        return regressions
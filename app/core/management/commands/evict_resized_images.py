@@ -0,0 +1,30 @@
+"""
+Django command to trim the resized recipe image cache.
+"""
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipe.resize import evict
+
+
+class Command(BaseCommand):
+    """Django command to delete the least recently read resized images."""
+    help = (
+        'Delete the least recently read resized recipe images until the cache '
+        'is under --budget bytes (RECIPE_IMAGE_CACHE_BYTES by default). Web '
+        'workers also do this as they write copies, this is for cron or '
+        'after lowering the budget.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--budget', type=int, default=None)
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        budget = options['budget']
+        if budget is None:
+            budget = settings.RECIPE_IMAGE_CACHE_BYTES
+        deleted = evict(budget)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} resized images.'))
@@ -0,0 +1,248 @@
+"""
+Django command to load test the API over HTTP.
+"""
+from typing import Any
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from core import loadtest
+from core.benchmark import seed_recipe_collection
+from core.models import Recipe, Tag, User
+
+EMAIL = 'loadtest-{}@example.com'
+PASSWORD = 'loadtest-pass-123'
+
+
+class Command(BaseCommand):
+    """Django command to drive concurrent clients against a running API."""
+    help = (
+        'Seed load test users, start the API with runserver or uwsgi (or use '
+        'a running one with --url), send a weighted mix of requests from '
+        'concurrent clients or replay a request log, and report latency '
+        'percentiles, throughput and errors per endpoint. The users and '
+        'their data are deleted afterwards unless --keep-data is given.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--url', help='Base URL of a running API, none starts one.')
+        parser.add_argument('--server', choices=['runserver', 'uwsgi'], default='uwsgi')
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--workers', type=int, default=4, help='uwsgi workers.')
+        parser.add_argument('--clients', type=int, default=10)
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run.')
+        parser.add_argument('--requests', type=int, help='Stop after this many requests.')
+        parser.add_argument(
+            '--mix',
+            type=loadtest.parse_mix,
+            default=loadtest.DEFAULT_MIX,
+            help=(
+                'Scenario weights, e.g. list=40,detail=20. Scenarios: '
+                f'{", ".join(loadtest.SCENARIOS)}.'
+            ),
+        )
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--recipes', type=int, default=1000, help='Recipes per user.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--record', metavar='PATH', help='Write the requests sent to a log.')
+        parser.add_argument(
+            '--replay',
+            metavar='PATH',
+            help='Send the requests of a log instead of the mix.',
+        )
+        parser.add_argument(
+            '--speed',
+            type=float,
+            default=1,
+            help='Replay this many times faster than recorded, 0 sends as fast as possible.',
+        )
+        parser.add_argument('--save', metavar='PATH', help='Write the results to a JSON file.')
+        parser.add_argument(
+            '--keep-data',
+            action='store_true',
+            help='Keep the load test users, later runs reuse them instead of seeding.',
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        entries = None
+        if options['replay']:
+            try:
+                with open(options['replay']) as log:
+                    entries = [json.loads(line) for line in log if line.strip()]
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Cannot read request log: {error}')
+
+        users = self._seed(options)
+        server = None
+        try:
+            url = options['url']
+            if not url:
+                server = self._start_server(options)
+                url = f'http://127.0.0.1:{options["port"]}'
+            stats = self._run(url, users, entries, options)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+            if not options['keep_data']:
+                self._cleanup(options['users'])
+
+        results = stats.summary()
+        self._report(results)
+        if options['save']:
+            meta = {
+                key: options[key]
+                for key in ('clients', 'duration', 'requests', 'mix', 'users', 'recipes', 'replay')
+            }
+            meta['server'] = options['url'] or options['server']
+            with open(options['save'], 'w') as report_file:
+                json.dump({'meta': meta, 'results': results}, report_file, indent=2)
+            self.stdout.write(f'Saved results to {options["save"]}')
+
+    def _seed(self, options: Any) -> list:
+        """Create the load test users with their recipes and tokens.
+
+        Users kept by an earlier run with --keep-data are used as they are,
+        so a log recorded against them replays with the same recipe ids.
+        """
+        users = []
+        self.stdout.write(
+            f'Seeding {options["users"]} users with {options["recipes"]} recipes each...'
+        )
+        for index in range(options['users']):
+            user = User.objects.filter(email=EMAIL.format(index)).first()
+            if user is None:
+                # Committed per user, the server reads them from its own connections
+                with transaction.atomic():
+                    user = User.objects.create_user(EMAIL.format(index), PASSWORD)
+                    seed_recipe_collection(
+                        user, recipes=options['recipes'], seed=options['seed'] + index,
+                    )
+            users.append({
+                'index': index,
+                'email': user.email,
+                'password': PASSWORD,
+                'token': Token.objects.get_or_create(user=user)[0].key,
+                'tag_ids': list(Tag.objects.filter(user=user).values_list('id', flat=True)),
+                'recipe_ids': list(Recipe.objects.filter(user=user).values_list('id', flat=True)),
+            })
+
+        return users
+
+    def _cleanup(self, count: int):
+        """Delete the load test users, their recipes and uploaded images."""
+        emails = [EMAIL.format(index) for index in range(count)]
+        for recipe in Recipe.objects.filter(user__email__in=emails).exclude(image=''):
+            recipe.image.delete(save=False)
+        User.objects.filter(email__in=emails).delete()
+
+    def _start_server(self, options: Any):
+        """Start the API in a child process and wait until it accepts connections."""
+        address = f'127.0.0.1:{options["port"]}'
+        if options['server'] == 'uwsgi':
+            # As scripts/run.sh starts it, serving HTTP instead of the uwsgi protocol
+            command = [
+                'uwsgi', '--http', address, '--workers', str(options['workers']),
+                '--master', '--enable-threads', '--module', 'app.wsgi',
+                '--die-on-term', '--disable-logging',
+            ]
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', '--noreload', address]
+
+        self.stdout.write(f'Starting {options["server"]} on {address}...')
+        try:
+            server = subprocess.Popen(
+                command,
+                cwd=settings.BASE_DIR,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as error:
+            raise CommandError(f'Cannot start {options["server"]}: {error}')
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'{options["server"]} exited with {server.returncode}.')
+            try:
+                socket.create_connection(('127.0.0.1', options['port']), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+
+        server.terminate()
+        raise CommandError(f'{options["server"]} did not start within 30 seconds.')
+
+    def _run(self, url: str, users: list, entries: Any, options: Any):
+        """Run every client in its own thread until the traffic is sent."""
+        stats = loadtest.Stats()
+        log = None
+        record = None
+        if options['record']:
+            log = open(options['record'], 'w')
+            lock = threading.Lock()
+
+            def record(entry: dict):
+                with lock:
+                    log.write(json.dumps(entry) + '\n') # type:ignore
+
+        clients = [
+            loadtest.LoadClient(
+                url, stats, users[index % len(users)],
+                random.Random(options['seed'] + index), record,
+            )
+            for index in range(options['clients'])
+        ]
+        if entries is not None:
+            queue = loadtest.ReplayQueue(entries)
+            speed = options['speed'] or float('inf')
+            self.stdout.write(f'Replaying {len(entries)} requests with {len(clients)} clients...')
+            targets = [
+                (loadtest.run_replay, (client, queue, users, speed)) for client in clients
+            ]
+        else:
+            budget = loadtest.Budget(options['requests'])
+            deadline = time.perf_counter() + options['duration']
+            self.stdout.write(f'Running {len(clients)} clients...')
+            targets = [
+                (loadtest.run_mix, (client, options['mix'], deadline, budget))
+                for client in clients
+            ]
+
+        threads = [threading.Thread(target=target, args=args) for target, args in targets]
+        stats.started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats.finished = time.perf_counter()
+
+        for client in clients:
+            client.close()
+        if log:
+            log.close()
+        return stats
+
+    def _report(self, results: dict):
+        """Print the results per endpoint."""
+        self.stdout.write(
+            f'{"endpoint":44} {"requests":>8} {"errors":>6} {"req/s":>8} '
+            f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}'
+        )
+        for endpoint, result in results.items():
+            line = (
+                f'{endpoint:44} {result["requests"]:8} {result["errors"]:6} '
+                f'{result["rps"]:8.1f} {result["p50"]:9.1f} {result["p95"]:9.1f} '
+                f'{result["p99"]:9.1f}'
+            )
+            self.stdout.write(self.style.ERROR(line) if result['errors'] else line)
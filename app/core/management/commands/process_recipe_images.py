@@ -0,0 +1,32 @@
+"""
+Django command to process recipe images that are not processed yet.
+"""
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe, IMAGE_FAILED, IMAGE_PENDING
+from recipe.images import process_now
+
+
+class Command(BaseCommand):
+    """Django command to process pending recipe images in this process."""
+    help = (
+        'Process recipe images still pending, e.g. uploaded before images '
+        'were processed or left over by a worker that stopped. --failed '
+        'retries failed images as well.'
+    )
+
+    def add_arguments(self, parser: Any):
+        parser.add_argument('--failed', action='store_true')
+
+    def handle(self, *args: Any, **options: Any):
+        """Entrypoint for command."""
+        statuses = [IMAGE_PENDING, IMAGE_FAILED] if options['failed'] else [IMAGE_PENDING]
+        recipes = Recipe.objects.filter(image_status__in=statuses).values_list('id', 'image')
+        count = 0
+        for recipe_id, name in recipes.iterator():
+            process_now(recipe_id, name)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {count} images.'))
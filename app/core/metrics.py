@@ -0,0 +1,189 @@
+"""
+Prometheus metrics of the API.
+
+uwsgi runs several worker processes, each with its own copy of these
+metrics. When PROMETHEUS_MULTIPROC_DIR is set, prometheus_client writes
+every worker's values to memory mapped files in that directory and the
+metrics view adds them up, so any worker can answer a scrape for all.
+"""
+from contextlib import contextmanager
+from typing import Any, Optional
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily
+
+from recipe.cache import cache_stats
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (
+    256, 1024, 4096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304,
+)
+
+REQUESTS = Counter(
+    'api_requests',
+    'Requests served, by route, method and status code.',
+    ['route', 'method', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds',
+    'Time spent serving a request.',
+    ['route', 'method'],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'api_db_queries',
+    'Database queries run per request.',
+    ['route'],
+    buckets=QUERY_BUCKETS,
+)
+DB_LATENCY = Histogram(
+    'api_db_duration_seconds',
+    'Time spent in database queries per request.',
+    ['route'],
+    buckets=LATENCY_BUCKETS,
+)
+SERIALIZER_LATENCY = Histogram(
+    'api_serializer_duration_seconds',
+    'Time spent turning objects into response data per request.',
+    ['route'],
+    buckets=LATENCY_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    'api_response_bytes',
+    'Size of response bodies.',
+    ['route'],
+    buckets=BYTES_BUCKETS,
+)
+
+_state = threading.local()
+
+
+class RequestStats:
+    """Database and serializer work done while serving one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self._serializer_depth = 0
+
+    def __call__(self, execute: Any, sql: str, params: Any, many: bool, context: Any):
+        """Time a query, used as a connection execute wrapper."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - start
+
+
+def current_stats() -> Optional[RequestStats]:
+    """Return the stats of the request being served by this thread."""
+    return getattr(_state, 'stats', None)
+
+
+@contextmanager
+def collect_stats(stats: RequestStats):
+    """Make stats the current request stats of this thread."""
+    previous = current_stats()
+    _state.stats = stats
+    try:
+        yield stats
+    finally:
+        _state.stats = previous
+
+
+@contextmanager
+def serializer_timer():
+    """Add the time spent in the block to the current request stats."""
+    stats = current_stats()
+    # Nested serializers run inside their parent, only the outermost counts
+    if stats is None or stats._serializer_depth:
+        yield
+        return
+
+    stats._serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_seconds += time.perf_counter() - start
+        stats._serializer_depth -= 1
+
+
+class TimedSerializerMixin:
+    """Serializer whose representation time is recorded in the metrics."""
+
+    def to_representation(self, instance: Any):
+        with serializer_timer():
+            return super().to_representation(instance) # type:ignore
+
+
+def observe_request(
+    route: str,
+    method: str,
+    status: int,
+    seconds: float,
+    stats: RequestStats,
+):
+    """Record a served request."""
+    REQUESTS.labels(route, method, status).inc()
+    REQUEST_LATENCY.labels(route, method).observe(seconds)
+    DB_QUERIES.labels(route).observe(stats.queries)
+    DB_LATENCY.labels(route).observe(stats.db_seconds)
+    SERIALIZER_LATENCY.labels(route).observe(stats.serializer_seconds)
+
+
+def observe_response_bytes(route: str, size: int):
+    """Record the size of a response body."""
+    RESPONSE_BYTES.labels(route).observe(size)
+
+
+class ResponseCacheCollector:
+    """Expose the recipe response cache counters, shared by all workers."""
+
+    def collect(self):
+        stats = cache_stats()
+        hits = CounterMetricFamily(
+            'api_response_cache_hits', 'Recipe API responses served from the cache.',
+        )
+        hits.add_metric([], stats['hits'])
+        misses = CounterMetricFamily(
+            'api_response_cache_misses', 'Recipe API responses built on a cache miss.',
+        )
+        misses.add_metric([], stats['misses'])
+        return [hits, misses]
+
+
+# Read from the shared cache on scrape, never aggregated per process
+CACHE_REGISTRY = CollectorRegistry()
+CACHE_REGISTRY.register(ResponseCacheCollector())
+
+
+def multiprocess_dir() -> Optional[str]:
+    """Return the directory shared by the worker processes, if any."""
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def render_metrics() -> bytes:
+    """Return all metrics in the Prometheus text format."""
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry) + generate_latest(CACHE_REGISTRY)
@@ -0,0 +1,86 @@
+"""
+Middleware for the API.
+"""
+from typing import Any, Callable
+import time
+
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+from core import metrics
+from core.slow_queries import SlowQueryLogger
+
+
+def route_name(request: HttpRequest, view_func: Any) -> str:
+    """Return a low cardinality name for the view serving a request.
+
+    DRF viewsets are named ViewSet.action, e.g. RecipeViewSet.list, other
+    DRF views by class and plain Django views by URL name.
+    """
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        match = request.resolver_match
+        return (match.view_name if match else None) or view_func.__name__
+
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower()) # type:ignore
+    return f'{view_class.__name__}.{action}' if action else view_class.__name__
+
+
+class MetricsMiddleware:
+    """Record latency, database work and response size of every request."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        start = time.perf_counter()
+        stats = metrics.RequestStats()
+        # Unresolved URLs never reach process_view
+        request.route_name = 'unmatched' # type:ignore
+        with metrics.collect_stats(stats), connection.execute_wrapper(stats):
+            response = self.get_response(request)
+
+        route = request.route_name # type:ignore
+        metrics.observe_request(
+            route,
+            request.method, # type:ignore
+            response.status_code,
+            time.perf_counter() - start,
+            stats,
+        )
+        if response.streaming:
+            # Streamed bodies are only known once the last chunk is sent
+            response.streaming_content = self._count_bytes(
+                route, response.streaming_content, # type:ignore
+            )
+        else:
+            metrics.observe_response_bytes(route, len(response.content))
+
+        return response
+
+    def process_view(self, request: HttpRequest, view_func: Any, *args: Any):
+        request.route_name = route_name(request, view_func) # type:ignore
+
+    def _count_bytes(self, route: str, content: Any):
+        """Pass a streamed body through, recording its size at the end."""
+        size = 0
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+        metrics.observe_response_bytes(route, size)
+
+
+class SlowQueryMiddleware:
+    """Log the slow database queries of every request."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with connection.execute_wrapper(SlowQueryLogger(request)):
+            return self.get_response(request)
+
+    def process_view(self, request: HttpRequest, view_func: Any, *args: Any):
+        # Also set by MetricsMiddleware, kept so either works on its own
+        request.route_name = route_name(request, view_func) # type:ignore
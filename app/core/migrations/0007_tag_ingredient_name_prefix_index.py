@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Prefix indexes for tag and ingredient typeahead.
+
+    Django 3.2 cannot declare an operator class on an expression index, so
+    these are created with raw SQL. They answer
+    `user_id = %s AND upper(name) LIKE 'PREFIX%'` without scanning the
+    user's whole catalog.
+    """
+
+    dependencies = [
+        ('core', '0006_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX core_tag_user_name_prefix '
+            'ON core_tag (user_id, upper(name) text_pattern_ops);',
+            'DROP INDEX IF EXISTS core_tag_user_name_prefix;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX core_ingredient_user_name_prefix '
+            'ON core_ingredient (user_id, upper(name) text_pattern_ops);',
+            'DROP INDEX IF EXISTS core_ingredient_user_name_prefix;',
+        ),
+    ]
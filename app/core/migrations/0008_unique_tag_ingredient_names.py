@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-16 22:50
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge tags and ingredients sharing a user and name into the oldest one."""
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, field_name in [('Tag', 'tags'), ('Ingredient', 'ingredients')]:
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field_name).through
+        column = f'{model_name.lower()}_id'
+        duplicates = model.objects.values('user_id', 'name').annotate(
+            keep_id=Min('id'), total=Count('id'),
+        ).filter(total__gt=1)
+
+        for duplicate in duplicates:
+            keep_id = duplicate['keep_id']
+            drop_ids = model.objects.filter(
+                user_id=duplicate['user_id'], name=duplicate['name'],
+            ).exclude(id=keep_id).values_list('id', flat=True)
+            for drop_id in list(drop_ids):
+                linked = through.objects.filter(**{column: keep_id}).values('recipe_id')
+                # Links the kept row already has would violate the through
+                # table unique constraint, the rest are moved over
+                through.objects.filter(recipe_id__in=linked, **{column: drop_id}).delete()
+                through.objects.filter(**{column: drop_id}).update(**{column: keep_id})
+                model.objects.filter(id=drop_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tag_ingredient_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        # Run the deferred FK checks of the merge now, ALTER TABLE refuses
+        # to run with pending trigger events
+        migrations.RunSQL('SET CONSTRAINTS ALL IMMEDIATE', migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_ingredient_name_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_tag_name_per_user'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-16 22:58
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_recipes(apps, schema_editor):
+    """Fill recipe_count of existing tags and ingredients."""
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, field_name in [('Tag', 'tags'), ('Ingredient', 'ingredients')]:
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field_name).through
+        column = f'{model_name.lower()}_id'
+        links = through.objects.filter(**{column: OuterRef('pk')}).values(column).annotate(
+            links=Count('id'),
+        ).values('links')
+        model.objects.update(recipe_count=Coalesce(Subquery(links), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_unique_tag_ingredient_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:24
+
+from django.db import migrations, models
+
+
+def queue_existing_images(apps, schema_editor):
+    """Mark images uploaded before processing existed as pending."""
+    Recipe = apps.get_model('core', 'Recipe')
+    Recipe.objects.exclude(image='').exclude(image__isnull=True).update(image_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipe_user_id_desc_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnails',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(queue_existing_images, migrations.RunPython.noop),
+    ]
@@ -6,7 +6,9 @@ import os
 
 from typing import Optional, Any
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 from django.db.models import Model
 from django.contrib.auth.models import (
     AbstractBaseUser,
@@ -24,9 +26,35 @@ def recipe_image_file_path(instance: Model, filename: str) -> str:
     return os.path.join('uploads', 'recipe', filename)
 
 
+class UserQuerySet(models.QuerySet):
+    """Users, invalidating cached token lookups on bulk updates."""
+
+    def update(self, **kwargs: Any):
+        """Update the users, then drop their cached token lookups.
+
+        QuerySet.update() sends no post_save, so e.g. deactivating users in
+        bulk would otherwise keep their tokens working until the cache
+        entries expire.
+        """
+        # Imported here, core.authentication loads DRF
+        from core.authentication import invalidate_auth
+
+        with transaction.atomic(using=self.db):
+            # Locked and updated by id, so exactly the invalidated users change
+            ids = list(self.select_for_update().values_list('id', flat=True))
+            rows = self.model._base_manager.using(self.db).filter(id__in=ids).update(**kwargs)
+        for user_id in ids:
+            invalidate_auth(user_id)
+
+        return rows
+
+
 class UserManager(BaseUserManager['User']):
     """Manager for users."""
 
+    def get_queryset(self):
+        return UserQuerySet(self.model, using=self._db)
+
     def create_user(self, email:str, password:Optional[str]=None, **extra_fields: Any):
         """Create, save and return a new user."""
         if not email:
@@ -63,6 +91,16 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+IMAGE_PENDING = 'pending'
+IMAGE_READY = 'ready'
+IMAGE_FAILED = 'failed'
+IMAGE_STATUS_CHOICES = [
+    (IMAGE_PENDING, 'Pending'),
+    (IMAGE_READY, 'Ready'),
+    (IMAGE_FAILED, 'Failed'),
+]
+
+
 class Recipe(models.Model):
     """Recipe object."""
     user = models.ForeignKey(
@@ -78,6 +116,27 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag') # type:ignore
     ingredients = models.ManyToManyField('Ingredient') # type:ignore
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # Filled in by recipe.images once an uploaded image is processed
+    image_status = models.CharField(
+        max_length=10, choices=IMAGE_STATUS_CHOICES, blank=True, editable=False,
+    )
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    # {width: file name} of the resized copies
+    image_thumbnails = models.JSONField(default=dict, editable=False)
+    # Tiny blurred JPEG as a data URI, shown while the image loads
+    image_placeholder = models.TextField(blank=True, editable=False)
+    # Weighted tsvector of title (A) and description (B), kept up to date by
+    # a database trigger so it is correct for every kind of write
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            # Lists filter by user and page newest first, the index returns
+            # the rows already in order so no sort is needed
+            models.Index(fields=['user', '-id'], name='core_recipe_user_id_desc'),
+        ]
 
     # Display the title in django admin, if not will display the whole obj
     def __str__(self):
@@ -86,12 +145,25 @@ class Recipe(models.Model):
 
 class Tag(models.Model):
     """Tag for filtering recipes."""
+    # Prefix lookups use the (user_id, upper(name)) index from migration 0007
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
         # Defined in settings.py file - core.User
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # Number of recipes using the tag, maintained by recipe.counts
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # The unique constraint's (user_id, name) index also serves the
+        # list, filtered by user and ordered by -name with a backward scan
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_tag_name_per_user',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -99,11 +171,24 @@ class Tag(models.Model):
 
 class Ingredient(models.Model):
     """Ingredient for recipes."""
+    # Prefix lookups use the (user_id, upper(name)) index from migration 0007
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # Number of recipes using the ingredient, maintained by recipe.counts
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # The unique constraint's (user_id, name) index also serves the
+        # list, filtered by user and ordered by -name with a backward scan
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_ingredient_name_per_user',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -0,0 +1,25 @@
+"""
+Signal handlers for core models.
+"""
+from typing import Any
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.authentication import invalidate_auth
+from core.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_auth(sender: Any, instance: User, **kwargs: Any):
+    """Drop cached token lookups of a changed, deactivated or deleted user."""
+    invalidate_auth(instance.id) # type:ignore
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token_auth(sender: Any, instance: Token, **kwargs: Any):
+    """Drop cached token lookups when a token is created or deleted."""
+    invalidate_auth(instance.user_id) # type:ignore
@@ -0,0 +1,140 @@
+"""
+Slow query log.
+
+SlowQueryLogger is installed with connection.execute_wrapper() for the
+duration of a request. Queries slower than SLOW_QUERY_THRESHOLD_MS are
+logged as one JSON line with the view that ran them, a fingerprint of the
+SQL with every literal replaced, and the plan from a plain EXPLAIN. EXPLAIN
+without ANALYZE only plans the statement, it never runs it a second time.
+"""
+from typing import Any
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from psycopg2 import Error as Psycopg2Error
+
+logger = logging.getLogger('core.slow_queries')
+
+# Statements EXPLAIN accepts, anything else (SAVEPOINT, SET, DDL) is skipped
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+# Fingerprints remembered for rate limiting before the oldest are dropped
+MAX_FINGERPRINTS = 1000
+MAX_SQL_LENGTH = 2000
+
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    # IN lists of any length share one fingerprint
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+_lock = threading.Lock()
+# fingerprint: (monotonic time last logged, occurrences suppressed since)
+_last_logged: dict = {}
+
+
+def normalize_sql(sql: str) -> str:
+    """Return the SQL with literals and placeholders replaced by ?."""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized: str) -> str:
+    """Return a short stable id of a normalized statement."""
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def should_log(key: str) -> Any:
+    """Return the occurrences suppressed since the last log, None to skip."""
+    now = time.monotonic()
+    with _lock:
+        last, suppressed = _last_logged.get(key, (None, 0))
+        if last is not None and now - last < settings.SLOW_QUERY_LOG_INTERVAL:
+            _last_logged[key] = (last, suppressed + 1)
+            return None
+
+        if key not in _last_logged and len(_last_logged) >= MAX_FINGERPRINTS:
+            # Dicts keep insertion order, forget the oldest fingerprint
+            del _last_logged[next(iter(_last_logged))]
+        _last_logged[key] = (now, 0)
+        return suppressed
+
+
+def reset_rate_limit():
+    """Forget every logged fingerprint."""
+    with _lock:
+        _last_logged.clear()
+
+
+class SlowQueryLogger:
+    """Execute wrapper logging the slow queries of one request."""
+
+    def __init__(self, request: Any):
+        self.request = request
+
+    def __call__(self, execute: Any, sql: str, params: Any, many: bool, context: Any):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        threshold = settings.SLOW_QUERY_THRESHOLD_MS
+        if threshold > 0 and elapsed_ms >= threshold:
+            self.log(sql, params, many, elapsed_ms, context['connection'])
+
+        return result
+
+    def log(self, sql: str, params: Any, many: bool, elapsed_ms: float, connection: Any):
+        """Write a slow query to the log, unless its fingerprint was just logged."""
+        normalized = normalize_sql(sql)
+        key = fingerprint(normalized)
+        suppressed = should_log(key)
+        if suppressed is None:
+            return
+
+        plan = None
+        if settings.SLOW_QUERY_EXPLAIN and not many:
+            plan = self.explain(connection, sql, params)
+
+        logger.warning(json.dumps({
+            'duration_ms': round(elapsed_ms, 2),
+            'route': getattr(self.request, 'route_name', 'unmatched'),
+            'method': self.request.method,
+            'path': self.request.path,
+            'fingerprint': key,
+            'sql': normalized[:MAX_SQL_LENGTH],
+            # executemany() runs one statement per parameter set
+            'params': len(params or ()),
+            'many': many,
+            'suppressed': suppressed,
+            'plan': plan,
+        }))
+
+    def explain(self, connection: Any, sql: str, params: Any):
+        """Return the plan of a statement, or None if it cannot be explained."""
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+
+        # The raw psycopg2 cursor skips the execute wrappers. A savepoint
+        # keeps a failing EXPLAIN from aborting the request's transaction.
+        savepoint = connection.in_atomic_block
+        with connection.connection.cursor() as cursor:
+            try:
+                if savepoint:
+                    cursor.execute('SAVEPOINT slow_query_explain')
+                cursor.execute(f'EXPLAIN {sql}', params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                if savepoint:
+                    cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            except Psycopg2Error as error:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                plan = f'EXPLAIN failed: {error}'
+
+        return plan
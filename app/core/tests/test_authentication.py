@@ -0,0 +1,124 @@
+"""
+Tests for cached token authentication.
+"""
+from typing import cast
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import models
+from core.authentication import TOKEN_KEY, local_cache
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test token lookups are cached and invalidated."""
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.user = cast(models.UserManager, get_user_model().objects).create_user(
+            'user@example.com', 'testpass123', name='Test Name',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def _token_queries(self):
+        """Return the token lookups run by a request to the profile."""
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 200)
+        return [q for q in ctx.captured_queries if 'authtoken_token' in q['sql']]
+
+    def test_lookup_cached(self):
+        """Test only the first request looks the token up."""
+        self.assertEqual(len(self._token_queries()), 1)
+        self.assertEqual(self._token_queries(), [])
+
+    def test_shared_cache_used_by_other_processes(self):
+        """Test a process without the token in memory uses the shared cache."""
+        self._token_queries()
+        # As seen by another worker
+        local_cache.clear()
+
+        self.assertEqual(self._token_queries(), [])
+
+    def test_user_loaded_from_cache(self):
+        """Test the cached user is returned."""
+        self._token_queries()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['email'], 'user@example.com') # type:ignore
+        self.assertEqual(res.data['name'], 'Test Name') # type:ignore
+
+    def test_deleted_token_rejected(self):
+        """Test a deleted token stops authenticating at once."""
+        self._token_queries()
+
+        self.token.delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_deactivated_user_rejected(self):
+        """Test a deactivated user stops authenticating at once."""
+        self._token_queries()
+
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_deactivated_in_bulk_rejected(self):
+        """Test users deactivated with QuerySet.update() stop authenticating at once."""
+        self._token_queries()
+
+        get_user_model().objects.filter(id=self.user.id).update(is_active=False)
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_only_user_id_cached(self):
+        """Test neither the token nor the password hash is cached."""
+        self._token_queries()
+
+        key = TOKEN_KEY.format(digest=hashlib.sha256(self.token.key.encode()).hexdigest())
+        entry = cache.get(key)
+        self.assertEqual(entry[1], (self.user.id, True))
+        self.assertNotIn(self.user.password, repr(entry))
+
+    def test_updated_user_reloaded(self):
+        """Test changes to the user are seen on the next request."""
+        self._token_queries()
+
+        self.user.name = 'New Name'
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['name'], 'New Name') # type:ignore
+
+    @override_settings(TOKEN_AUTH_CACHE_TIMEOUT=0)
+    def test_cache_turned_off(self):
+        """Test every request looks the token up when caching is off."""
+        self.assertEqual(len(self._token_queries()), 1)
+        self.assertEqual(len(self._token_queries()), 1)
+
+    def test_invalid_token_rejected(self):
+        """Test an unknown token is rejected."""
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 401)
@@ -1,6 +1,10 @@
 """
 Test custom Django management commands.
 """
+from io import StringIO
+import json
+import os
+import tempfile
 # Mock behavior of db
 from unittest.mock import patch, MagicMock
 
@@ -9,10 +13,14 @@ from psycopg2 import OperationalError as Psycopg2Error
 
 # Helper function to call the command by name
 from django.core.management import call_command
+from django.core.management.base import CommandError
 # Exception that might throw by db
 from django.db.utils import OperationalError
 # Base test class
-from django.test import SimpleTestCase
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase
+
+from core.loadtest import endpoint_name, parse_mix
+from core.models import Recipe, User
 
 
 # mock check method from BaseCommand
@@ -44,3 +52,192 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BenchmarkRecipeFiltersTests(TestCase):
+    """Test the recipe filter benchmark command."""
+
+    def test_benchmark_leaves_database_untouched(self):
+        """Test the benchmark reports every plan and rolls back its data."""
+        out = StringIO()
+
+        call_command(
+            'benchmark_recipe_filters',
+            recipes=20, tags=5, ingredients=5, runs=1, stdout=out,
+        )
+
+        self.assertIn('legacy JOIN + DISTINCT', out.getvalue())
+        self.assertIn('EXISTS (all)', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+
+class BenchmarkRecipeListTests(TestCase):
+    """Test the recipe list serialization benchmark command."""
+
+    def test_benchmark_output_identical(self):
+        """Test the benchmark finds both serializers agree and rolls back."""
+        out = StringIO()
+
+        call_command('benchmark_recipe_list', recipes=20, runs=1, stdout=out)
+
+        self.assertIn('Identical JSON: yes', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+
+class AuditQueryPlansTests(TestCase):
+    """Test the query plan audit command."""
+
+    def test_audit_passes_within_threshold(self):
+        """Test small scans and sorts pass and the data is rolled back."""
+        out = StringIO()
+
+        call_command(
+            'audit_query_plans',
+            recipes=50, tags=5, ingredients=10, max_rows=10_000, stdout=out,
+        )
+
+        self.assertIn('All query plans within limits.', out.getvalue())
+        self.assertIn('tags assigned only', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_audit_fails_above_threshold(self):
+        """Test a sequential scan over more rows than allowed fails."""
+        out = StringIO()
+
+        with self.assertRaises(CommandError):
+            call_command(
+                'audit_query_plans',
+                recipes=50, tags=5, ingredients=10, max_rows=0, stdout=out,
+            )
+
+        self.assertIn('Seq Scan on core_ingredient', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+
+class BenchmarkSuiteTests(TestCase):
+    """Test the benchmark suite command."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = os.path.join(directory.name, 'baseline.json')
+
+    def _run(self, **options):
+        out = StringIO()
+        call_command(
+            'benchmark_suite',
+            recipes=20, tags=5, ingredients=10, runs=2, stdout=out, **options,
+        )
+        return out.getvalue()
+
+    def test_saves_baseline_and_rolls_back(self):
+        """Test the results are saved as JSON and the data is rolled back."""
+        self._run(save=self.baseline)
+
+        with open(self.baseline) as baseline_file:
+            report = json.load(baseline_file)
+        self.assertEqual(report['meta']['recipes'], 20)
+        result = report['results']['recipe create']
+        self.assertLessEqual(result['p50'], result['p95'])
+        self.assertLessEqual(result['p95'], result['p99'])
+        self.assertGreater(result['queries'], 0)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_compare_fails_on_more_queries(self):
+        """Test a benchmark running more queries than the baseline fails."""
+        self._run(save=self.baseline)
+        with open(self.baseline) as baseline_file:
+            report = json.load(baseline_file)
+        report['results']['recipe update']['queries'] -= 1
+        with open(self.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file)
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command(
+                'benchmark_suite',
+                recipes=20, tags=5, ingredients=10, runs=2,
+                compare=self.baseline, tolerance=1_000_000, stdout=out,
+            )
+
+        self.assertIn('recipe update', out.getvalue())
+        self.assertIn('REGRESSED', out.getvalue())
+
+    def test_compare_missing_baseline(self):
+        """Test a missing baseline fails before anything is seeded."""
+        with self.assertRaises(CommandError):
+            self._run(compare=self.baseline)
+
+        self.assertFalse(Recipe.objects.exists())
+
+
+class LoadTestTests(LiveServerTestCase):
+    """Test the load test command against a live server."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, 'requests.jsonl')
+        self.results = os.path.join(directory.name, 'results.json')
+
+    def _run(self, **options):
+        out = StringIO()
+        call_command(
+            'loadtest',
+            url=self.live_server_url, clients=2, users=1, recipes=20,
+            save=self.results, stdout=out, **options,
+        )
+        with open(self.results) as results_file:
+            return json.load(results_file)['results']
+
+    def test_mix_recorded_and_replayed(self):
+        """Test the mix is sent without errors and a recorded log replays."""
+        results = self._run(requests=40, record=self.log, keep_data=True)
+
+        self.assertEqual(results['total']['requests'], 40)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertTrue(User.objects.filter(email='loadtest-0@example.com').exists())
+
+        replayed = self._run(replay=self.log, speed=0)
+
+        self.assertEqual(replayed['total']['requests'], 40)
+        self.assertEqual(replayed['total']['errors'], 0)
+        self.assertFalse(User.objects.filter(email='loadtest-0@example.com').exists())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_mix_limited_to_scenarios(self):
+        """Test only the scenarios of the mix are sent."""
+        results = self._run(requests=10, mix=parse_mix('list=1,detail=1'))
+
+        self.assertLessEqual(set(results) - {'total'}, {'list', 'detail'})
+        self.assertEqual(results['total']['requests'], 10)
+
+
+class LoadTestHelperTests(SimpleTestCase):
+    """Test the load test helpers."""
+
+    def test_endpoint_name(self):
+        """Test ids and query strings are dropped from endpoint names."""
+        self.assertEqual(
+            endpoint_name('GET', '/api/recipe/recipes/12/?fields=id'),
+            'GET /api/recipe/recipes/{id}/',
+        )
+
+    def test_parse_mix_unknown_scenario(self):
+        """Test an unknown scenario in the mix is rejected."""
+        with self.assertRaises(ValueError):
+            parse_mix('list=1,delete=1')
+
+
+class BenchmarkLoginTests(TestCase):
+    """Test the login benchmark command."""
+
+    def test_benchmark_leaves_database_untouched(self):
+        """Test every hasher setup is timed and the users are rolled back."""
+        out = StringIO()
+
+        call_command('benchmark_login', runs=2, stdout=out)
+
+        self.assertIn('pbkdf2', out.getvalue())
+        self.assertIn('rehash on login', out.getvalue())
+        self.assertFalse(User.objects.exists())
@@ -0,0 +1,68 @@
+"""
+Tests for the password hasher policy.
+"""
+from typing import cast
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import models
+
+TOKEN_URL = reverse('user:token')
+PBKDF2 = 'django.contrib.auth.hashers.PBKDF2PasswordHasher'
+
+
+class PasswordHasherTests(TestCase):
+    """Test passwords are hashed and rehashed with the configured hasher."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = cast(models.UserManager, get_user_model().objects).create_user(
+            'user@example.com', 'testpass123',
+        )
+
+    def _login(self):
+        res = self.client.post(
+            TOKEN_URL, {'email': 'user@example.com', 'password': 'testpass123'},
+        )
+        self.assertEqual(res.status_code, 200)
+        self.user.refresh_from_db()
+
+    @override_settings(PASSWORD_ARGON2_TIME_COST=2, PASSWORD_ARGON2_MEMORY_COST=19456)
+    def test_new_password_uses_configured_costs(self):
+        """Test new passwords are hashed with Argon2id and the configured costs."""
+        self.user.set_password('testpass123')
+
+        self.assertTrue(self.user.password.startswith('argon2$argon2id$v=19$m=19456,t=2,p=1$'))
+
+    def test_pbkdf2_rehashed_on_login(self):
+        """Test a PBKDF2 hash is replaced with Argon2 when the user logs in."""
+        with override_settings(PASSWORD_HASHERS=[PBKDF2]):
+            self.user.password = make_password('testpass123')
+        self.user.save()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+        self._login()
+
+        self.assertTrue(self.user.password.startswith('argon2$'))
+
+    def test_changed_costs_rehashed_on_login(self):
+        """Test a hash made with other costs is rehashed when the user logs in."""
+        with override_settings(PASSWORD_ARGON2_TIME_COST=3):
+            self._login()
+            self.assertIn(',t=3,', self.user.password)
+
+    def test_wrong_password_not_rehashed(self):
+        """Test a failed login leaves the hash alone."""
+        with override_settings(PASSWORD_HASHERS=[PBKDF2]):
+            self.user.password = make_password('testpass123')
+        self.user.save()
+
+        res = self.client.post(TOKEN_URL, {'email': 'user@example.com', 'password': 'wrong'})
+
+        self.assertEqual(res.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
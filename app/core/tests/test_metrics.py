@@ -0,0 +1,115 @@
+"""
+Tests for the API metrics.
+"""
+from decimal import Decimal
+from typing import Any, cast
+from unittest.mock import patch
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from core import models
+from core.metrics import render_metrics
+
+RECIPES_URL = reverse('recipe:recipe-list')
+METRICS_URL = reverse('metrics')
+
+
+def sample(name: str, **labels: Any) -> float:
+    """Return the current value of a metric sample, 0 if not recorded yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsMiddlewareTests(TestCase):
+    """Test requests are recorded per route."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = cast(models.UserManager, get_user_model().objects).create_user(
+            'user@example.com', 'testpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_viewset_action_recorded(self):
+        """Test a recipe list request is recorded as RecipeViewSet.list."""
+        models.Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=5, price=Decimal('5.00'),
+        )
+        route = 'RecipeViewSet.list'
+        requests = sample('api_requests_total', route=route, method='GET', status='200')
+        queries = sample('api_db_queries_sum', route=route)
+        responses = sample('api_response_bytes_count', route=route)
+        serializer = sample('api_serializer_duration_seconds_sum', route=route)
+        timed = sample('api_request_duration_seconds_count', route=route, method='GET')
+
+        self.client.get(RECIPES_URL)
+
+        self.assertEqual(
+            sample('api_requests_total', route=route, method='GET', status='200'),
+            requests + 1,
+        )
+        self.assertGreater(sample('api_db_queries_sum', route=route), queries)
+        self.assertEqual(sample('api_response_bytes_count', route=route), responses + 1)
+        self.assertGreater(
+            sample('api_serializer_duration_seconds_sum', route=route), serializer,
+        )
+        self.assertEqual(
+            sample('api_request_duration_seconds_count', route=route, method='GET'),
+            timed + 1,
+        )
+
+    def test_status_codes_recorded(self):
+        """Test error responses are counted with their status code."""
+        before = sample(
+            'api_requests_total', route='RecipeViewSet.list', method='GET', status='400',
+        )
+
+        self.client.get(RECIPES_URL, {'match': 'some'})
+
+        self.assertEqual(
+            sample('api_requests_total', route='RecipeViewSet.list', method='GET', status='400'),
+            before + 1,
+        )
+
+    def test_unmatched_url_recorded(self):
+        """Test requests to unknown URLs share one route label."""
+        before = sample('api_requests_total', route='unmatched', method='GET', status='404')
+
+        self.client.get('/no/such/page/')
+
+        self.assertEqual(
+            sample('api_requests_total', route='unmatched', method='GET', status='404'),
+            before + 1,
+        )
+
+
+class MetricsEndpointTests(TestCase):
+    """Test the metrics endpoint."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_metrics_endpoint(self):
+        """Test metrics are served in the Prometheus text format."""
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'api_request_duration_seconds_bucket', res.content)
+        self.assertIn(b'api_response_cache_hits_total 0.0', res.content)
+
+    def test_multiprocess_metrics(self):
+        """Test metrics are read from the shared directory when configured."""
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict('os.environ', {'PROMETHEUS_MULTIPROC_DIR': directory}):
+            content = render_metrics()
+
+        # Nothing was written by workers, only the shared cache counters remain
+        self.assertNotIn(b'api_request_duration_seconds', content)
+        self.assertIn(b'api_response_cache_misses_total', content)
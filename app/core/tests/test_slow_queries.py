@@ -0,0 +1,122 @@
+"""
+Tests for the slow query log.
+"""
+from decimal import Decimal
+from typing import cast
+from unittest.mock import patch
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import models
+from core.slow_queries import fingerprint, normalize_sql, reset_rate_limit
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class NormalizeSqlTests(TestCase):
+    """Test SQL fingerprints ignore literal values."""
+
+    def test_literals_replaced(self):
+        """Test numbers, strings and placeholders become ?."""
+        sql = "SELECT * FROM t WHERE a = 'x''y' AND b = 42 AND c = %s LIMIT 51"
+
+        self.assertEqual(
+            normalize_sql(sql), 'SELECT * FROM t WHERE a = ? AND b = ? AND c = ? LIMIT ?',
+        )
+
+    def test_in_lists_share_fingerprint(self):
+        """Test IN lists of different lengths give the same fingerprint."""
+        short = normalize_sql('SELECT id FROM t WHERE id IN (%s, %s)')
+        long = normalize_sql('SELECT id FROM t WHERE id IN (%s,\n %s, %s, %s)')
+
+        self.assertEqual(short, 'SELECT id FROM t WHERE id IN (...)')
+        self.assertEqual(fingerprint(short), fingerprint(long))
+
+
+# Any query is slower than this
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0.000001, SLOW_QUERY_LOG_INTERVAL=60)
+class SlowQueryLogTests(TestCase):
+    """Test slow queries of a request are logged."""
+
+    def setUp(self):
+        cache.clear()
+        reset_rate_limit()
+        self.user = cast(models.UserManager, get_user_model().objects).create_user(
+            'user@example.com', 'testpass123',
+        )
+        models.Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=5, price=Decimal('5.00'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _entries(self, logs):
+        return [json.loads(line.split(':', 2)[2]) for line in logs.output]
+
+    def test_slow_query_logged_with_plan(self):
+        """Test a slow query is logged with its view, fingerprint and plan."""
+        with self.assertLogs('core.slow_queries') as logs:
+            self.client.get(RECIPES_URL, {'tags': '1,2'})
+
+        entry = next(
+            entry for entry in self._entries(logs) if 'core_recipe' in entry['sql']
+        )
+        self.assertEqual(entry['route'], 'RecipeViewSet.list')
+        self.assertEqual(entry['method'], 'GET')
+        self.assertEqual(entry['path'], RECIPES_URL)
+        # The user id and both tag ids
+        self.assertEqual(entry['params'], 3)
+        self.assertEqual(entry['suppressed'], 0)
+        self.assertIn('Scan', entry['plan'])
+
+    def test_rate_limited_per_fingerprint(self):
+        """Test a repeated query is logged once and counted afterwards."""
+        with self.assertLogs('core.slow_queries'):
+            self.client.get(RECIPES_URL, {'tags': '1'})
+        # Same statements with a longer IN list, all within the interval
+        with patch('core.slow_queries.logger') as slow_logger:
+            self.client.get(RECIPES_URL, {'tags': '1,2,3'})
+
+        slow_logger.warning.assert_not_called()
+
+        # Skip the response cache so the queries run again
+        cache.clear()
+        with override_settings(SLOW_QUERY_LOG_INTERVAL=0), \
+                self.assertLogs('core.slow_queries') as logs:
+            self.client.get(RECIPES_URL, {'tags': '1'})
+
+        entry = next(
+            entry for entry in self._entries(logs) if 'core_recipe' in entry['sql']
+        )
+        self.assertEqual(entry['suppressed'], 1)
+
+    @override_settings(SLOW_QUERY_EXPLAIN=False)
+    def test_explain_can_be_turned_off(self):
+        """Test no plan is captured when EXPLAIN is turned off."""
+        with self.assertLogs('core.slow_queries') as logs:
+            self.client.get(RECIPES_URL)
+
+        self.assertTrue(all(entry['plan'] is None for entry in self._entries(logs)))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_threshold_zero_disables(self):
+        """Test nothing is logged when the threshold is 0."""
+        with patch('core.slow_queries.logger') as slow_logger:
+            self.client.get(RECIPES_URL)
+
+        slow_logger.warning.assert_not_called()
+
+    def test_write_in_transaction_unaffected(self):
+        """Test explaining writes inside a transaction leaves it usable."""
+        payload = {'title': 'Stew', 'time_minutes': 5, 'price': '5.00', 'tags': [{'name': 'A'}]}
+
+        with self.assertLogs('core.slow_queries'):
+            res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(models.Recipe.objects.filter(title='Stew', tags__name='A').exists())
@@ -0,0 +1,37 @@
+"""
+Tests for cache version tokens.
+"""
+from django.core.cache import cache
+from django.test import TestCase
+
+from core.versions import bump_version, get_version
+
+
+class VersionTests(TestCase):
+    """Test version tokens per prefix and owner."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_stable_until_bumped(self):
+        """Test a version stays the same until it is bumped."""
+        version = get_version('test:version', 1)
+        self.assertEqual(get_version('test:version', 1), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version('test:version', 1)
+            bumped = get_version('test:version', 1)
+
+        self.assertNotEqual(bumped, version)
+        # Bumped again on commit
+        self.assertNotEqual(get_version('test:version', 1), bumped)
+
+    def test_versions_independent(self):
+        """Test bumping one owner or prefix leaves the others alone."""
+        other_owner = get_version('test:version', 2)
+        other_prefix = get_version('other:version', 1)
+
+        bump_version('test:version', 1)
+
+        self.assertEqual(get_version('test:version', 2), other_owner)
+        self.assertEqual(get_version('other:version', 1), other_prefix)
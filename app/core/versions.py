@@ -0,0 +1,43 @@
+"""
+Version tokens in the shared cache, used to invalidate groups of entries.
+
+Each owner (e.g. a user) has a random token under a key prefix. Cache
+entries are stored under, or checked against, the current token, so
+replacing it makes all of the owner's old entries unusable at once,
+without having to find and delete them.
+"""
+from typing import Any
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(prefix: str, owner: Any) -> str:
+    return f'{prefix}:{owner}'
+
+
+def get_version(prefix: str, owner: Any) -> str:
+    """Return the current version token of an owner."""
+    key = _key(prefix, owner)
+    version = cache.get(key)
+    if version is None:
+        # A random token rather than a counter, so an evicted version can
+        # never restart at a value that old entries were stored under
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+
+    return version
+
+
+def _set_new_version(prefix: str, owner: Any):
+    """Replace the version token of an owner."""
+    cache.set(_key(prefix, owner), uuid.uuid4().hex, None)
+
+
+def bump_version(prefix: str, owner: Any):
+    """Invalidate every entry stored under an owner's current version."""
+    _set_new_version(prefix, owner)
+    # Bump again once the transaction commits, a read running before the
+    # commit may have cached the old rows under the first new version
+    transaction.on_commit(lambda: _set_new_version(prefix, owner))
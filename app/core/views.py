@@ -0,0 +1,12 @@
+"""
+Views for the core app.
+"""
+from django.http import HttpRequest, HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from core.metrics import render_metrics
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Return the metrics of all workers for Prometheus to scrape."""
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,152 @@
+"""
+Per-user versioned response cache for recipe APIs.
+
+Every user has a data version token in the cache. Cached responses are
+keyed on that token, so changing it on any write makes all of the user's
+old entries unreachable at once, without having to find and delete them.
+"""
+from contextlib import contextmanager
+from typing import Any, Callable
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from core.versions import bump_version, get_version
+
+VERSION_PREFIX = 'recipe:version'
+RESPONSE_KEY = 'recipe:response:{user_id}:{version}:{digest}'
+HITS_KEY = 'recipe:cache:hits'
+MISSES_KEY = 'recipe:cache:misses'
+
+_state = threading.local()
+
+
+def get_data_version(user_id: Any) -> str:
+    """Return the current data version token of a user."""
+    return get_version(VERSION_PREFIX, user_id)
+
+
+def bump_data_version(user_id: Any):
+    """Invalidate every cached response of a user."""
+    bump_version(VERSION_PREFIX, user_id)
+
+
+@contextmanager
+def invalidated_manually():
+    """Turn the per-object signal bumps off while the caller bumps once."""
+    previous = invalidation_enabled()
+    _state.manual = True
+    try:
+        yield
+    finally:
+        _state.manual = not previous
+
+
+def invalidation_enabled() -> bool:
+    """Return whether the signal handlers should bump data versions."""
+    return not getattr(_state, 'manual', False)
+
+
+def _incr(key: str):
+    """Increment a shared counter, creating it if needed."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def cache_stats() -> dict:
+    """Return the response cache hit and miss counters."""
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
+
+
+class CachedResponseMixin:
+    """Serve read actions of a viewset from the per-user cache.
+
+    Responses also carry an ETag derived from the user's data version, so
+    clients sending it back in If-None-Match get a 304 Not Modified without
+    the view touching the database or a serializer.
+    """
+    request: Request
+    kwargs: dict
+    basename: str
+    action: str
+
+    def _request_digest(self, request: Request) -> str:
+        """Return a digest identifying the resource a request reads."""
+        # Same params in any order identify the same resource
+        params = sorted(
+            (key, sorted(values)) for key, values in request.query_params.lists()
+        )
+        raw = repr((self.basename, self.action, sorted(self.kwargs.items()), params))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _etag(self, request: Request, version: str, digest: str) -> str:
+        """Return the strong ETag of a response."""
+        # The rendered format is part of the representation, JSON and the
+        # browsable API must not share a validator
+        raw = f'{version}:{digest}:{request.accepted_renderer.format}' # type:ignore
+        return quote_etag(hashlib.sha256(raw.encode()).hexdigest()[:32])
+
+    def _client_etags(self, request: Request) -> list:
+        """Return the validators the client sent in If-None-Match."""
+        header = request.META.get('HTTP_IF_NONE_MATCH')
+        if not header:
+            return []
+
+        # If-None-Match uses the weak comparison, W/ prefixes are ignored
+        return [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(header)]
+
+    def cached_response(
+        self,
+        handler: Callable[..., Response],
+        request: Request,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Response:
+        """Return the cached response of a handler, running it on a miss."""
+        version = get_data_version(request.user.pk)
+        digest = self._request_digest(request)
+        etag = self._etag(request, version, digest)
+        client_etags = self._client_etags(request)
+        if etag in client_etags:
+            return Response(status=304, headers={'ETag': etag})
+
+        key = RESPONSE_KEY.format(
+            user_id=request.user.pk,
+            version=version,
+            digest=digest,
+        )
+        # * matches any current representation, only known once there is
+        # a 200 to send, a missing recipe must stay a 404
+        data = cache.get(key)
+        if data is not None:
+            _incr(HITS_KEY)
+            if '*' in client_etags:
+                return Response(status=304, headers={'ETag': etag})
+            return Response(data, headers={'X-Cache': 'HIT', 'ETag': etag})
+
+        _incr(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+            if '*' in client_etags:
+                return Response(status=304, headers={'ETag': etag})
+            response['ETag'] = etag
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """List objects, from the cache when possible."""
+        return self.cached_response(
+            super().list, request, *args, **kwargs # type:ignore
+        )
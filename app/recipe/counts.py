@@ -0,0 +1,130 @@
+"""
+Denormalized recipe counts of tags and ingredients.
+
+Tag.recipe_count and Ingredient.recipe_count hold the number of recipes
+linked to each row, so listings never count across the through tables at
+read time. Links written through the related managers are recounted by
+the signal handlers in recipe.signals. Bulk writes bypass those signals
+and adjust the counters by the rows their statements actually changed.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterable, Optional
+import threading
+
+from django.db import connection
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from core.models import Recipe, Tag, Ingredient
+
+# Through model: (related model, column of the related id)
+THROUGH = {
+    Recipe.tags.through: (Tag, 'tag_id'), # type:ignore
+    Recipe.ingredients.through: (Ingredient, 'ingredient_id'), # type:ignore
+}
+# Related model: (through model, column of the related id)
+RELATED = {model: (through, column) for through, (model, column) in THROUGH.items()}
+
+_state = threading.local()
+
+
+def adjust_recipe_counts(model: Any, deltas: dict):
+    """Add {id: delta} to the recipe counts of tags or ingredients.
+
+    Runs a single UPDATE, whatever the number of ids.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    model.objects.filter(id__in=deltas).update(
+        recipe_count=F('recipe_count') + Case(
+            *[When(id=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def insert_links(through: Any, column: str, links: list) -> Counter:
+    """Insert (recipe id, related id) links, returning {related id: inserted}.
+
+    Pairs that are linked already, also by a concurrent request after any
+    earlier SELECT, are skipped by ON CONFLICT DO NOTHING and only the rows
+    RETURNING reports are counted.
+    """
+    if not links:
+        return Counter()
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(through._meta.db_table)} (recipe_id, {quote(column)}) '
+            'SELECT * FROM UNNEST(%s::bigint[], %s::bigint[]) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(column)}',
+            [[recipe_id for recipe_id, _ in links], [related_id for _, related_id in links]],
+        )
+        return Counter(related_id for related_id, in cursor.fetchall())
+
+
+def delete_links(
+    through: Any,
+    column: str,
+    recipe_ids: list,
+    related_ids: Optional[list] = None,
+) -> Counter:
+    """Delete links of recipes to tags or ingredients, returning {related id: deleted}.
+
+    All links of the recipes when related_ids is None. Counted from
+    DELETE ... RETURNING, links a concurrent request deleted first are not
+    uncounted twice.
+    """
+    if not recipe_ids or related_ids == []:
+        return Counter()
+
+    quote = connection.ops.quote_name
+    sql = f'DELETE FROM {quote(through._meta.db_table)} WHERE recipe_id = ANY(%s)'
+    params: list = [list(recipe_ids)]
+    if related_ids is not None:
+        sql += f' AND {quote(column)} = ANY(%s)'
+        params.append(list(related_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {quote(column)}', params)
+        return Counter(related_id for related_id, in cursor.fetchall())
+
+
+def linked_counts(model: Any, recipe_ids: Iterable[int]) -> Counter:
+    """Return {id: links} of the tags or ingredients linked to recipes."""
+    through, column = RELATED[model]
+    return Counter(dict(
+        through.objects.filter(recipe_id__in=recipe_ids).values(column).annotate(
+            links=Count('id'),
+        ).values_list(column, 'links')
+    ))
+
+
+def refresh_recipe_counts(model: Any, **filters: Any):
+    """Recount the recipes of tags or ingredients from the through table."""
+    through, column = RELATED[model]
+    links = through.objects.filter(**{column: OuterRef('pk')}).values(column).annotate(
+        links=Count('id'),
+    ).values('links')
+    model.objects.filter(**filters).update(
+        recipe_count=Coalesce(Subquery(links), 0),
+    )
+
+
+@contextmanager
+def counted_manually():
+    """Turn the signal handlers off while the caller adjusts the counts."""
+    previous = counting_enabled()
+    _state.manual = True
+    try:
+        yield
+    finally:
+        _state.manual = not previous
+
+
+def counting_enabled() -> bool:
+    """Return whether the signal handlers should maintain the counts."""
+    return not getattr(_state, 'manual', False)
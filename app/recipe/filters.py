@@ -0,0 +1,39 @@
+"""
+Filters for recipe APIs.
+"""
+from typing import Iterable
+
+from django.db.models import Exists, Model, OuterRef, QuerySet
+
+MATCH_ANY = 'any'
+MATCH_ALL = 'all'
+MATCH_CHOICES = [MATCH_ANY, MATCH_ALL]
+
+
+def filter_by_related(
+    queryset: QuerySet,
+    through: type[Model],
+    column: str,
+    ids: Iterable[int],
+    match: str = MATCH_ANY,
+) -> QuerySet:
+    """Filter recipes linked to the given ids through an M2M table.
+
+    Uses EXISTS semi-joins on the through table instead of joining it, so a
+    recipe is never duplicated and no DISTINCT is needed. Each EXISTS is
+    answered by the (recipe_id, <column>) unique index of the through table.
+    """
+    ids = sorted(set(ids))
+    if match == MATCH_ALL:
+        # One semi-join per id, the recipe must be linked to every one
+        for related_id in ids:
+            queryset = queryset.filter(Exists(through.objects.filter( # type:ignore
+                recipe_id=OuterRef('pk'),
+                **{column: related_id},
+            )))
+        return queryset
+
+    return queryset.filter(Exists(through.objects.filter( # type:ignore
+        recipe_id=OuterRef('pk'),
+        **{f'{column}__in': ids},
+    )))
@@ -0,0 +1,252 @@
+"""
+Background processing of uploaded recipe images.
+
+An upload is saved as sent and marked pending. Once the request's
+transaction commits, the file is handed to a process pool, so the upload
+returns right away and Pillow's CPU work never blocks a web worker. The
+worker rotates the image upright from its EXIF orientation, re-encodes
+it as a JPEG no larger than RECIPE_IMAGE_MAX_SIZE without any metadata,
+writes the RECIPE_IMAGE_THUMBNAIL_WIDTHS copies and a tiny placeholder.
+The dimensions and file names are then recorded on the recipe.
+
+process_image() only touches files and is safe to run in another
+process. Recording happens back in the web process, and is skipped when
+the recipe got another image in the meantime.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Optional
+import base64
+import io
+import logging
+import multiprocessing
+import os
+import threading
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from core.models import Recipe, IMAGE_FAILED, IMAGE_PENDING, IMAGE_READY
+from recipe.cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# Width of the placeholder, small enough to inline in every response
+PLACEHOLDER_WIDTH = 16
+
+_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Return the process pool, started on first use in each web worker."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Forking a threaded web worker can copy locks held by other
+            # threads, the pool processes start from a clean server process
+            # and set Django up to import this module
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=django.setup,
+            )
+        return _executor
+
+
+def to_rgb(image: Any) -> Any:
+    """Return the image in RGB, transparent areas on white."""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _save_jpeg(image: Any, path: str, quality: int):
+    """Write a JPEG atomically, no metadata is copied from the source."""
+    temporary = f'{path}.tmp'
+    image.save(temporary, format='JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(temporary, path)
+
+
+def process_image(
+    path: str,
+    max_size: int,
+    quality: int,
+    thumbnail_widths: list,
+) -> dict:
+    """Normalize the image at path and write its thumbnails next to it.
+
+    Returns the new file name (relative to the directory of path), the
+    final width and height, {width: file name} of the thumbnails and the
+    placeholder data URI.
+    """
+    with Image.open(path) as source:
+        image = to_rgb(ImageOps.exif_transpose(source))
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    width, height = image.size
+
+    directory, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    name = f'{stem}.jpg'
+    # A different original is deleted by record_result(), once the recipe
+    # points at the new file
+    _save_jpeg(image, os.path.join(directory, name), quality)
+
+    thumbnails = {}
+    for thumbnail_width in sorted(thumbnail_widths):
+        # Never upscaled, clients use the image itself when it is smaller
+        if thumbnail_width >= width:
+            break
+        thumbnail_name = f'{stem}_{thumbnail_width}.jpg'
+        thumbnail = image.resize(
+            (thumbnail_width, max(1, round(height * thumbnail_width / width))),
+            Image.LANCZOS,
+        )
+        _save_jpeg(thumbnail, os.path.join(directory, thumbnail_name), quality)
+        thumbnails[str(thumbnail_width)] = thumbnail_name
+
+    buffer = io.BytesIO()
+    image.resize(
+        (PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))),
+        Image.BILINEAR,
+    ).save(buffer, format='JPEG', quality=40)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+    return {
+        'name': name,
+        'width': width,
+        'height': height,
+        'thumbnails': thumbnails,
+        'placeholder': placeholder,
+    }
+
+
+def _arguments(name: str) -> tuple:
+    return (
+        default_storage.path(name),
+        settings.RECIPE_IMAGE_MAX_SIZE,
+        settings.RECIPE_IMAGE_QUALITY,
+        settings.RECIPE_IMAGE_THUMBNAIL_WIDTHS,
+    )
+
+
+def record_result(recipe_id: int, name: str, result: Optional[dict]):
+    """Store the outcome of processing an image, None when it failed."""
+    directory = os.path.dirname(name)
+    if result is None:
+        changes: dict = {'image_status': IMAGE_FAILED}
+    else:
+        changes = {
+            'image': os.path.join(directory, result['name']),
+            'image_status': IMAGE_READY,
+            'image_width': result['width'],
+            'image_height': result['height'],
+            'image_thumbnails': {
+                width: os.path.join(directory, thumbnail)
+                for width, thumbnail in result['thumbnails'].items()
+            },
+            'image_placeholder': result['placeholder'],
+        }
+
+    # Only while the recipe still has the image that was processed
+    recipes = Recipe.objects.filter(id=recipe_id, image=name)
+    user_ids = list(recipes.values_list('user_id', flat=True))
+    if recipes.update(**changes):
+        # update() sends no signals, drop the cached responses here
+        bump_data_version(user_ids[0])
+        if result is not None and changes['image'] != name:
+            # Re-encoded under a new name, nothing points at the upload now
+            default_storage.delete(name)
+    elif result is not None:
+        # Replaced or deleted while processing, the files belong to nobody
+        for file_name in [result['name'], *result['thumbnails'].values()]:
+            default_storage.delete(os.path.join(directory, file_name))
+
+
+def _finish(recipe_id: int, name: str, future: Future):
+    """Record the result of a pooled job, run on the pool's result thread."""
+    try:
+        error = future.exception()
+        if error is not None:
+            logger.error('Processing image %s of recipe %s failed: %r', name, recipe_id, error)
+        record_result(recipe_id, name, None if error else future.result())
+    except Exception:
+        logger.exception('Recording image %s of recipe %s failed', name, recipe_id)
+    finally:
+        # This thread outlives requests, do not keep a connection open
+        close_old_connections()
+
+
+def process_now(recipe_id: int, name: str):
+    """Process an image in this process and record the result."""
+    try:
+        result = process_image(*_arguments(name))
+    except Exception:
+        logger.exception('Processing image %s of recipe %s failed', name, recipe_id)
+        result = None
+    record_result(recipe_id, name, result)
+
+
+def submit(recipe_id: int, name: str):
+    """Process an image in the pool, or right here with 0 workers."""
+    global _executor
+    if settings.RECIPE_IMAGE_WORKERS <= 0:
+        process_now(recipe_id, name)
+        return
+
+    try:
+        future = _get_executor().submit(process_image, *_arguments(name))
+    except BrokenProcessPool:
+        # A pool process died, start a new pool and try once more
+        with _lock:
+            _executor = None
+        future = _get_executor().submit(process_image, *_arguments(name))
+    future.add_done_callback(lambda done: _finish(recipe_id, name, done))
+
+
+def pending_fields() -> dict:
+    """Return the processing fields of a recipe that got a new image."""
+    return {
+        'image_status': IMAGE_PENDING,
+        'image_width': None,
+        'image_height': None,
+        'image_thumbnails': {},
+        'image_placeholder': '',
+    }
+
+
+def image_files(recipe: Recipe) -> list:
+    """Return the stored files of a recipe's image, thumbnails included."""
+    if not recipe.image:
+        return []
+    return [recipe.image.name, *recipe.image_thumbnails.values()]
+
+
+def delete_files(names: list):
+    """Delete the files of image_files() and the resized copies of the image."""
+    # Imported here, recipe.resize imports this module
+    from recipe.resize import delete_copies
+
+    for name in names:
+        default_storage.delete(name)
+    if names:
+        delete_copies(os.path.splitext(os.path.basename(names[0]))[0])
+
+
+def schedule_deletion(names: list):
+    """Delete files once the current transaction commits."""
+    if names:
+        transaction.on_commit(lambda: delete_files(names))
+
+
+def schedule_processing(recipe: Recipe):
+    """Process the recipe's image once the current transaction commits."""
+    # The pool must only see files whose name is committed
+    name = recipe.image.name
+    transaction.on_commit(lambda: submit(recipe.id, name)) # type:ignore
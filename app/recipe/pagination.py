@@ -0,0 +1,128 @@
+"""
+Pagination for recipe APIs.
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination on recipe id.
+
+    Each page is fetched with `WHERE id < last_seen_id ORDER BY id DESC LIMIT n`,
+    so the cost stays the same however deep the client pages and no
+    COUNT(*) or OFFSET scan is ever run.
+
+    Searches are ordered by (search_rank, id). DRF only keys the cursor on
+    the first ordering field and skips past equal ranks with an OFFSET, so
+    here the cursor carries every ordering field and pages are filtered
+    with `WHERE (rank, id) < (last_rank, last_id)`. Positions are then
+    unique and the offset stays 0 however many recipes share a rank.
+    """
+    # Same order as RecipeViewSet.get_queryset, newest first
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    # Separates the ordering fields in a cursor position
+    position_separator = ','
+
+    def get_ordering(self, request, queryset, view):
+        """Order searches by relevance, newest first within the same rank."""
+        if 'search_rank' in queryset.query.annotations:
+            return ('-search_rank', '-id')
+
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Paginate like CursorPagination, filtering on every ordering field."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*[
+                order[1:] if order.startswith('-') else f'-{order}'
+                for order in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self._after_position(current_position, reverse))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _after_position(self, position, reverse):
+        """Return the filter for rows past a position in paging direction.
+
+        For (a, b) that is `a past x OR (a = x AND b past y)`.
+        """
+        values = position.split(self.position_separator)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip('-')
+            # Test for: (cursor reversed) XOR (field reversed)
+            lookup = 'lt' if reverse != order.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        """Return the values of all ordering fields, so positions are unique."""
+        values = []
+        for order in ordering:
+            field = order.lstrip('-')
+            if isinstance(instance, dict):
+                values.append(str(instance[field]))
+            else:
+                values.append(str(getattr(instance, field)))
+
+        return self.position_separator.join(values)
@@ -0,0 +1,197 @@
+"""
+Recipe images resized on demand, cached on disk.
+
+A resized copy lives at MEDIA_ROOT/resized/<stem>/<width>.<format>, the
+same path as its URL under MEDIA_URL. nginx serves existing copies
+straight from disk and only passes misses to Django, which resizes the
+uploaded image <stem>.* and writes the copy for next time. Only the
+widths in RECIPE_IMAGE_RESIZE_WIDTHS are made, so the number of copies
+per image is bounded.
+
+The directory is kept under RECIPE_IMAGE_CACHE_BYTES by deleting the
+least recently read copies, by access time since nginx hits never reach
+Python. With the usual relatime mount option access times move at most
+once a day, which is enough to tell hot copies from cold ones.
+"""
+from typing import BinaryIO, Optional
+import glob
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.validators import get_available_image_extensions
+from PIL import Image, ImageOps
+
+from recipe.images import to_rgb
+
+# URL extension: (Pillow format, content type)
+FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+# Evict down to this share of the budget, so not every write sweeps again
+LOW_WATERMARK = 0.9
+
+_lock = threading.Lock()
+# Cache size found by this process's last sweep, plus the bytes it wrote since
+_size: Optional[int] = None
+_last_sweep = 0.0
+
+
+def cache_dir() -> str:
+    return os.path.join(settings.MEDIA_ROOT, 'resized')
+
+
+def source_path(stem: str) -> Optional[str]:
+    """Return the path of the uploaded image with this file stem, if any."""
+    upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads', 'recipe')
+    # Processed images are JPEGs, pending ones keep their uploaded extension
+    processed = os.path.join(upload_dir, f'{stem}.jpg')
+    if os.path.exists(processed):
+        return processed
+    # Only extensions an upload can have, never the .tmp files still
+    # being written by the image processing
+    extensions = get_available_image_extensions()
+    for match in sorted(glob.glob(os.path.join(upload_dir, glob.escape(stem) + '.*'))):
+        if os.path.splitext(match)[1][1:].lower() in extensions:
+            return match
+    return None
+
+
+def resized_path(stem: str, width: int, extension: str) -> Optional[str]:
+    """Return the cached copy of an image at a width, making it if needed.
+
+    None when the image does not exist or cannot be read. Copies are
+    never wider than the image itself.
+    """
+    path = os.path.join(cache_dir(), stem, f'{width}.{extension}')
+    if os.path.exists(path):
+        return path
+
+    source = source_path(stem)
+    if source is None:
+        return None
+
+    try:
+        with Image.open(source) as original:
+            image = to_rgb(ImageOps.exif_transpose(original))
+    except OSError:
+        # Not an image Pillow can read
+        return None
+    if width < image.width:
+        image = image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS,
+        )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per writer, two workers making the same copy do not clash
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    image.save(
+        temporary,
+        format=FORMATS[extension][0],
+        quality=settings.RECIPE_IMAGE_QUALITY,
+    )
+    os.replace(temporary, path)
+
+    maybe_evict(os.path.getsize(path))
+    return path
+
+
+def open_resized(stem: str, width: int, extension: str) -> Optional[BinaryIO]:
+    """Open the cached copy of an image at a width, making it if needed.
+
+    A copy evicted between being found and being opened is made again.
+    None when the image does not exist or cannot be read.
+    """
+    for _ in range(2):
+        path = resized_path(stem, width, extension)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            continue
+
+    return None
+
+
+def delete_copies(stem: str):
+    """Delete every resized copy of an image."""
+    shutil.rmtree(os.path.join(cache_dir(), stem), ignore_errors=True)
+
+
+def evict(budget: int) -> int:
+    """Delete the least recently read copies beyond budget bytes.
+
+    Returns the number of files deleted.
+    """
+    return _evict(budget)[0]
+
+
+def _evict(budget: int) -> tuple:
+    """Evict like evict(), returning (files deleted, bytes left)."""
+    files = []
+    total = 0
+    for directory, _, names in os.walk(cache_dir()):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= budget:
+        return 0, total
+
+    deleted = 0
+    target = budget * LOW_WATERMARK
+    for _, size, path in sorted(files):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+
+    # Directories of images with no copies left
+    for directory, _, _ in os.walk(cache_dir(), topdown=False):
+        if directory != cache_dir():
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    return deleted, total
+
+
+def maybe_evict(written: int):
+    """Evict after this process wrote a copy, if the cache may be over budget.
+
+    The directory is only walked once this process's estimate of the size
+    passes the budget, or when it wrote copies and has not walked it for
+    RECIPE_IMAGE_CACHE_SWEEP_INTERVAL, to catch up with other workers.
+    Workers that only serve existing copies never walk it.
+    """
+    global _size, _last_sweep
+    now = time.monotonic()
+    budget = settings.RECIPE_IMAGE_CACHE_BYTES
+    with _lock:
+        if _size is not None:
+            _size += written
+            if _size <= budget and now - _last_sweep < settings.RECIPE_IMAGE_CACHE_SWEEP_INTERVAL:
+                return
+        _last_sweep = now
+        # Writes during the sweep keep counting from here, other threads
+        # do not sweep at the same time
+        _size = 0
+
+    _, left = _evict(budget)
+    with _lock:
+        _size += left
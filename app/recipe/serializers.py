@@ -1,13 +1,56 @@
 """
 Serializers for recipe APIs
 """
-from typing import Any, cast
+from collections import Counter
+from itertools import chain
+from typing import Any, Iterable, Optional
+import os
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from core.models import Recipe, Tag, Ingredient
+from core.metrics import TimedSerializerMixin, serializer_timer
+from core.models import Recipe, Tag, Ingredient, User
+from recipe.cache import bump_data_version
+from recipe.counts import adjust_recipe_counts
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+def bulk_get_or_create(model: Any, user: User, names: Iterable[str]) -> dict:
+    """Return {name: id} for the user's tags or ingredients, creating missing ones.
+
+    Runs one INSERT ... ON CONFLICT DO NOTHING against the unique
+    (user, name) constraint and one SELECT, whatever the number of names.
+    Concurrent requests adding the same name wait on each other's insert
+    instead of creating duplicates.
+    """
+    names = set(names)
+    if not names:
+        return {}
+
+    model.objects.bulk_create(
+        [model(user=user, name=name) for name in names],
+        ignore_conflicts=True,
+    )
+    return dict(
+        model.objects.filter(user=user, name__in=names).values_list('name', 'id')
+    )
+
+
+class SparseFieldsMixin:
+    """Serializer that can be limited to a subset of its fields."""
+    fields: Any
+
+    def __init__(self, *args: Any, fields: Optional[Iterable[str]] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs) # type:ignore
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for ingredients."""
     class Meta: # type:ignore
         model = Ingredient
@@ -15,7 +58,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for tags."""
 
     class Meta: # type:ignore
@@ -24,7 +67,69 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class TagCountSerializer(TagSerializer):
+    """Serializer for tags with the number of recipes using them."""
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['recipe_count']
+        read_only_fields = ['id', 'recipe_count']
+
+
+class IngredientCountSerializer(IngredientSerializer):
+    """Serializer for ingredients with the number of recipes using them."""
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ['recipe_count']
+        read_only_fields = ['id', 'recipe_count']
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Create many recipes with a handful of set-based queries."""
+
+    def create(self, validated_data: Any):
+        """Create recipes, their tags, ingredients and links in bulk."""
+        user = self.context['request'].user
+        tag_names = [[tag['name'] for tag in item.pop('tags', [])] for item in validated_data]
+        ingredient_names = [
+            [ingredient['name'] for ingredient in item.pop('ingredients', [])]
+            for item in validated_data
+        ]
+
+        with transaction.atomic():
+            tag_ids = bulk_get_or_create(Tag, user, chain.from_iterable(tag_names))
+            ingredient_ids = bulk_get_or_create(
+                Ingredient, user, chain.from_iterable(ingredient_names),
+            )
+            recipes = Recipe.objects.bulk_create(
+                Recipe(**item) for item in validated_data
+            )
+            # dict.fromkeys drops names repeated within a recipe
+            tag_links = Recipe.tags.through.objects.bulk_create([
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_ids[name]) # type:ignore
+                for recipe, names in zip(recipes, tag_names)
+                for name in dict.fromkeys(names)
+            ])
+            ingredient_links = Recipe.ingredients.through.objects.bulk_create([
+                Recipe.ingredients.through(
+                    recipe_id=recipe.id, # type:ignore
+                    ingredient_id=ingredient_ids[name],
+                )
+                for recipe, names in zip(recipes, ingredient_names)
+                for name in dict.fromkeys(names)
+            ])
+            adjust_recipe_counts(Tag, Counter(link.tag_id for link in tag_links))
+            adjust_recipe_counts(
+                Ingredient, Counter(link.ingredient_id for link in ingredient_links),
+            )
+
+        # bulk_create sends no signals, invalidate cached reads here
+        bump_data_version(user.id)
+        return recipes
+
+
+class RecipeSerializer(
+    SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer,
+):
     """Serializer for recipes. (By default readonly)"""
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
@@ -36,29 +141,43 @@ class RecipeSerializer(serializers.ModelSerializer):
             'ingredients',
         ]
         read_only_fields = ['id']
+        list_serializer_class = RecipeListSerializer
+
+    # Through table rows inserted or deleted by the last update
+    m2m_rows_touched = 0
 
     def _get_or_create_tags(self, tags: Any, recipe: Recipe):
         """Handle getting or creating tags as needed."""
         auth_user = self.context['request'].user
-        recipe_tags = cast(Any, recipe.tags) # type: ignore
-        for tag in tags:
-            tag_obj, _ = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag
-            )
-            recipe_tags.add(tag_obj) # type: ignore
+        tag_ids = bulk_get_or_create(Tag, auth_user, [tag['name'] for tag in tags])
+        if tag_ids:
+            recipe.tags.add(*tag_ids.values()) # type: ignore
 
     def _get_or_create_ingredients(self, ingredients: Any, recipe: Recipe):
         """Handle getting or creating ingredients as needed."""
         auth_user = self.context['request'].user
-        recipe_ingredients = cast(Any, recipe.ingredients) # type: ignore
-        for ingredient in ingredients:
-            ingredient_obj, _ = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient
-            )
-            recipe_ingredients.add(ingredient_obj)
+        ingredient_ids = bulk_get_or_create(
+            Ingredient, auth_user, [ingredient['name'] for ingredient in ingredients],
+        )
+        if ingredient_ids:
+            recipe.ingredients.add(*ingredient_ids.values())
 
+    def _set_related(self, recipe: Recipe, field: str, model: Any, items: Any):
+        """Replace the tags or ingredients of a recipe, writing only the difference."""
+        auth_user = self.context['request'].user
+        wanted = set(bulk_get_or_create(
+            model, auth_user, [item['name'] for item in items],
+        ).values())
+        manager = getattr(recipe, field)
+        # Served from the prefetch cache when the view loaded the recipe
+        current = {obj.id for obj in manager.all()}
+        removed = current - wanted
+        added = wanted - current
+        if removed:
+            manager.remove(*removed)
+        if added:
+            manager.add(*added)
+        self.m2m_rows_touched += len(removed) + len(added)
 
     def create(self, validated_data: Any):
         """Create a recipe."""
@@ -74,12 +193,11 @@ class RecipeSerializer(serializers.ModelSerializer):
         """Update a recipe"""
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
+        self.m2m_rows_touched = 0
         if tags is not None:
-            instance.tags.clear() # type: ignore
-            self._get_or_create_tags(tags, instance)
+            self._set_related(instance, 'tags', Tag, tags)
         if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+            self._set_related(instance, 'ingredients', Ingredient, ingredients)
 
         # Assign everything else to instance except for tags
         for attr, value in validated_data.items():
@@ -89,20 +207,212 @@ class RecipeSerializer(serializers.ModelSerializer):
         return instance
 
 
+class RecipeRowSerializer:
+    """Read-only RecipeSerializer for lists, built from values() rows.
+
+    Produces exactly the output of RecipeSerializer(many=True) without
+    creating a serializer per recipe. Tags and ingredients of all rows are
+    fetched in one query each and nested in the same (id) order the
+    recipe views prefetch them in.
+    """
+    related_fields = ['tags', 'ingredients']
+
+    def __init__(
+        self,
+        rows: Iterable[dict],
+        fields: Optional[Iterable[str]] = None,
+        serializer_class: Any = None,
+    ):
+        self.rows = list(rows)
+        # Serializer whose output is reproduced, RecipeSerializer by default
+        self.serializer_class = serializer_class or RecipeSerializer
+        self.fields = list(fields or self.serializer_class.Meta.fields)
+
+    @staticmethod
+    def columns(fields: Iterable[str]) -> list:
+        """Return the recipe columns to load for the given fields."""
+        return [
+            name for name in fields
+            if name not in RecipeRowSerializer.related_fields
+        ]
+
+    def _related_map(self, name: str, recipe_ids: list) -> dict:
+        """Return {recipe_id: [{'id', 'name'}, ...]} for an M2M field."""
+        m2m = getattr(Recipe, name)
+        # Through table FK to the related model, e.g. tag
+        column = m2m.field.m2m_reverse_field_name()
+        related: dict = {recipe_id: [] for recipe_id in recipe_ids}
+        links = m2m.through.objects.filter(recipe_id__in=recipe_ids).order_by(
+            f'{column}_id',
+        ).values_list('recipe_id', f'{column}_id', f'{column}__name')
+        for recipe_id, related_id, related_name in links:
+            related[recipe_id].append({'id': related_id, 'name': related_name})
+
+        return related
+
+    @property
+    def data(self) -> list:
+        """Return the serialized rows."""
+        recipe_ids = [row['id'] for row in self.rows]
+        related = {
+            name: self._related_map(name, recipe_ids)
+            for name in self.related_fields if name in self.fields
+        }
+        # Reuse the field classes so values are formatted exactly the same
+        serializer_fields = self.serializer_class().fields
+        to_representation = {
+            name: serializer_fields[name].to_representation
+            for name in self.fields if name not in related
+        }
+
+        data = []
+        with serializer_timer():
+            for row in self.rows:
+                item = {}
+                for name in self.fields:
+                    if name in related:
+                        item[name] = related[name][row['id']]
+                    else:
+                        value = row[name]
+                        item[name] = None if value is None else to_representation[name](value)
+                data.append(item)
+
+        return data
+
+
+# The uploaded image and what recipe.images made of it
+IMAGE_FIELDS = [
+    'image', 'image_status', 'image_width', 'image_height',
+    'image_thumbnails', 'image_placeholder', 'image_resized_url',
+]
+
+
+@extend_schema_field(OpenApiTypes.OBJECT)
+class ThumbnailsField(serializers.Field):
+    """Read-only {width: URL} of the resized copies of a recipe image."""
+
+    def __init__(self, **kwargs: Any):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value: dict):
+        # Same URLs as ImageField, absolute when there is a request
+        request = self.context.get('request')
+        urls = {}
+        for width, name in value.items():
+            url = default_storage.url(name)
+            urls[width] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
+@extend_schema_field(OpenApiTypes.STR)
+class ResizedUrlField(serializers.Field):
+    """Read-only URL template of the on-demand resized copies of a recipe image.
+
+    Clients replace {width} with one of RECIPE_IMAGE_RESIZE_WIDTHS and
+    {format} with jpg or webp, see recipe.resize.
+    """
+
+    def __init__(self, **kwargs: Any):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value: Any):
+        if not value:
+            return None
+        stem = os.path.splitext(os.path.basename(value.name))[0]
+        url = default_storage.url(f'resized/{stem}/')
+        request = self.context.get('request')
+        if request:
+            url = request.build_absolute_uri(url)
+        # Added after the URL is built, which would escape the braces
+        return url + '{width}.{format}'
+
+
 # Extension of RecipeSerializer
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for recipe detail view."""
+    image_thumbnails = ThumbnailsField()
+    image_resized_url = ResizedUrlField(
+        source='image',
+        allow_null=True,
+        help_text=(
+            'URL of the image at any width, replace {width} with one of '
+            + ', '.join(str(width) for width in settings.RECIPE_IMAGE_RESIZE_WIDTHS)
+            + ' and {format} with jpg or webp'
+        ),
+    )
+
+    image_fields = IMAGE_FIELDS
 
     class Meta(RecipeSerializer.Meta):
-        fields = RecipeSerializer.Meta.fields + ['description', 'image']
+        fields = RecipeSerializer.Meta.fields + ['description'] + IMAGE_FIELDS
+
+
+class RecipeChangesSerializer(serializers.ModelSerializer):
+    """Serializer for the fields a bulk update can set."""
+
+    class Meta:
+        model = Recipe
+        fields = ['title', 'time_minutes', 'price', 'link', 'description']
+        extra_kwargs = {
+            'title': {'required': False},
+            'time_minutes': {'required': False},
+            'price': {'required': False},
+        }
+
+
+class RecipeSelectionSerializer(serializers.Serializer):
+    """Serializer for the recipes a bulk action applies to.
+
+    Recipes are picked either by id or with the same filters as the
+    recipe list, e.g. {"filter": {"tags": "1,2", "match": "all"}}.
+    """
+    filter_keys = ['tags', 'ingredients', 'search', 'match']
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+    )
+    filter = serializers.DictField(child=serializers.CharField(), required=False)
+
+    def validate_filter(self, value: dict):
+        unknown = set(value) - set(self.filter_keys)
+        if unknown:
+            raise serializers.ValidationError(
+                f'Unknown filters: {", ".join(sorted(unknown))}.'
+            )
+        return value
+
+    def validate(self, attrs: Any):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('Provide either ids or filter.')
+        return attrs
+
+
+class RecipeBulkUpdateSerializer(RecipeSelectionSerializer):
+    """Serializer for a partial change applied to many recipes."""
+    changes = RecipeChangesSerializer(required=False)
+    add_tags = TagSerializer(many=True, required=False)
+    remove_tags = TagSerializer(many=True, required=False)
+    add_ingredients = IngredientSerializer(many=True, required=False)
+    remove_ingredients = IngredientSerializer(many=True, required=False)
+
+    def validate(self, attrs: Any):
+        attrs = super().validate(attrs)
+        operations = [
+            'changes', 'add_tags', 'remove_tags', 'add_ingredients', 'remove_ingredients',
+        ]
+        if not any(attrs.get(name) for name in operations):
+            raise serializers.ValidationError('No changes given.')
+        return attrs
 
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for uploading images to recipes."""
 
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_status']
         read_only_fields = ['id']
         extra_kwargs = {
             'image': {
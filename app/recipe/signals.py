@@ -0,0 +1,95 @@
+"""
+Signal handlers for recipe APIs.
+"""
+from typing import Any
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.cache import bump_data_version, invalidation_enabled
+from recipe.counts import (
+    THROUGH,
+    adjust_recipe_counts,
+    counting_enabled,
+    linked_counts,
+    refresh_recipe_counts,
+)
+from recipe.images import image_files, schedule_deletion
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_on_write(sender: Any, instance: Any, **kwargs: Any):
+    """Invalidate cached responses of the owner of a changed object."""
+    if invalidation_enabled():
+        bump_data_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_on_link_change(sender: Any, instance: Any, action: str, **kwargs: Any):
+    """Invalidate cached responses when recipe tags or ingredients change."""
+    if action in ('post_add', 'post_remove', 'post_clear') and invalidation_enabled():
+        bump_data_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def count_link_change(
+    sender: Any,
+    instance: Any,
+    action: str,
+    reverse: bool,
+    pk_set: Any,
+    **kwargs: Any,
+):
+    """Keep the recipe counts of tags and ingredients up to date."""
+    if not counting_enabled():
+        return
+
+    # Recounted rather than adjusted: add() may report links a concurrent
+    # request created too, and remove() links it deleted first
+    model, column = THROUGH[sender]
+    if action == 'post_add':
+        refresh_recipe_counts(model, id__in=[instance.pk] if reverse else pk_set)
+    elif action in ('pre_remove', 'pre_clear'):
+        # remove() passes every id it was given, linked or not, and clear()
+        # passes none, so look up the links before they are deleted
+        own, other = (column, 'recipe_id') if reverse else ('recipe_id', column)
+        links = sender.objects.filter(**{own: instance.pk})
+        if pk_set is not None:
+            links = links.filter(**{f'{other}__in': pk_set})
+        instance._removed_links = set(links.values_list(column, flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        removed = getattr(instance, '_removed_links', set())
+        if removed:
+            refresh_recipe_counts(model, id__in=removed)
+
+
+@receiver(pre_delete, sender=Recipe)
+def collect_recipe_links(sender: Any, instance: Any, **kwargs: Any):
+    """Remember the tags and ingredients of a recipe about to be deleted."""
+    # Deleting a recipe cascades to its links without any m2m_changed
+    if counting_enabled():
+        instance._deleted_links = {
+            model: linked_counts(model, [instance.pk]) for model in (Tag, Ingredient)
+        }
+
+
+@receiver(post_delete, sender=Recipe)
+def count_recipe_delete(sender: Any, instance: Any, **kwargs: Any):
+    """Uncount the tags and ingredients of a deleted recipe."""
+    for model, links in getattr(instance, '_deleted_links', {}).items():
+        adjust_recipe_counts(model, {pk: -count for pk, count in links.items()})
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image(sender: Any, instance: Any, **kwargs: Any):
+    """Delete the image, thumbnails and resized copies of a deleted recipe."""
+    # Once committed, a rolled back delete still has its files
+    schedule_deletion(image_files(instance))
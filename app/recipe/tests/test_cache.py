@@ -0,0 +1,211 @@
+"""
+Tests for the recipe API response cache.
+"""
+from typing import Any, cast
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework.response import Response
+
+from core.models import Recipe, Tag, UserManager
+
+from recipe.cache import cache_stats
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id: str):
+    """Create and return a recipe detail URL."""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+def create_user(email: str = 'user@example.com', password: str = 'testpass123'):
+    """Create and return a new user."""
+    return cast(UserManager, get_user_model().objects).create_user(email, password)
+
+def create_recipe(user: Any, **params: Any):
+    """Create and return a sample recipe."""
+    defaults: dict[str, Any] = {
+        'title': 'Sample recipe title',
+        'time_minutes': 22,
+        'price': Decimal('5.25'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ResponseCacheTests(TestCase):
+    """Test caching of recipe API reads."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_repeated_list_served_from_cache(self):
+        """Test listing recipes twice only queries the database once."""
+        create_recipe(user=self.user)
+        res: Response = cast(Response, self.client.get(RECIPES_URL))
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            cached: Response = cast(Response, self.client.get(RECIPES_URL))
+
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_query_params_normalized(self):
+        """Test query params in a different order share a cache entry."""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.get(RECIPES_URL, {'tags': tag.id, 'match': 'all'}) # type:ignore
+
+        res: Response = cast(Response, self.client.get(
+            f'{RECIPES_URL}?match=all&tags={tag.id}' # type:ignore
+        ))
+        self.assertEqual(res['X-Cache'], 'HIT')
+
+        res = cast(Response, self.client.get(RECIPES_URL, {'tags': tag.id})) # type:ignore
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_update_invalidates_detail(self):
+        """Test updating a recipe is visible on the next read."""
+        recipe = create_recipe(user=self.user, title='Old title')
+        url = detail_url(recipe.id) # type:ignore
+        self.client.get(url)
+
+        self.client.patch(url, {'title': 'New title'})
+        res: Response = cast(Response, self.client.get(url))
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(cast(Any, res.data)['title'], 'New title')
+
+    def test_nested_tag_create_invalidates_tags(self):
+        """Test tags created through a recipe show up in the tag list."""
+        recipe = create_recipe(user=self.user)
+        res: Response = cast(Response, self.client.get(TAGS_URL))
+        self.assertEqual(res.data, [])
+
+        self.client.patch(
+            detail_url(recipe.id), # type:ignore
+            {'tags': [{'name': 'Lunch'}]},
+            format='json',
+        )
+        res = cast(Response, self.client.get(TAGS_URL))
+
+        self.assertEqual([tag['name'] for tag in cast(Any, res.data)], ['Lunch'])
+
+    def test_tag_delete_invalidates_recipes(self):
+        """Test deleting a tag through the tag API refreshes recipe reads."""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag) # type:ignore
+        self.client.get(RECIPES_URL)
+
+        self.client.delete(reverse('recipe:tag-detail', args=[tag.id])) # type:ignore
+        res: Response = cast(Response, self.client.get(RECIPES_URL))
+
+        self.assertEqual(cast(Any, res.data)['results'][0]['tags'], [])
+
+    def test_cache_limited_to_user(self):
+        """Test cached responses are never shared between users."""
+        create_recipe(user=self.user)
+        self.client.get(RECIPES_URL)
+
+        other_user = create_user(email='other@example.com')
+        self.client.force_authenticate(other_user)
+        res: Response = cast(Response, self.client.get(RECIPES_URL))
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(cast(Any, res.data)['results'], [])
+
+    def test_errors_not_cached(self):
+        """Test error responses are not stored."""
+        self.client.get(RECIPES_URL, {'match': 'some'})
+        res: Response = cast(Response, self.client.get(RECIPES_URL, {'match': 'some'}))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(cache_stats(), {'hits': 0, 'misses': 2})
+
+
+class ConditionalGetTests(TestCase):
+    """Test ETag and If-None-Match handling of recipe API reads."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_list_not_modified(self):
+        """Test an unchanged recipe list returns 304 without queries."""
+        create_recipe(user=self.user)
+        res: Response = cast(Response, self.client.get(RECIPES_URL))
+        etag = res['ETag']
+
+        with self.assertNumQueries(0):
+            res = cast(Response, self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag))
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+
+    def test_change_gives_new_etag(self):
+        """Test a write makes the old ETag stale for detail reads."""
+        recipe = create_recipe(user=self.user)
+        url = detail_url(recipe.id) # type:ignore
+        etag = cast(Response, self.client.get(url))['ETag']
+
+        self.client.patch(url, {'title': 'New title'})
+        res: Response = cast(Response, self.client.get(url, HTTP_IF_NONE_MATCH=etag))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_weak_and_listed_etags(self):
+        """Test If-None-Match with several and weak validators on tags."""
+        Tag.objects.create(user=self.user, name='Vegan')
+        etag = cast(Response, self.client.get(TAGS_URL))['ETag']
+
+        res: Response = cast(Response, self.client.get(
+            TAGS_URL, HTTP_IF_NONE_MATCH=f'"other", W/{etag}'
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_any_etag_only_for_existing_recipes(self):
+        """Test If-None-Match: * is a 304 for a recipe and 404 without one."""
+        recipe = create_recipe(user=self.user)
+        other = create_recipe(user=create_user(email='other@example.com'))
+
+        res: Response = cast(Response, self.client.get(
+            detail_url(recipe.id), HTTP_IF_NONE_MATCH='*' # type:ignore
+        ))
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        for recipe_id in [other.id, recipe.id + 1000]: # type:ignore
+            res = cast(Response, self.client.get(
+                detail_url(recipe_id), HTTP_IF_NONE_MATCH='*'
+            ))
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_etag_differs_per_query_and_user(self):
+        """Test ETags are specific to query params and users."""
+        etag = cast(Response, self.client.get(RECIPES_URL))['ETag']
+
+        res: Response = cast(Response, self.client.get(
+            RECIPES_URL, {'search': 'curry'}, HTTP_IF_NONE_MATCH=etag
+        ))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(create_user(email='other@example.com'))
+        res = cast(Response, self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
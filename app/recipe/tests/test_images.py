@@ -0,0 +1,246 @@
+"""
+Tests for recipe image processing.
+"""
+from decimal import Decimal
+from typing import Any, cast
+from unittest.mock import patch
+import io
+import os
+import tempfile
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Recipe, UserManager, IMAGE_FAILED, IMAGE_PENDING, IMAGE_READY
+from recipe import images
+from recipe.images import process_image, record_result
+from recipe.resize import cache_dir, resized_path
+
+# EXIF tag of the camera orientation, 6 means rotate 90 degrees clockwise
+ORIENTATION = 0x0112
+
+
+def image_file(size: tuple, image_format: str = 'JPEG', orientation: Any = None):
+    """Return an in-memory image file to upload."""
+    buffer = io.BytesIO()
+    image = Image.new('RGB', size, (200, 50, 50))
+    options = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[ORIENTATION] = orientation
+        options['exif'] = exif.tobytes()
+    image.save(buffer, format=image_format, **options)
+    buffer.name = f'photo.{image_format.lower()}'
+    buffer.seek(0)
+    return buffer
+
+
+@override_settings(RECIPE_IMAGE_WORKERS=0, RECIPE_IMAGE_MAX_SIZE=400)
+class ImageProcessingTests(TestCase):
+    """Test uploaded images are processed after the upload commits."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = cast(UserManager, get_user_model().objects).create_user(
+            'user@example.com', 'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=5, price=Decimal('5.00'),
+        )
+        self.upload_url = reverse('recipe:recipe-upload-image', args=[self.recipe.id])
+        self.detail_url = reverse('recipe:recipe-detail', args=[self.recipe.id])
+
+    def tearDown(self):
+        """Remove the image, its thumbnails and resized copies."""
+        recipe = Recipe.objects.filter(id=self.recipe.id).first()
+        if recipe is not None:
+            images.delete_files(images.image_files(recipe))
+
+    def _upload(self, upload: Any):
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(self.upload_url, {'image': upload}, format='multipart')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['image_status'], IMAGE_PENDING) # type:ignore
+        self.recipe.refresh_from_db()
+
+    def test_image_normalized(self):
+        """Test the image is rotated upright and saved without metadata."""
+        self._upload(image_file((40, 20), orientation=6))
+
+        self.assertEqual(self.recipe.image_status, IMAGE_READY)
+        self.assertEqual((self.recipe.image_width, self.recipe.image_height), (20, 40))
+        with Image.open(self.recipe.image.path) as processed:
+            self.assertEqual(processed.size, (20, 40))
+            self.assertEqual(len(processed.getexif()), 0)
+
+    def test_size_capped_with_thumbnails(self):
+        """Test large images are scaled down, re-encoded and resized."""
+        self._upload(image_file((800, 400), image_format='PNG'))
+
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+        self.assertEqual((self.recipe.image_width, self.recipe.image_height), (400, 200))
+        # 640 is wider than the image, no copy is made
+        self.assertEqual(sorted(self.recipe.image_thumbnails), ['160', '320'])
+        with Image.open(default_storage.path(self.recipe.image_thumbnails['160'])) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 80))
+            self.assertEqual(thumbnail.format, 'JPEG')
+
+    def test_original_deleted_once_recorded(self):
+        """Test a re-encoded upload is only deleted after the recipe points at the JPEG."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                self.upload_url, {'image': image_file((40, 20), image_format='PNG')},
+                format='multipart',
+            )
+        self.recipe.refresh_from_db()
+        original = self.recipe.image.name
+
+        with patch('recipe.images.record_result', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                for callback in callbacks:
+                    callback()
+        # Recording failed, the recipe still points at an existing file
+        self.assertTrue(default_storage.exists(original))
+        default_storage.delete(original.replace('.png', '.jpg'))
+
+        for callback in callbacks:
+            callback()
+
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+        self.assertFalse(default_storage.exists(original))
+
+    def _resize(self) -> str:
+        """Make a resized copy of the image, return the directory of its copies."""
+        stem = os.path.splitext(os.path.basename(self.recipe.image.name))[0]
+        self.assertIsNotNone(resized_path(stem, 80, 'jpg'))
+        return os.path.join(cache_dir(), stem)
+
+    def test_replaced_image_deleted(self):
+        """Test uploading another image deletes the old one, its thumbnails and copies."""
+        self._upload(image_file((800, 400), image_format='PNG'))
+        previous = [self.recipe.image.name, *self.recipe.image_thumbnails.values()]
+        self.assertEqual(len(previous), 3)
+        copies = self._resize()
+        self.assertTrue(os.path.isdir(copies))
+
+        self._upload(image_file((800, 400)))
+
+        for name in previous:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(os.path.exists(copies))
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+
+    def test_deleted_recipe_image_deleted(self):
+        """Test deleting a recipe deletes its image, thumbnails and copies."""
+        self._upload(image_file((800, 400)))
+        files = images.image_files(self.recipe)
+        copies = self._resize()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.delete(self.detail_url)
+
+        self.assertEqual(res.status_code, 204)
+        for name in files:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(os.path.exists(copies))
+
+    def test_processed_image_in_detail(self):
+        """Test the detail view shows the processed image."""
+        self._upload(image_file((800, 400)))
+
+        res = self.client.get(self.detail_url)
+
+        data = cast(Any, res.data)
+        self.assertEqual(data['image_status'], IMAGE_READY)
+        self.assertEqual(data['image_width'], 400)
+        self.assertTrue(data['image_thumbnails']['320'].startswith('http://testserver/'))
+        self.assertTrue(data['image_placeholder'].startswith('data:image/jpeg;base64,'))
+        stem = os.path.splitext(os.path.basename(self.recipe.image.name))[0]
+        self.assertEqual(
+            data['image_resized_url'].format(width=320, format='webp'),
+            'http://testserver' + reverse(
+                'resized-image', kwargs={'stem': stem, 'width': 320, 'extension': 'webp'},
+            ),
+        )
+
+    def test_missing_file_marked_failed(self):
+        """Test an image that cannot be processed is marked failed."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                self.upload_url, {'image': image_file((40, 20))}, format='multipart',
+            )
+        self.recipe.refresh_from_db()
+        default_storage.delete(self.recipe.image.name)
+
+        with self.assertLogs('recipe.images', 'ERROR'):
+            for callback in callbacks:
+                callback()
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status, IMAGE_FAILED)
+
+    def test_pending_images_processed_by_command(self):
+        """Test the command processes images that are still pending."""
+        with self.captureOnCommitCallbacks():
+            self.client.post(
+                self.upload_url, {'image': image_file((40, 20))}, format='multipart',
+            )
+
+        call_command('process_recipe_images', stdout=io.StringIO())
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status, IMAGE_READY)
+        self.assertEqual(self.recipe.image_width, 40)
+
+    def test_result_for_replaced_image_discarded(self):
+        """Test results for an image the recipe no longer has are dropped."""
+        self._upload(image_file((800, 400)))
+        stale = default_storage.save(
+            os.path.join(os.path.dirname(self.recipe.image.name), 'stale.jpg'),
+            image_file((10, 10)),
+        )
+
+        record_result(self.recipe.id, 'uploads/recipe/replaced.jpg', { # type:ignore
+            'name': os.path.basename(stale),
+            'width': 10,
+            'height': 10,
+            'thumbnails': {},
+            'placeholder': '',
+        })
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_width, 400)
+        self.assertFalse(default_storage.exists(stale))
+
+
+class ProcessImageTests(TestCase):
+    """Test images are processed in a separate process."""
+
+    def test_process_in_pool(self):
+        """Test process_image runs in the process pool of the web workers."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'photo.jpg')
+            with open(path, 'wb') as upload:
+                upload.write(image_file((500, 250)).getvalue())
+
+            with override_settings(RECIPE_IMAGE_WORKERS=1):
+                executor = images._get_executor()
+            self.addCleanup(setattr, images, '_executor', None)
+            self.addCleanup(executor.shutdown)
+            result = executor.submit(process_image, path, 2048, 85, [160, 320, 640]).result()
+
+            self.assertEqual((result['width'], result['height']), (500, 250))
+            self.assertEqual(result['thumbnails'], {'160': 'photo_160.jpg', '320': 'photo_320.jpg'})
+            self.assertTrue(os.path.exists(os.path.join(directory, 'photo_320.jpg')))
@@ -139,3 +139,39 @@ class PrivateIngredientsApiTests(TestCase):
 
         # Should only return 1 egg
         self.assertEqual(len(res.data), 1)  # type:ignore
+
+    def test_typeahead_ingredients(self):
+        """Test looking up ingredients by a case insensitive name prefix."""
+        Ingredient.objects.create(user=self.user, name='Garlic')
+        Ingredient.objects.create(user=self.user, name='garam masala')
+        Ingredient.objects.create(user=self.user, name='Ginger')
+
+        res: Response = cast(Response, self.client.get(INGREDIENTS_URL, {'q': 'Ga'}))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        names = [ingredient['name'] for ingredient in cast(Any, res.data)]
+        self.assertEqual(names, ['garam masala', 'Garlic'])
+
+    def test_typeahead_invalid_limit(self):
+        """Test a non numeric typeahead limit returns an error."""
+        res: Response = cast(Response, self.client.get(
+            INGREDIENTS_URL, {'q': 'ga', 'limit': 'ten'}
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ingredients_with_recipe_count(self):
+        """Test listing ingredients with the number of recipes using them."""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=Decimal('4.50'),
+        )
+        recipe.ingredients.add(salt, pepper)
+        recipe.ingredients.remove(pepper)
+
+        res: Response = cast(Response, self.client.get(
+            INGREDIENTS_URL, {'recipe_count': 1, 'assigned_only': 1}
+        ))
+
+        self.assertEqual(res.data, [{'id': salt.id, 'name': 'Salt', 'recipe_count': 1}]) # type:ignore
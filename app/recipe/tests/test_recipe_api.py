@@ -3,27 +3,41 @@ Tests for recipe APIs
 """
 from typing import Any, cast
 from decimal import Decimal
+from unittest.mock import patch
+import base64
+import gzip
+import json
+import re
 import tempfile
 import os
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 
 from core.models import Recipe, User, UserManager, Tag, Ingredient
 
+from recipe.cache import get_data_version
 from recipe.serializers import (
     RecipeSerializer,
     RecipeDetailSerializer,
 )
 
 RECIPES_URL = reverse('recipe:recipe-list')
+EXPORT_URL = reverse('recipe:recipe-export')
+BULK_URL = reverse('recipe:recipe-bulk')
+FACETS_URL = reverse('recipe:recipe-facets')
 
 def detail_url(recipe_id: str):
     """Create and return a recipe detail URL."""
@@ -47,6 +61,14 @@ def create_recipe(user: User, **params: Any):
     recipe = Recipe.objects.create(user=user, **defaults)
     return recipe
 
+def with_ordered_relations(recipes: Any):
+    """Prefetch tags and ingredients in id order, like the API returns them."""
+    return recipes.prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.order_by('id')),
+        Prefetch('ingredients', queryset=Ingredient.objects.order_by('id')),
+    )
+
+
 def create_user(**params: Any):
     """Create and return a new user."""
     return cast(UserManager, get_user_model().objects).create_user(**params)
@@ -85,7 +107,7 @@ class PrivateRecipeAPITests(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(cast(Any, res.data)['results'], serializer.data)
 
     def test_recipe_list_limited_to_user(self):
         """Test list of recipes is limited to authenticated user."""
@@ -99,7 +121,7 @@ class PrivateRecipeAPITests(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(cast(Any, res.data)['results'], serializer.data)
 
     def test_get_recipe_detail(self):
         """Test get recipe detail."""
@@ -392,6 +414,89 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(recipe.ingredients.count(), 0)
 
+    def test_create_recipe_repeated_tag_names(self):
+        """Test repeating a tag name in one recipe links a single tag."""
+        payload: Any = {
+            'title': 'Pongal',
+            'time_minutes': 60,
+            'price': Decimal('4.50'),
+            'tags': [{'name': 'Indian'}, {'name': 'Indian'}],
+        }
+
+        res: Response = cast(Response, self.client.post(RECIPES_URL, payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tag.objects.filter(user=self.user, name='Indian').count(), 1)
+        self.assertEqual(len(cast(Any, res.data)['tags']), 1)
+
+    def test_create_recipe_queries_constant_in_tags(self):
+        """Test nested tags and ingredients cost the same queries at any count."""
+        def payload(count: int):
+            return {
+                'title': 'Curry',
+                'time_minutes': 30,
+                'price': '5.00',
+                'tags': [{'name': f'Tag {i}'} for i in range(count)],
+                'ingredients': [{'name': f'Ingredient {i}'} for i in range(count)],
+            }
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(RECIPES_URL, payload(1), format='json')
+        self.client.force_authenticate(create_user(email='other@example.com', password='test123'))
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(RECIPES_URL, payload(20), format='json')
+
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    @override_settings(DEBUG=True)
+    def test_update_tags_writes_difference(self):
+        """Test updating tags only touches links that changed."""
+        tags = [Tag.objects.create(user=self.user, name=f'Tag {i}') for i in range(3)]
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(*tags) # type:ignore
+        through = Recipe.tags.through # type:ignore
+        kept_link_ids = list(through.objects.filter(
+            recipe_id=recipe.id, tag_id__in=[tags[0].id, tags[1].id], # type:ignore
+        ).values_list('id', flat=True))
+
+        payload: Any = {'tags': [{'name': 'Tag 0'}, {'name': 'Tag 1'}, {'name': 'New'}]}
+        url:str = detail_url(recipe.id) # type:ignore
+        res: Response = cast(Response, self.client.patch(url, payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # Tag 2 removed, New added, the other links are left as they were
+        self.assertEqual(res['X-M2M-Rows-Touched'], '2')
+        self.assertEqual(
+            sorted(tag.name for tag in recipe.tags.all()), # type:ignore
+            ['New', 'Tag 0', 'Tag 1'],
+        )
+        self.assertEqual(
+            through.objects.filter(id__in=kept_link_ids).count(), 2,
+        )
+
+    @override_settings(DEBUG=True)
+    def test_update_same_ingredients_touches_nothing(self):
+        """Test resending the current ingredients writes no links."""
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = create_recipe(user=self.user)
+        recipe.ingredients.add(ingredient)
+
+        payload: Any = {'ingredients': [{'name': 'Salt'}]}
+        url:str = detail_url(recipe.id) # type:ignore
+        res: Response = cast(Response, self.client.patch(url, payload, format='json'))
+
+        self.assertEqual(res['X-M2M-Rows-Touched'], '0')
+        self.assertEqual(list(recipe.ingredients.all()), [ingredient])
+
+    def test_rows_touched_header_only_when_debugging(self):
+        """Test the write volume header is not sent in production."""
+        recipe = create_recipe(user=self.user)
+        url:str = detail_url(recipe.id) # type:ignore
+
+        res: Response = cast(Response, self.client.patch(url, {'tags': []}, format='json'))
+
+        self.assertNotIn('X-M2M-Rows-Touched', res)
+
     def test_filter_by_tags(self):
         """Test filtering recipes by tags."""
         recipe1 = create_recipe(user=self.user, title='Thai Vegetable Curry')
@@ -410,9 +515,9 @@ class PrivateRecipeAPITests(TestCase):
         serializer2 = RecipeSerializer(recipe2)
         serializer3 = RecipeSerializer(recipe3)
 
-        self.assertIn(serializer1.data, res.data) # type:ignore
-        self.assertIn(serializer2.data, res.data) # type:ignore
-        self.assertNotIn(serializer3.data, res.data) # type:ignore
+        self.assertIn(serializer1.data, cast(Any, res.data)['results'])
+        self.assertIn(serializer2.data, cast(Any, res.data)['results'])
+        self.assertNotIn(serializer3.data, cast(Any, res.data)['results'])
 
     def test_filter_by_ingredients(self):
         """Test filtering recipes by ingredients."""
@@ -431,9 +536,760 @@ class PrivateRecipeAPITests(TestCase):
         serializer2 = RecipeSerializer(recipe2)
         serializer3 = RecipeSerializer(recipe3)
 
-        self.assertIn(serializer1.data, res.data) # type:ignore
-        self.assertIn(serializer2.data, res.data) # type:ignore
-        self.assertNotIn(serializer3.data, res.data) # type:ignore
+        self.assertIn(serializer1.data, cast(Any, res.data)['results'])
+        self.assertIn(serializer2.data, cast(Any, res.data)['results'])
+        self.assertNotIn(serializer3.data, cast(Any, res.data)['results'])
+
+    def test_filter_match_all_tags_and_ingredients(self):
+        """Test filtering recipes that have all given tags and ingredients."""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Quick')
+        ingredient = Ingredient.objects.create(user=self.user, name='Tofu')
+        recipe1 = create_recipe(user=self.user, title='Tofu Stir Fry')
+        recipe1.tags.add(tag1, tag2) # type:ignore
+        recipe1.ingredients.add(ingredient)
+        recipe2 = create_recipe(user=self.user, title='Tofu Stew')
+        recipe2.tags.add(tag1) # type:ignore
+        recipe2.ingredients.add(ingredient)
+        recipe3 = create_recipe(user=self.user, title='Quick Salad')
+        recipe3.tags.add(tag1, tag2) # type:ignore
+
+        params = {
+            'tags': f'{tag1.id},{tag2.id}', # type:ignore
+            'ingredients': f'{ingredient.id}', # type:ignore
+            'match': 'all',
+        }
+        res: Response = cast(Response, self.client.get(RECIPES_URL, params))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            cast(Any, res.data)['results'],
+            [RecipeSerializer(with_ordered_relations(Recipe.objects).get(id=recipe1.id)).data], # type:ignore
+        )
+
+    def test_filter_match_any_does_not_duplicate(self):
+        """Test a recipe matching several tags is returned once, without DISTINCT."""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Quick')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag1, tag2) # type:ignore
+
+        params = {'tags': f'{tag1.id},{tag2.id}', 'match': 'any'} # type:ignore
+        with CaptureQueriesContext(connection) as ctx:
+            res: Response = cast(Response, self.client.get(RECIPES_URL, params))
+
+        self.assertEqual(len(cast(Any, res.data)['results']), 1)
+        recipe_query = ctx.captured_queries[0]['sql']
+        self.assertIn('EXISTS', recipe_query)
+        self.assertNotIn('DISTINCT', recipe_query)
+        self.assertNotIn('JOIN', recipe_query)
+
+    def test_filter_invalid_match(self):
+        """Test an unknown match mode returns an error."""
+        res: Response = cast(Response, self.client.get(RECIPES_URL, {'match': 'some'}))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_title_and_description(self):
+        """Test searching recipes ranks title matches above description ones."""
+        in_description = create_recipe(
+            user=self.user,
+            title='Weeknight Dinner',
+            description='A quick curry with lots of spinach.',
+        )
+        in_title = create_recipe(
+            user=self.user,
+            title='Green Curries',
+            description='Fragrant and mild.',
+        )
+        create_recipe(user=self.user, title='Fish and Chips', description='Crispy.')
+
+        res: Response = cast(Response, self.client.get(RECIPES_URL, {'search': 'curry'}))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [r['id'] for r in cast(Any, res.data)['results']]
+        self.assertEqual(ids, [in_title.id, in_description.id]) # type:ignore
+
+    def test_search_updates_with_recipe(self):
+        """Test the search index follows title changes."""
+        recipe = create_recipe(user=self.user, title='Pancakes')
+        url:str = detail_url(recipe.id) # type:ignore
+        self.client.patch(url, {'title': 'Waffles'})
+
+        res: Response = cast(Response, self.client.get(RECIPES_URL, {'search': 'waffle'}))
+        self.assertEqual(len(cast(Any, res.data)['results']), 1)
+        res = cast(Response, self.client.get(RECIPES_URL, {'search': 'pancake'}))
+        self.assertEqual(len(cast(Any, res.data)['results']), 0)
+
+    def test_search_with_tag_filter(self):
+        """Test search composes with the tag filter."""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        vegan = create_recipe(user=self.user, title='Vegan Curry')
+        vegan.tags.add(tag) # type:ignore
+        create_recipe(user=self.user, title='Chicken Curry')
+
+        params = {'search': 'curry', 'tags': f'{tag.id}'} # type:ignore
+        res: Response = cast(Response, self.client.get(RECIPES_URL, params))
+
+        ids = [r['id'] for r in cast(Any, res.data)['results']]
+        self.assertEqual(ids, [vegan.id]) # type:ignore
+
+    def test_search_paginated_by_rank(self):
+        """Test paging through ranked search results returns each recipe once."""
+        recipes = [
+            create_recipe(user=self.user, title=f'Curry {i}', description='curry ' * i)
+            for i in range(5)
+        ]
+
+        seen = []
+        url: Any = RECIPES_URL
+        params: Any = {'search': 'curry', 'page_size': 2}
+        while url:
+            res: Response = cast(Response, self.client.get(url, params))
+            seen += [r['id'] for r in cast(Any, res.data)['results']]
+            url, params = cast(Any, res.data)['next'], None
+
+        self.assertEqual(sorted(seen), sorted(r.id for r in recipes)) # type:ignore
+
+    def test_search_paginated_past_equal_ranks(self):
+        """Test paging through many equally ranked matches by (rank, id)."""
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                user=self.user,
+                title='Tomato soup',
+                time_minutes=10,
+                price=Decimal('2.00'),
+            )
+            for _ in range(300)
+        ])
+
+        seen = []
+        url: Any = RECIPES_URL
+        params: Any = {'search': 'soup', 'page_size': 50}
+        shapes = set()
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                res: Response = cast(Response, self.client.get(url, params))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            page_query = next(
+                query['sql'] for query in ctx.captured_queries
+                if 'ts_rank' in query['sql']
+            )
+            self.assertNotIn('OFFSET', page_query)
+            if params is None:
+                # Past the first page, only the cursor's values may change
+                shapes.add(re.sub(r'\d+(\.\d+)?', '?', page_query))
+
+            data = cast(Any, res.data)
+            seen += [recipe['id'] for recipe in data['results']]
+            url, params = data['next'], None
+
+        # Same ranks, so newest first without duplicates or gaps
+        self.assertEqual(seen, sorted((r.id for r in recipes), reverse=True)) # type:ignore
+        self.assertEqual(len(shapes), 1)
+
+        # And back again from the last page
+        seen_back = data['results']
+        url = data['previous']
+        while url:
+            data = cast(Any, self.client.get(url).data)
+            seen_back = data['results'] + seen_back
+            url = data['previous']
+        self.assertEqual([recipe['id'] for recipe in seen_back], seen)
+
+    def test_search_invalid_cursor(self):
+        """Test a malformed search cursor is a 404, not a server error."""
+        cursor = base64.b64encode(b'p=abc,1').decode()
+
+        res = self.client.get(RECIPES_URL, {'search': 'soup', 'cursor': cursor})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_paginated_by_cursor(self):
+        """Test walking the recipe list page by page with a cursor."""
+        recipes = [create_recipe(user=self.user, title=f'Recipe {i}') for i in range(5)]
+
+        seen = []
+        url: Any = RECIPES_URL
+        params: Any = {'page_size': 2}
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                res: Response = cast(Response, self.client.get(url, params))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            for query in ctx.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+
+            data = cast(Any, res.data)
+            self.assertLessEqual(len(data['results']), 2)
+            seen += [recipe['id'] for recipe in data['results']]
+            # The next link already carries page_size and cursor
+            url, params = data['next'], None
+
+        self.assertEqual(seen, [r.id for r in reversed(recipes)]) # type:ignore
+
+    def test_pagination_with_filter(self):
+        """Test cursor pagination keeps applying the tag filter."""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        tagged = []
+        for i in range(3):
+            recipe = create_recipe(user=self.user, title=f'Vegan {i}')
+            recipe.tags.add(tag) # type:ignore
+            tagged.append(recipe)
+            create_recipe(user=self.user, title=f'Other {i}')
+
+        params = {'tags': f'{tag.id}', 'page_size': 2} # type:ignore
+        res: Response = cast(Response, self.client.get(RECIPES_URL, params))
+        first_page = cast(Any, res.data)
+        res = cast(Response, self.client.get(first_page['next']))
+        second_page = cast(Any, res.data)
+
+        ids = [r['id'] for r in first_page['results'] + second_page['results']]
+        self.assertEqual(ids, [r.id for r in reversed(tagged)]) # type:ignore
+        self.assertIsNone(second_page['next'])
+
+
+class SparseFieldsTests(TestCase):
+    """Test pruning recipe responses with ?fields= and ?omit=."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user, title='Pancakes')
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Breakfast')) # type:ignore
+
+    def test_list_titles_only(self):
+        """Test a titles only list is a single narrow query."""
+        with CaptureQueriesContext(connection) as ctx:
+            res: Response = cast(Response, self.client.get(RECIPES_URL, {'fields': 'id,title'}))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            cast(Any, res.data)['results'],
+            [{'id': self.recipe.id, 'title': 'Pancakes'}], # type:ignore
+        )
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('"core_recipe"."price"', ctx.captured_queries[0]['sql'])
+
+    def test_list_omit_relations(self):
+        """Test omitting tags and ingredients skips their prefetch."""
+        with self.assertNumQueries(1):
+            res: Response = cast(Response, self.client.get(
+                RECIPES_URL, {'omit': 'tags,ingredients'}
+            ))
+
+        recipe = cast(Any, res.data)['results'][0]
+        self.assertEqual(
+            list(recipe), ['id', 'title', 'time_minutes', 'price', 'link'],
+        )
+
+    def test_detail_fields(self):
+        """Test limiting the fields of a recipe detail."""
+        url:str = detail_url(self.recipe.id) # type:ignore
+        with self.assertNumQueries(2):
+            res: Response = cast(Response, self.client.get(url, {'fields': 'description,tags'}))
+
+        self.assertEqual(
+            res.data,
+            {'tags': [{'id': self.recipe.tags.get().id, 'name': 'Breakfast'}], # type:ignore
+             'description': 'Sample description'},
+        )
+
+    def test_unknown_field(self):
+        """Test asking for a field that does not exist returns an error."""
+        res: Response = cast(Response, self.client.get(RECIPES_URL, {'fields': 'title,secret'}))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeRowSerializerTests(TestCase):
+    """Test the list path built from values() rows."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def test_list_identical_to_serializer(self):
+        """Test the list renders byte for byte like RecipeSerializer."""
+        tags = [Tag.objects.create(user=self.user, name=n) for n in ['Vegan', 'Quick', 'Ünïcode']]
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        create_recipe(user=self.user, price=Decimal('0.50'), link='')
+        recipe = create_recipe(user=self.user, title='Curry "hot"', price=Decimal('999.99'))
+        # Linked out of id order on purpose
+        recipe.tags.add(tags[2]) # type:ignore
+        recipe.tags.add(tags[0], tags[1]) # type:ignore
+        recipe.ingredients.add(salt)
+
+        res: Response = cast(Response, self.client.get(RECIPES_URL))
+
+        recipes = with_ordered_relations(Recipe.objects.filter(user=self.user).order_by('-id'))
+        expected = JSONRenderer().render(RecipeSerializer(recipes, many=True).data)
+        self.assertEqual(JSONRenderer().render(cast(Any, res.data)['results']), expected)
+
+    def test_sparse_rows_identical_to_serializer(self):
+        """Test a pruned list matches RecipeSerializer pruned the same way."""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan')) # type:ignore
+        fields = ['price', 'tags']
+
+        res: Response = cast(Response, self.client.get(RECIPES_URL, {'fields': ','.join(fields)}))
+
+        expected = RecipeSerializer([recipe], many=True, fields=fields).data
+        self.assertEqual(
+            JSONRenderer().render(cast(Any, res.data)['results']),
+            JSONRenderer().render(expected),
+        )
+
+
+class RecipeExportTests(TestCase):
+    """Test streaming export of a user's recipes."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipes = []
+        for i in range(3):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'Tag {i}')) # type:ignore
+            self.recipes.append(recipe)
+        create_recipe(user=create_user(email='other@example.com', password='test123'))
+
+    def _expected(self):
+        """Return the user's recipes as in the detail view, without images."""
+        expected = []
+        for recipe in reversed(self.recipes):
+            data = dict(RecipeDetailSerializer(recipe).data)
+            for name in RecipeDetailSerializer.image_fields:
+                data.pop(name)
+            expected.append(data)
+
+        return expected
+
+    @patch('recipe.views.RecipeViewSet.export_chunk_size', 2)
+    def test_export_ndjson(self):
+        """Test exporting recipes one JSON document per line, in chunks."""
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming) # type:ignore
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(res.streaming_content).decode().splitlines() # type:ignore
+        self.assertEqual([json.loads(line) for line in lines], self._expected())
+
+    def test_export_json_gzip(self):
+        """Test exporting a gzipped JSON array."""
+        res = self.client.get(
+            EXPORT_URL, {'export_format': 'json'}, HTTP_ACCEPT_ENCODING='gzip',
+        )
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(res.streaming_content)) # type:ignore
+        self.assertEqual(json.loads(body), self._expected())
+
+    def test_export_gzip_negotiated(self):
+        """Test gzip follows the Accept-Encoding q-values."""
+        for header, gzipped in [
+            ('gzip;q=0', False),
+            ('br, gzip;q=0, *;q=1', False),
+            ('deflate, *;q=0.5', True),
+            ('GZIP ; q=0.8', True),
+            ('', False),
+        ]:
+            res = self.client.get(EXPORT_URL, HTTP_ACCEPT_ENCODING=header)
+
+            self.assertEqual(res.has_header('Content-Encoding'), gzipped, header)
+            self.assertIn('Accept-Encoding', res['Vary'])
+            b''.join(res.streaming_content) # type:ignore
+
+    def test_export_filtered(self):
+        """Test the export applies the list filters."""
+        tag = self.recipes[0].tags.get() # type:ignore
+        res = self.client.get(EXPORT_URL, {'tags': tag.id, 'export_format': 'json'})
+
+        data = json.loads(b''.join(res.streaming_content)) # type:ignore
+        self.assertEqual([r['id'] for r in data], [self.recipes[0].id]) # type:ignore
+
+    def test_export_empty(self):
+        """Test exporting an empty collection is a valid document."""
+        Recipe.objects.filter(user=self.user).delete()
+
+        res = self.client.get(EXPORT_URL, {'export_format': 'json'})
+
+        self.assertEqual(json.loads(b''.join(res.streaming_content)), []) # type:ignore
+
+
+class RecipeBulkCreateTests(TestCase):
+    """Test creating many recipes in one request."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def _payload(self, count: int):
+        """Return a list of recipes sharing a few tags and ingredients."""
+        return [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': 10 + i,
+                'price': '5.50',
+                'tags': [{'name': 'Quick'}, {'name': f'Tag {i % 3}'}],
+                'ingredients': [{'name': 'Salt'}, {'name': 'Salt'}],
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_create(self):
+        """Test creating recipes with new and existing tags in bulk."""
+        quick = Tag.objects.create(user=self.user, name='Quick')
+
+        res: Response = cast(Response, self.client.post(
+            BULK_URL, self._payload(5), format='json'
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(cast(Any, res.data)['created'], 5)
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            [r.id for r in recipes], cast(Any, res.data)['ids'], # type:ignore
+        )
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 1)
+        for recipe in recipes:
+            self.assertIn(quick, recipe.tags.all()) # type:ignore
+            self.assertEqual(recipe.tags.count(), 2) # type:ignore
+            self.assertEqual(recipe.ingredients.count(), 1)
+            self.assertEqual(recipe.user, self.user)
+
+    def test_bulk_create_counts_recipes(self):
+        """Test bulk created links are counted on tags and ingredients."""
+        self.client.post(BULK_URL, self._payload(6), format='json')
+
+        self.assertEqual(Tag.objects.get(user=self.user, name='Quick').recipe_count, 6)
+        self.assertEqual(Tag.objects.get(user=self.user, name='Tag 0').recipe_count, 2)
+        self.assertEqual(Ingredient.objects.get(user=self.user, name='Salt').recipe_count, 6)
+
+    def test_bulk_create_constant_queries(self):
+        """Test the number of queries does not grow with the batch."""
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(BULK_URL, self._payload(2), format='json')
+        # Fresh user, so tags and ingredients are created again
+        self.client.force_authenticate(create_user(email='other@example.com', password='test123'))
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(BULK_URL, self._payload(50), format='json')
+
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_bulk_create_invalid_item(self):
+        """Test one invalid recipe rejects the whole batch."""
+        payload = self._payload(3)
+        payload[1]['price'] = 'free'
+
+        res: Response = cast(Response, self.client.post(BULK_URL, payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('price', cast(Any, res.data)[1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_create_limit(self):
+        """Test batches over the size cap are rejected."""
+        with patch('recipe.views.RecipeViewSet.bulk_max_size', 2):
+            res: Response = cast(Response, self.client.post(
+                BULK_URL, self._payload(3), format='json'
+            ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_visible_in_list(self):
+        """Test bulk created recipes are not hidden by cached reads."""
+        self.client.get(RECIPES_URL)
+        self.client.post(BULK_URL, self._payload(2), format='json')
+
+        res: Response = cast(Response, self.client.get(RECIPES_URL))
+
+        self.assertEqual(len(cast(Any, res.data)['results']), 2)
+
+
+class RecipeBulkUpdateTests(TestCase):
+    """Test updating and deleting many recipes in one request."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_update_fields_by_ids(self):
+        """Test setting fields on a list of recipes."""
+        r1 = create_recipe(user=self.user, time_minutes=5)
+        r2 = create_recipe(user=self.user, time_minutes=5)
+        r3 = create_recipe(user=self.user, time_minutes=5)
+        other = create_recipe(
+            user=create_user(email='other@example.com', password='test123'),
+            time_minutes=5,
+        )
+        payload: Any = {
+            'ids': [r1.id, r2.id, other.id], # type:ignore
+            'changes': {'time_minutes': 30},
+        }
+
+        res: Response = cast(Response, self.client.patch(BULK_URL, payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cast(Any, res.data)['matched'], 2)
+        self.assertEqual(cast(Any, res.data)['updated'], 2)
+        for recipe, minutes in [(r1, 30), (r2, 30), (r3, 5), (other, 5)]:
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.time_minutes, minutes)
+
+    def test_bulk_update_tags_by_filter(self):
+        """Test adding and removing tags on the recipes matching a filter."""
+        dinner = Tag.objects.create(user=self.user, name='Dinner')
+        old = Tag.objects.create(user=self.user, name='Old')
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        r3 = create_recipe(user=self.user)
+        r1.tags.add(dinner, old) # type:ignore
+        r2.tags.add(dinner) # type:ignore
+        r3.tags.add(old) # type:ignore
+        payload: Any = {
+            'filter': {'tags': str(dinner.id)}, # type:ignore
+            'add_tags': [{'name': 'Weekly'}],
+            'remove_tags': [{'name': 'Old'}],
+        }
+
+        res: Response = cast(Response, self.client.patch(BULK_URL, payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cast(Any, res.data)['matched'], 2)
+        self.assertEqual(cast(Any, res.data)['tags_added'], 2)
+        self.assertEqual(cast(Any, res.data)['tags_removed'], 1)
+        self.assertEqual(
+            sorted(tag.name for tag in r1.tags.all()), ['Dinner', 'Weekly'], # type:ignore
+        )
+        self.assertEqual(
+            sorted(tag.name for tag in r2.tags.all()), ['Dinner', 'Weekly'], # type:ignore
+        )
+        self.assertEqual([tag.name for tag in r3.tags.all()], ['Old']) # type:ignore
+
+    def test_bulk_add_existing_ingredient_links_once(self):
+        """Test adding an ingredient a recipe already has is not counted."""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        r1.ingredients.add(salt)
+        payload: Any = {
+            'ids': [r1.id, r2.id], # type:ignore
+            'add_ingredients': [{'name': 'Salt'}],
+        }
+
+        res: Response = cast(Response, self.client.patch(BULK_URL, payload, format='json'))
+
+        self.assertEqual(cast(Any, res.data)['ingredients_added'], 1)
+        self.assertEqual(list(r2.ingredients.all()), [salt])
+
+    def test_bulk_changes_keep_recipe_counts(self):
+        """Test bulk link changes and deletes keep recipe counts correct."""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        recipes = [create_recipe(user=self.user) for _ in range(3)]
+        for recipe in recipes:
+            recipe.ingredients.add(salt)
+        ids = [recipe.id for recipe in recipes] # type:ignore
+
+        self.client.patch(BULK_URL, {
+            'ids': ids[:2],
+            'add_tags': [{'name': 'Weekly'}],
+            'remove_ingredients': [{'name': 'Salt'}],
+        }, format='json')
+
+        self.assertEqual(Tag.objects.get(user=self.user, name='Weekly').recipe_count, 2)
+        salt.refresh_from_db()
+        self.assertEqual(salt.recipe_count, 1)
+
+        self.client.delete(BULK_URL, {'ids': ids[1:]}, format='json')
+
+        self.assertEqual(Tag.objects.get(user=self.user, name='Weekly').recipe_count, 1)
+        salt.refresh_from_db()
+        self.assertEqual(salt.recipe_count, 0)
+
+    def test_bulk_add_already_linked_pair(self):
+        """Test adding a tag some recipes already have only counts new links."""
+        weekly = Tag.objects.create(user=self.user, name='Weekly')
+        recipes = [create_recipe(user=self.user) for _ in range(3)]
+        recipes[0].tags.add(weekly) # type:ignore
+
+        res: Response = cast(Response, self.client.patch(BULK_URL, {
+            'ids': [recipe.id for recipe in recipes], # type:ignore
+            'add_tags': [{'name': 'Weekly'}],
+        }, format='json'))
+
+        self.assertEqual(cast(Any, res.data)['tags_added'], 2)
+        weekly.refresh_from_db()
+        self.assertEqual(weekly.recipe_count, 3)
+
+        # Removing twice never takes the count below the links left
+        for _ in range(2):
+            self.client.patch(BULK_URL, {
+                'ids': [recipes[0].id], # type:ignore
+                'remove_tags': [{'name': 'Weekly'}],
+            }, format='json')
+        weekly.refresh_from_db()
+        self.assertEqual(weekly.recipe_count, 2)
+
+    def test_bulk_update_query_count_is_constant(self):
+        """Test the number of statements does not grow with the selection."""
+        recipes = [create_recipe(user=self.user) for _ in range(20)]
+        payload: Any = {
+            'changes': {'title': 'Renamed'},
+            'add_tags': [{'name': 'A'}, {'name': 'B'}],
+            'remove_ingredients': [{'name': 'Salt'}],
+        }
+
+        counts = []
+        for selected in (recipes[:2], recipes):
+            payload['ids'] = [recipe.id for recipe in selected] # type:ignore
+            with CaptureQueriesContext(connection) as ctx:
+                res: Response = cast(Response, self.client.patch(
+                    BULK_URL, payload, format='json'
+                ))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_update_invalid(self):
+        """Test a bulk update needs one selection and at least one change."""
+        recipe = create_recipe(user=self.user)
+        payloads: Any = [
+            {'changes': {'title': 'x'}},
+            {'ids': [recipe.id], 'filter': {}, 'changes': {'title': 'x'}}, # type:ignore
+            {'ids': [recipe.id]}, # type:ignore
+            {'filter': {'colour': 'red'}, 'changes': {'title': 'x'}},
+            {'filter': {'tags': 'abc'}, 'changes': {'title': 'x'}},
+        ]
+
+        for payload in payloads:
+            res: Response = cast(Response, self.client.patch(BULK_URL, payload, format='json'))
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, payload)
+
+    def test_bulk_selection_capped(self):
+        """Test a filter matching more recipes than the cap is rejected."""
+        for _ in range(3):
+            create_recipe(user=self.user)
+
+        with patch('recipe.views.RecipeViewSet.bulk_max_size', 2):
+            res: Response = cast(Response, self.client.delete(
+                BULK_URL, {'filter': {}}, format='json'
+            ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+
+    def test_bulk_delete(self):
+        """Test deleting the user's recipes by id."""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        r1.tags.add(Tag.objects.create(user=self.user, name='Dinner')) # type:ignore
+        other = create_recipe(
+            user=create_user(email='other@example.com', password='test123'),
+        )
+        payload: Any = {'ids': [r1.id, other.id]} # type:ignore
+
+        res: Response = cast(Response, self.client.delete(BULK_URL, payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cast(Any, res.data)['deleted'], 1)
+        self.assertFalse(Recipe.objects.filter(id=r1.id).exists()) # type:ignore
+        self.assertTrue(Recipe.objects.filter(id=r2.id).exists()) # type:ignore
+        self.assertTrue(Recipe.objects.filter(id=other.id).exists()) # type:ignore
+
+    def test_bulk_delete_bumps_version_once(self):
+        """Test deleting many recipes invalidates the user's cache once."""
+        ids = [create_recipe(user=self.user).id for _ in range(5)] # type:ignore
+        version = get_data_version(self.user.id) # type:ignore
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            res = self.client.delete(BULK_URL, {'ids': ids}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(get_data_version(self.user.id), version) # type:ignore
+        # bump_data_version bumps again on commit, once per call
+        self.assertEqual(len(callbacks), 1)
+
+
+class RecipeFacetsTests(TestCase):
+    """Test counting filtered recipes per tag and ingredient."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.tofu = Ingredient.objects.create(user=self.user, name='Tofu')
+        curry = create_recipe(user=self.user, title='Tofu curry')
+        curry.tags.add(self.vegan, self.quick) # type:ignore
+        curry.ingredients.add(self.tofu)
+        salad = create_recipe(user=self.user, title='Salad')
+        salad.tags.add(self.vegan) # type:ignore
+        other = create_recipe(
+            user=create_user(email='other@example.com', password='test123'),
+        )
+        other.tags.add(Tag.objects.create(user=other.user, name='Vegan')) # type:ignore
+
+    def test_facets(self):
+        """Test counts cover all of the user's recipes, most used first."""
+        res: Response = cast(Response, self.client.get(FACETS_URL))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cast(Any, res.data), {
+            'tags': [
+                {'id': self.vegan.id, 'name': 'Vegan', 'count': 2}, # type:ignore
+                {'id': self.quick.id, 'name': 'Quick', 'count': 1}, # type:ignore
+            ],
+            'ingredients': [
+                {'id': self.tofu.id, 'name': 'Tofu', 'count': 1}, # type:ignore
+            ],
+        })
+
+    def test_facets_filtered(self):
+        """Test counts follow the list filters."""
+        res: Response = cast(Response, self.client.get(
+            FACETS_URL, {'ingredients': str(self.tofu.id)} # type:ignore
+        ))
+
+        tags = {tag['name']: tag['count'] for tag in cast(Any, res.data)['tags']}
+        self.assertEqual(tags, {'Vegan': 1, 'Quick': 1})
+
+        res = cast(Response, self.client.get(FACETS_URL, {'search': 'salad'}))
+
+        self.assertEqual(cast(Any, res.data)['tags'], [
+            {'id': self.vegan.id, 'name': 'Vegan', 'count': 1}, # type:ignore
+        ])
+        self.assertEqual(cast(Any, res.data)['ingredients'], [])
+
+    def test_facets_grouped_queries(self):
+        """Test facets run one grouped query per relation."""
+        with self.assertNumQueries(2):
+            self.client.get(FACETS_URL, {'tags': str(self.vegan.id)}) # type:ignore
+
+    def test_facets_cached_per_data_version(self):
+        """Test facets are served from the cache until the data changes."""
+        self.client.get(FACETS_URL)
+        res: Response = cast(Response, self.client.get(FACETS_URL))
+
+        self.assertEqual(res['X-Cache'], 'HIT')
+
+        Recipe.objects.get(title='Salad').tags.add(self.quick) # type:ignore
+        res = cast(Response, self.client.get(FACETS_URL))
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        tags = {tag['name']: tag['count'] for tag in cast(Any, res.data)['tags']}
+        self.assertEqual(tags, {'Vegan': 2, 'Quick': 2})
 
 
 class IamgeUploadTests(TestCase):
@@ -477,3 +1333,94 @@ class IamgeUploadTests(TestCase):
 
         res: Response = cast(Response, self.client.post(url, payload, format='multipart'))
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Maximum queries allowed per endpoint, regardless of how many recipes,
+# tags and ingredients are involved. Raise these only on purpose.
+QUERY_BUDGETS = {
+    'list': 3,
+    'retrieve': 3,
+    'partial_update': 6,
+    # Tags and ingredients each: upsert, id lookup, removed and added links
+    # with their recipe_count UPDATEs
+    'update_tags': 22,
+}
+
+
+class RecipeQueryBudgetTests(TestCase):
+    """Test recipe endpoints run a constant number of queries."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def _create_recipes(self, count: int):
+        """Create recipes that each have their own tags and ingredients."""
+        recipes = []
+        for i in range(count):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            for j in range(2):
+                recipe.tags.add( # type:ignore
+                    Tag.objects.create(user=self.user, name=f'Tag {recipe.id}-{j}') # type:ignore
+                )
+                recipe.ingredients.add(
+                    Ingredient.objects.create(
+                        user=self.user, name=f'Ingredient {recipe.id}-{j}' # type:ignore
+                    )
+                )
+            recipes.append(recipe)
+
+        return recipes
+
+    def test_list_query_budget(self):
+        """Test listing recipes does not scale queries with recipes."""
+        for count in [1, 10]:
+            self._create_recipes(count)
+            with self.assertNumQueries(QUERY_BUDGETS['list']):
+                res: Response = cast(Response, self.client.get(RECIPES_URL))
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_query_budget(self):
+        """Test retrieving a recipe with many tags stays within budget."""
+        recipe = self._create_recipes(1)[0]
+        for i in range(5):
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'Extra {i}')) # type:ignore
+
+        with self.assertNumQueries(QUERY_BUDGETS['retrieve']):
+            res: Response = cast(Response, self.client.get(detail_url(recipe.id))) # type:ignore
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(cast(Any, res.data)['tags']), 7)
+
+    def test_partial_update_query_budget(self):
+        """Test updating a recipe's fields stays within budget."""
+        recipe = self._create_recipes(1)[0]
+        payload = {'title': 'New title'}
+
+        with self.assertNumQueries(QUERY_BUDGETS['partial_update']):
+            res: Response = cast(Response, self.client.patch(
+                detail_url(recipe.id), payload, format='json' # type:ignore
+            ))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(cast(Any, res.data)['tags']), 2)
+
+    def test_update_tags_query_budget(self):
+        """Test replacing a recipe's tags and ingredients does not scale queries."""
+        for count in [1, 10]:
+            recipe = self._create_recipes(1)[0]
+            payload = {
+                'tags': [{'name': f'Lunch {count}-{i}'} for i in range(count)],
+                'ingredients': [{'name': f'Salt {count}-{i}'} for i in range(count)],
+            }
+
+            with self.assertNumQueries(QUERY_BUDGETS['update_tags']):
+                res: Response = cast(Response, self.client.patch(
+                    detail_url(recipe.id), payload, format='json' # type:ignore
+                ))
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(cast(Any, res.data)['tags']), count)
+            self.assertEqual(len(cast(Any, res.data)['ingredients']), count)
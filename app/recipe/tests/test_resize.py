@@ -0,0 +1,187 @@
+"""
+Tests for on demand resized recipe images.
+"""
+from typing import Any
+from unittest.mock import patch
+import io
+import math
+import os
+import tempfile
+import uuid
+
+from PIL import Image
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from recipe.resize import LOW_WATERMARK, cache_dir, evict, maybe_evict
+
+
+def resized_url(stem: Any, width: int, extension: str = 'jpg'):
+    """Create and return the URL of a resized image."""
+    return reverse(
+        'resized-image', kwargs={'stem': stem, 'width': width, 'extension': extension},
+    )
+
+
+class ResizedImageTests(TestCase):
+    """Test images are resized on request and cached on disk."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.stem = uuid.uuid4()
+        self.source = os.path.join(directory.name, 'uploads', 'recipe', f'{self.stem}.jpg')
+        os.makedirs(os.path.dirname(self.source))
+        Image.new('RGB', (800, 400), (20, 120, 40)).save(self.source, format='JPEG')
+
+    def _get(self, url: str):
+        res = self.client.get(url)
+        if res.status_code == 200:
+            content = b''.join(res.streaming_content) # type:ignore
+            res.close()
+            return res, Image.open(io.BytesIO(content))
+        return res, None
+
+    def test_url_matches_cache_path(self):
+        """Test the URL is the cache path under MEDIA_URL, as nginx expects."""
+        self.assertEqual(
+            resized_url(self.stem, 320, 'webp'), f'/static/media/resized/{self.stem}/320.webp',
+        )
+
+    def test_resize_jpeg(self):
+        """Test a JPEG copy is made at the requested width and cached."""
+        res, image = self._get(resized_url(self.stem, 320))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertEqual(image.size, (320, 160)) # type:ignore
+        self.assertTrue(os.path.exists(os.path.join(cache_dir(), str(self.stem), '320.jpg')))
+
+    def test_resize_webp(self):
+        """Test a WebP copy is made."""
+        res, image = self._get(resized_url(self.stem, 160, 'webp'))
+
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        self.assertEqual(image.format, 'WEBP') # type:ignore
+        self.assertEqual(image.size, (160, 80)) # type:ignore
+
+    def test_never_upscaled(self):
+        """Test widths larger than the image give the image's own size."""
+        res, image = self._get(resized_url(self.stem, 960))
+
+        self.assertEqual(image.size, (800, 400)) # type:ignore
+
+    def test_cached_copy_reused(self):
+        """Test a cached copy is served even without the source."""
+        self._get(resized_url(self.stem, 320))
+        os.remove(self.source)
+
+        res, image = self._get(resized_url(self.stem, 320))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(image.size, (320, 160)) # type:ignore
+
+    def test_partial_files_never_resized(self):
+        """Test .tmp files being written are not taken for the upload."""
+        # Written in full but not renamed yet, it still must not be used
+        os.replace(self.source, f'{self.source}.tmp')
+
+        res, _ = self._get(resized_url(self.stem, 320))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_pending_upload_resized(self):
+        """Test an upload not yet processed is found by its own extension."""
+        png = self.source.replace('.jpg', '.png')
+        with Image.open(self.source) as image:
+            image.save(png, format='PNG')
+        os.remove(self.source)
+        open(f'{self.source}.tmp', 'wb').close()
+
+        res, image = self._get(resized_url(self.stem, 320))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(image.size, (320, 160)) # type:ignore
+
+    def test_copy_evicted_before_open_made_again(self):
+        """Test a copy deleted between being found and opened is made again."""
+        self._get(resized_url(self.stem, 320))
+        path = os.path.join(cache_dir(), str(self.stem), '320.jpg')
+        real_open = open
+        evicted = []
+
+        def evicting_open(file: Any, *args: Any, **kwargs: Any):
+            if file == path and not evicted:
+                # As if evict() ran in another worker right before
+                evicted.append(file)
+                os.remove(path)
+            return real_open(file, *args, **kwargs)
+
+        with patch('builtins.open', evicting_open):
+            res, image = self._get(resized_url(self.stem, 320))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(evicted, [path])
+        self.assertEqual(image.size, (320, 160)) # type:ignore
+
+    def test_unsupported_requests_not_found(self):
+        """Test other widths, formats and unknown images are 404s."""
+        for url in [
+            resized_url(self.stem, 321),
+            resized_url(self.stem, 320, 'png'),
+            resized_url(uuid.uuid4(), 320),
+        ]:
+            res, _ = self._get(url)
+            self.assertEqual(res.status_code, 404, url)
+        self.assertFalse(os.path.exists(cache_dir()))
+
+    def test_only_reads_allowed(self):
+        """Test writing to a resized image URL is not allowed."""
+        res = self.client.post(resized_url(self.stem, 320))
+
+        self.assertEqual(res.status_code, 405)
+
+    def test_least_recently_read_evicted(self):
+        """Test the oldest read copies are deleted to fit the budget."""
+        for width, atime in [(160, 100), (320, 300), (640, 200)]:
+            self._get(resized_url(self.stem, width))
+            path = os.path.join(cache_dir(), str(self.stem), f'{width}.jpg')
+            os.utime(path, (atime, os.stat(path).st_mtime))
+        kept = os.path.join(cache_dir(), str(self.stem), '320.jpg')
+
+        # Trimmed to the low watermark, just enough for the newest copy
+        deleted = evict(math.ceil(os.stat(kept).st_size / LOW_WATERMARK))
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(os.listdir(os.path.dirname(kept)), ['320.jpg'])
+
+    def test_evict_command(self):
+        """Test the command empties the cache with a budget of 0."""
+        self._get(resized_url(self.stem, 320))
+
+        call_command('evict_resized_images', budget=0, stdout=io.StringIO())
+
+        self.assertEqual(os.listdir(cache_dir()), [])
+
+    @override_settings(RECIPE_IMAGE_CACHE_BYTES=1000, RECIPE_IMAGE_CACHE_SWEEP_INTERVAL=60)
+    def test_swept_only_when_budget_may_be_exceeded(self):
+        """Test the cache is walked only once this process's writes may exceed the budget."""
+        with patch('recipe.resize._size', None), \
+                patch('recipe.resize._evict', return_value=(0, 0)) as sweep:
+            # Nothing known about the cache yet, the walk counts this copy
+            maybe_evict(100)
+            self.assertEqual(sweep.call_count, 1)
+
+            maybe_evict(500)
+            maybe_evict(500)
+            self.assertEqual(sweep.call_count, 1)
+
+            maybe_evict(1)
+            self.assertEqual(sweep.call_count, 2)
@@ -3,9 +3,15 @@ Tests for tags API.
 """
 from typing import cast, Any
 from decimal import Decimal
+import threading
+
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -141,3 +147,212 @@ class PrivateTagsApiTests(TestCase):
 
         # Breakfast tag should be returned only once
         self.assertEqual(len(res.data), 1) # type:ignore
+
+    def test_typeahead_tags(self):
+        """Test looking up tags by a case insensitive name prefix."""
+        Tag.objects.create(user=self.user, name='Vegetarian')
+        Tag.objects.create(user=self.user, name='vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        user2 = create_user(email='user2@example.com')
+        Tag.objects.create(user=user2, name='Veggie')
+
+        res: Response = cast(Response, self.client.get(TAGS_URL, {'q': 'VEG'}))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        names = [tag['name'] for tag in cast(Any, res.data)]
+        self.assertEqual(names, ['vegan', 'Vegetarian'])
+
+    def test_typeahead_tags_limit(self):
+        """Test the typeahead returns at most the requested number of tags."""
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'Spicy {i}')
+
+        res: Response = cast(Response, self.client.get(TAGS_URL, {'q': 'sp', 'limit': 2}))
+
+        names = [tag['name'] for tag in cast(Any, res.data)]
+        self.assertEqual(names, ['Spicy 0', 'Spicy 1'])
+
+    def test_rename_tag_to_existing_name(self):
+        """Test renaming a tag to a name the user already has fails."""
+        Tag.objects.create(user=self.user, name='Dessert')
+        tag = Tag.objects.create(user=self.user, name='After Dinner')
+
+        res: Response = cast(Response, self.client.patch(detail_url(tag.id), {'name': 'Dessert'})) # type:ignore
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'After Dinner')
+
+    def test_assigned_only_uses_exists(self):
+        """Test assigned tags are found with EXISTS rather than JOIN + DISTINCT."""
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        sql = ctx.captured_queries[-1]['sql'].upper()
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def test_tags_with_recipe_count(self):
+        """Test listing tags with the number of recipes using them."""
+        dinner = Tag.objects.create(user=self.user, name='Dinner')
+        Tag.objects.create(user=self.user, name='Unused')
+        for title in ['Curry', 'Stew']:
+            recipe = Recipe.objects.create(
+                user=self.user, title=title, time_minutes=5, price=Decimal('4.50'),
+            )
+            recipe.tags.add(dinner) # type:ignore
+
+        res: Response = cast(Response, self.client.get(TAGS_URL, {'recipe_count': 1}))
+
+        counts = {tag['name']: tag['recipe_count'] for tag in cast(Any, res.data)}
+        self.assertEqual(counts, {'Dinner': 2, 'Unused': 0})
+
+        res = cast(Response, self.client.get(TAGS_URL))
+
+        self.assertNotIn('recipe_count', cast(Any, res.data)[0])
+
+
+class RecipeCountTests(TestCase):
+    """Test the denormalized recipe counts of tags follow link changes."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.tags = [Tag.objects.create(user=self.user, name=f'Tag {i}') for i in range(3)]
+        self.recipes = [
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5, price=Decimal('4.50'),
+            )
+            for i in range(2)
+        ]
+
+    def assertCounts(self, expected: list):
+        counts = [Tag.objects.get(id=tag.id).recipe_count for tag in self.tags] # type:ignore
+        self.assertEqual(counts, expected)
+
+    def test_add_and_remove(self):
+        """Test counts follow add() and remove() from the recipe side."""
+        recipe = self.recipes[0]
+        recipe.tags.add(self.tags[0], self.tags[1]) # type:ignore
+        # Adding an existing link again changes nothing
+        recipe.tags.add(self.tags[0]) # type:ignore
+        self.assertCounts([1, 1, 0])
+
+        # Removing a tag the recipe does not have changes nothing either
+        recipe.tags.remove(self.tags[1], self.tags[2]) # type:ignore
+        self.assertCounts([1, 0, 0])
+
+        recipe.tags.clear() # type:ignore
+        self.assertCounts([0, 0, 0])
+
+    def test_reverse_side(self):
+        """Test counts follow link changes made from the tag side."""
+        tag = self.tags[0]
+        tag.recipe_set.add(*self.recipes) # type:ignore
+        self.assertCounts([2, 0, 0])
+
+        tag.recipe_set.remove(self.recipes[0]) # type:ignore
+        self.assertCounts([1, 0, 0])
+
+        tag.recipe_set.clear() # type:ignore
+        self.assertCounts([0, 0, 0])
+
+    def test_recipe_delete(self):
+        """Test deleting a recipe uncounts its tags."""
+        self.recipes[0].tags.add(self.tags[0], self.tags[1]) # type:ignore
+        self.recipes[1].tags.add(self.tags[0]) # type:ignore
+
+        self.recipes[0].delete()
+
+        self.assertCounts([1, 0, 0])
+
+    def _race(self, action: str, change: Any):
+        """Run change as another request would, just before add() or remove() writes."""
+        def receiver(action: str, **kwargs: Any):
+            if action == race_action:
+                change()
+
+        race_action = action
+        m2m_changed.connect(receiver, sender=Recipe.tags.through)
+        self.addCleanup(m2m_changed.disconnect, receiver, sender=Recipe.tags.through)
+
+    def test_add_racing_another_add(self):
+        """Test a pair linked after add() looked for it is counted once."""
+        recipe, tag = self.recipes[0], self.tags[0]
+
+        def link():
+            Recipe.tags.through.objects.create(recipe=recipe, tag=tag)
+            Tag.objects.filter(id=tag.id).update(recipe_count=F('recipe_count') + 1) # type:ignore
+
+        self._race('pre_add', link)
+        recipe.tags.add(tag) # type:ignore
+
+        self.assertCounts([1, 0, 0])
+
+    def test_remove_racing_another_remove(self):
+        """Test a pair unlinked after remove() looked for it is uncounted once."""
+        recipe, tag = self.recipes[0], self.tags[0]
+        recipe.tags.add(tag) # type:ignore
+
+        def unlink():
+            Recipe.tags.through.objects.filter(recipe=recipe, tag=tag).delete()
+            Tag.objects.filter(id=tag.id).update(recipe_count=F('recipe_count') - 1) # type:ignore
+
+        self._race('pre_remove', unlink)
+        recipe.tags.remove(tag) # type:ignore
+
+        self.assertCounts([0, 0, 0])
+
+
+class BulkDeleteRaceTests(TransactionTestCase):
+    """Test bulk deletes racing link changes in other transactions."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tags = [Tag.objects.create(user=self.user, name=f'Tag {i}') for i in range(2)]
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Recipe', time_minutes=5, price=Decimal('4.50'),
+        )
+        self.recipe.tags.add(self.tags[0]) # type:ignore
+
+    def test_bulk_delete_racing_a_link_insert(self):
+        """Test a link inserted while a bulk delete runs is never miscounted."""
+        recipe, tag = self.recipe, self.tags[1]
+
+        def link():
+            try:
+                with transaction.atomic():
+                    # Check the recipe exists now rather than at commit
+                    with connection.cursor() as cursor:
+                        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+                    Recipe.tags.through.objects.create(recipe=recipe, tag=tag)
+                    Tag.objects.filter(id=tag.id).update( # type:ignore
+                        recipe_count=F('recipe_count') + 1,
+                    )
+            except IntegrityError:
+                pass
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=link)
+
+        def race(execute: Any, sql: str, *args: Any):
+            """Insert the link from another connection just before links are deleted."""
+            if sql.startswith('DELETE FROM "core_recipe_tags"') and not thread.ident:
+                thread.start()
+                thread.join(1)
+            return execute(sql, *args)
+
+        with connection.execute_wrapper(race):
+            res = cast(Response, self.client.delete(
+                reverse('recipe:recipe-bulk'), {'ids': [recipe.id]}, format='json', # type:ignore
+            ))
+        thread.join()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        for tag in Tag.objects.filter(id__in=[tag.id for tag in self.tags]): # type:ignore
+            self.assertEqual(
+                tag.recipe_count, Recipe.tags.through.objects.filter(tag=tag).count(),
+            )
@@ -1,4 +1,15 @@
 """Views for the recipe APIs."""
+from typing import Any
+import zlib
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Prefetch
+from django.db.models.functions import Cast, Upper
+from django.http import FileResponse, Http404, HttpRequest, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
 from drf_spectacular.utils import (
     extend_schema_view,
     extend_schema,
@@ -7,13 +18,57 @@ from drf_spectacular.utils import (
 )
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.serializers import BaseSerializer
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 
+from core.authentication import CachedTokenAuthentication
 from core.models import Recipe, Tag, Ingredient
-from recipe import serializers
+from recipe import images, resize, serializers
+from recipe.serializers import bulk_get_or_create
+from recipe.cache import CachedResponseMixin, bump_data_version, invalidated_manually
+from recipe.counts import (
+    RELATED,
+    adjust_recipe_counts,
+    counted_manually,
+    delete_links,
+    insert_links,
+)
+from recipe.filters import filter_by_related, MATCH_ANY, MATCH_CHOICES
+from recipe.pagination import RecipeCursorPagination
+
+
+# Filters shared by the recipe list and the facet counts
+RECIPE_FILTER_PARAMETERS = [
+    OpenApiParameter(
+        'tags',
+        OpenApiTypes.STR,
+        description='Comma separated list of tag IDs to filter',
+    ),
+    OpenApiParameter(
+        'ingredients',
+        OpenApiTypes.STR,
+        description='Comma separated list of ingredient IDs to filter',
+    ),
+    OpenApiParameter(
+        'search',
+        OpenApiTypes.STR,
+        description=(
+            'Full-text search over title and description, results '
+            'are ranked by relevance'
+        ),
+    ),
+    OpenApiParameter(
+        'match',
+        OpenApiTypes.STR, enum=MATCH_CHOICES,
+        description=(
+            'Return recipes with any (default) or all of the given '
+            'tags and ingredients'
+        ),
+    ),
+]
 
 
 # ModelViewSet specialy to work with models
@@ -25,49 +80,324 @@ from recipe import serializers
 # DELETE /api/recipe/recipes/{id}/ – Delete a recipe by its ID (destroy action)
 @extend_schema_view(
     list=extend_schema(
+        parameters=RECIPE_FILTER_PARAMETERS + [
+            OpenApiParameter(
+                'fields',
+                OpenApiTypes.STR,
+                description='Comma separated list of fields to return',
+            ),
+            OpenApiParameter(
+                'omit',
+                OpenApiTypes.STR,
+                description='Comma separated list of fields to leave out',
+            ),
+        ],
+    ),
+    retrieve=extend_schema(
         parameters=[
             OpenApiParameter(
-                'tags',
+                'fields',
                 OpenApiTypes.STR,
-                description='Comma separated list of tag IDs to filter',
+                description='Comma separated list of fields to return',
             ),
             OpenApiParameter(
-                'ingredients',
+                'omit',
                 OpenApiTypes.STR,
-                description='Comma separated list of ingredient IDs to filter',
+                description='Comma separated list of fields to leave out',
             ),
         ],
-    )
+    ),
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """View for manage recipe APIs"""
     serializer_class = serializers.RecipeDetailSerializer
     # objects avaliable for this view set
-    queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    # search_vector is only used for filtering, never send it over the wire
+    queryset = Recipe.objects.defer('search_vector')
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeCursorPagination
+    # Related objects to load upfront per action, so the serializer does not
+    # run a tags and an ingredients query for every single recipe (N+1)
+    prefetch_plan = {
+        'list': ['tags', 'ingredients'],
+        'retrieve': ['tags', 'ingredients'],
+        'update': ['tags', 'ingredients'],
+        'partial_update': ['tags', 'ingredients'],
+    }
+
+    # Most recipes one bulk create, update or delete request may touch
+    bulk_max_size = 1000
+    # Recipes serialized per round trip while streaming an export
+    export_chunk_size = 1000
+    # Actions whose response can be pruned with ?fields= and ?omit=
+    sparse_field_actions = ['list', 'retrieve']
 
     def _params_to_ints(self, qs):
         """Convert a list of strings to integers."""
         # 1,2,3
         return [int(str_id) for str_id in qs.split(',')]
 
-    def get_queryset(self):
-        """Retrieve recipes for authenticated user."""
-        tags = self.request.query_params.get('tags') # type:ignore
-        ingredients = self.request.query_params.get('ingredients') # type:ignore
-        queryset = self.queryset
+    def _params_to_names(self, qs):
+        """Convert a comma separated string to a list of names."""
+        return [name.strip() for name in qs.split(',') if name.strip()]
+
+    def get_sparse_fields(self):
+        """Return the fields requested with ?fields= and ?omit=, None for all."""
+        if self.action not in self.sparse_field_actions:
+            return None
+        fields = self.request.query_params.get('fields') # type:ignore
+        omit = self.request.query_params.get('omit') # type:ignore
+        if not fields and not omit:
+            return None
+
+        available = self.get_serializer_class().Meta.fields
+        requested = self._params_to_names(fields) if fields else available
+        omitted = self._params_to_names(omit) if omit else []
+        unknown = set(requested + omitted) - set(available)
+        if unknown:
+            raise ValidationError({
+                'fields': f'Unknown fields: {", ".join(sorted(unknown))}.'
+            })
+
+        return [name for name in available if name in requested and name not in omitted]
+
+    def get_serializer(self, *args, **kwargs):
+        """Return the serializer, limited to the requested fields."""
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+
+        return super().get_serializer(*args, **kwargs)
+
+    def _filter_recipes(self, queryset, params):
+        """Apply the tags, ingredients, search and match filters to recipes."""
+        tags = params.get('tags')
+        ingredients = params.get('ingredients')
+        search = params.get('search')
+        match = params.get('match', MATCH_ANY)
+        if match not in MATCH_CHOICES:
+            raise ValidationError({'match': f'Must be one of {MATCH_CHOICES}.'})
 
         if tags:
             tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = filter_by_related(
+                queryset, Recipe.tags.through, 'tag_id', tag_ids, match,
+            )
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = filter_by_related(
+                queryset,
+                Recipe.ingredients.through,
+                'ingredient_id',
+                ingredient_ids,
+                match,
+            )
+        if search:
+            # websearch accepts what users type, quotes, "or" and -exclusions
+            query = SearchQuery(search, config='english', search_type='websearch')
+            # Pagination orders by search_rank first when it is annotated.
+            # The float rank is cast to numeric so the cursor position
+            # round-trips exactly through its string form.
+            queryset = queryset.filter(search_vector=query).annotate(
+                search_rank=Cast(
+                    SearchRank(F('search_vector'), query),
+                    DecimalField(max_digits=20, decimal_places=10),
+                ),
+            )
+
+        return queryset
+
+    def get_queryset(self):
+        """Retrieve recipes for authenticated user."""
+        queryset = self._filter_recipes(
+            self.queryset, self.request.query_params, # type:ignore
+        )
+
+        prefetch = self.prefetch_plan.get(self.action, []) # type:ignore
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            # Only load the relations and columns the response will show
+            prefetch = [name for name in prefetch if name in fields]
+            columns = [name for name in fields if name not in ('tags', 'ingredients')]
+            queryset = queryset.only('id', *columns)
+        if prefetch:
+            queryset = queryset.prefetch_related(*[
+                # Ordered so nested lists are stable and match RecipeRowSerializer
+                Prefetch(name, queryset=getattr(Recipe, name).rel.model.objects.order_by('id'))
+                for name in prefetch
+            ])
 
         return queryset.filter(
             user=self.request.user
-        ).distinct().order_by('-id') # type:ignore
+        ).order_by('-id') # type:ignore
+
+    def list(self, request, *args, **kwargs):
+        """List recipes, from the cache when possible."""
+        return self.cached_response(self._list_rows, request, *args, **kwargs)
+
+    def _list_rows(self, request, *args, **kwargs):
+        """List recipes from values() rows instead of model serializers."""
+        fields = self.get_sparse_fields() or serializers.RecipeSerializer.Meta.fields
+        queryset = self.get_queryset().prefetch_related(None)
+        columns = serializers.RecipeRowSerializer.columns(fields)
+        if 'search_rank' in queryset.query.annotations:
+            # Needed by the paginator to build the next cursor
+            columns.append('search_rank')
+        queryset = queryset.values('id', *columns)
+
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else queryset
+        data = serializers.RecipeRowSerializer(rows, fields).data
+        if page is not None:
+            return self.get_paginated_response(data)
+
+        return Response(data)
+
+    @extend_schema(
+        parameters=RECIPE_FILTER_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @action(methods=['GET'], detail=False, url_path='facets')
+    def facets(self, request):
+        """Count the filtered recipes per tag and per ingredient."""
+        return self.cached_response(self._facets, request)
+
+    def _facets(self, request):
+        """Count recipes per tag and ingredient with one grouped query each."""
+        recipes = self._filter_recipes(
+            Recipe.objects.filter(user=request.user), request.query_params,
+        ).values('id')
+        data = {}
+        for name, field in [('tags', 'tag'), ('ingredients', 'ingredient')]:
+            through = getattr(Recipe, name).through
+            # Only tags and ingredients used by at least one of the recipes
+            # are returned, anything missing has a count of 0
+            data[name] = [
+                {'id': related_id, 'name': related_name, 'count': count}
+                for related_id, related_name, count in through.objects.filter(
+                    recipe_id__in=recipes,
+                ).values(f'{field}_id', f'{field}__name').annotate(
+                    count=Count('recipe_id'),
+                ).order_by('-count', f'{field}__name').values_list(
+                    f'{field}_id', f'{field}__name', 'count',
+                )
+            ]
+
+        return Response(data)
+
+    def _export_chunks(self, queryset, fields):
+        """Yield exported recipes, a serialized chunk at a time."""
+        # iterator() streams rows through a server-side cursor, only one
+        # chunk of recipes is ever held in memory
+        chunk = []
+        for row in queryset.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.export_chunk_size:
+                yield serializers.RecipeRowSerializer(
+                    chunk, fields, serializers.RecipeDetailSerializer,
+                ).data
+                chunk = []
+        if chunk:
+            yield serializers.RecipeRowSerializer(
+                chunk, fields, serializers.RecipeDetailSerializer,
+            ).data
+
+    def _export_content(self, chunks, export_format):
+        """Yield the encoded export document, one piece per chunk."""
+        renderer = JSONRenderer()
+        if export_format == 'ndjson':
+            for chunk in chunks:
+                yield b''.join(renderer.render(item) + b'\n' for item in chunk)
+            return
+
+        yield b'['
+        separator = b''
+        for chunk in chunks:
+            yield separator + b','.join(renderer.render(item) for item in chunk)
+            separator = b','
+        yield b']'
+
+    def _gzip(self, content):
+        """Compress a stream of bytes on the fly."""
+        # 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        for piece in content:
+            compressed = compressor.compress(piece)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def _accepts_gzip(self, request):
+        """Return whether Accept-Encoding allows gzip, honouring q-values."""
+        qualities = {}
+        for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            name, *params = [part.strip() for part in coding.split(';')]
+            quality = 1.0
+            for param in params:
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if name:
+                qualities[name.lower()] = quality
+
+        # An explicit gzip entry wins over *, gzip;q=0 turns it off
+        return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'export_format',
+                OpenApiTypes.STR, enum=['ndjson', 'json'],
+                description='One recipe per line (default) or a JSON array',
+            ),
+        ],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """Stream every recipe of the user, gzipped if the client accepts it."""
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in ('ndjson', 'json'):
+            raise ValidationError({'export_format': 'Must be ndjson or json.'})
+
+        # Images are files, they are not part of the export
+        fields = [
+            name for name in serializers.RecipeDetailSerializer.Meta.fields
+            if name not in serializers.RecipeDetailSerializer.image_fields
+        ]
+        queryset = self.get_queryset().values(
+            'id', *serializers.RecipeRowSerializer.columns(fields),
+        )
+        content = self._export_content(
+            self._export_chunks(queryset, fields), export_format,
+        )
+        gzipped = self._accepts_gzip(request)
+        if gzipped:
+            content = self._gzip(content)
+
+        response = StreamingHttpResponse(
+            content,
+            content_type=(
+                'application/x-ndjson' if export_format == 'ndjson'
+                else 'application/json'
+            ),
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="recipes.{export_format}"'
+        )
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a recipe, from the cache when possible."""
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -78,12 +408,172 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return self.serializer_class or serializers.RecipeDetailSerializer
 
+    def update(self, request, *args, **kwargs):
+        """Update a recipe, reporting M2M write volume when debugging."""
+        response = super().update(request, *args, **kwargs)
+        if settings.DEBUG:
+            response['X-M2M-Rows-Touched'] = str(self.m2m_rows_touched)
+
+        return response
+
+    def perform_update(self, serializer):
+        """Save a recipe update."""
+        serializer.save()
+        self.m2m_rows_touched = serializer.m2m_rows_touched
+
     # Validated serializer, values should be correct
     def perform_create(self, serializer:BaseSerializer):
         """Create a new recipe."""
         # Save authenticated user into serializer
         serializer.save(user=self.request.user)
 
+    @extend_schema(
+        request=serializers.RecipeSerializer(many=True),
+        responses={201: OpenApiTypes.OBJECT},
+    )
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """Create many recipes in one transaction."""
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': 'Expected a list of recipes.'})
+        if len(request.data) > self.bulk_max_size:
+            raise ValidationError({
+                'non_field_errors': f'At most {self.bulk_max_size} recipes per request.'
+            })
+
+        serializer = serializers.RecipeSerializer(
+            data=request.data,
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.save(user=request.user)
+
+        return Response(
+            {'created': len(recipes), 'ids': [recipe.id for recipe in recipes]},
+            status=status.HTTP_201_CREATED,
+        )
+
+    def _bulk_selection(self, data, lock=False):
+        """Return the ids of the user's recipes a bulk request selects.
+
+        With lock the recipes are locked FOR UPDATE until the transaction
+        ends, so no other request can link tags or ingredients to them.
+        """
+        queryset = Recipe.objects.filter(user=self.request.user)
+        if lock:
+            queryset = queryset.select_for_update(of=('self',))
+        if 'ids' in data:
+            if len(data['ids']) > self.bulk_max_size:
+                raise ValidationError({
+                    'ids': f'At most {self.bulk_max_size} recipes per request.'
+                })
+            queryset = queryset.filter(id__in=data['ids'])
+        else:
+            try:
+                queryset = self._filter_recipes(queryset, data['filter'])
+            except ValueError:
+                raise ValidationError({'filter': 'Tags and ingredients must be IDs.'})
+
+        # One row over the cap tells a too broad filter apart from an exact fit
+        ids = list(
+            queryset.order_by('id').values_list('id', flat=True)[:self.bulk_max_size + 1]
+        )
+        if len(ids) > self.bulk_max_size:
+            raise ValidationError({
+                'filter': f'Matches more than {self.bulk_max_size} recipes, narrow it down.'
+            })
+
+        return ids
+
+    def _bulk_add_related(self, model, through, column, recipe_ids, items):
+        """Link tags or ingredients to recipes, returning the links created."""
+        related_ids = list(bulk_get_or_create(
+            model, self.request.user, [item['name'] for item in items],
+        ).values())
+        # Pairs already linked, also by a concurrent request, are skipped
+        # and not counted
+        inserted = insert_links(through, column, [
+            (recipe_id, related_id)
+            for recipe_id in recipe_ids
+            for related_id in related_ids
+        ])
+        adjust_recipe_counts(model, inserted)
+        return sum(inserted.values())
+
+    def _bulk_remove_related(self, model, through, column, recipe_ids, items):
+        """Unlink tags or ingredients from recipes, returning the links deleted."""
+        related_ids = model.objects.filter(
+            user=self.request.user, name__in=[item['name'] for item in items],
+        ).values_list('id', flat=True)
+        removed = delete_links(through, column, recipe_ids, list(related_ids))
+        adjust_recipe_counts(model, {pk: -count for pk, count in removed.items()})
+        return sum(removed.values())
+
+    @extend_schema(
+        request=serializers.RecipeBulkUpdateSerializer,
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        """Apply a partial change to many recipes in one transaction."""
+        serializer = serializers.RecipeBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        related = [
+            ('tags', Tag, Recipe.tags.through, 'tag_id'),
+            ('ingredients', Ingredient, Recipe.ingredients.through, 'ingredient_id'),
+        ]
+
+        with transaction.atomic():
+            ids = self._bulk_selection(data)
+            summary = {'matched': len(ids), 'updated': 0}
+            if ids and data.get('changes'):
+                summary['updated'] = Recipe.objects.filter(id__in=ids).update(
+                    **data['changes'],
+                )
+            for name, model, through, column in related:
+                removed = data.get(f'remove_{name}')
+                added = data.get(f'add_{name}')
+                summary[f'{name}_removed'] = self._bulk_remove_related(
+                    model, through, column, ids, removed,
+                ) if ids and removed else 0
+                summary[f'{name}_added'] = self._bulk_add_related(
+                    model, through, column, ids, added,
+                ) if ids and added else 0
+
+        # update() and the through table writes send no signals
+        bump_data_version(request.user.id)
+        return Response(summary)
+
+    @extend_schema(
+        request=serializers.RecipeSelectionSerializer,
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """Delete many recipes in one transaction."""
+        serializer = serializers.RecipeSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            ids = self._bulk_selection(serializer.validated_data, lock=True)
+            # The links are deleted first and only the rows DELETE returns
+            # are uncounted, instead of two queries per recipe in the
+            # delete signal handlers
+            for model, through, column in [
+                (Tag, Recipe.tags.through, 'tag_id'),
+                (Ingredient, Recipe.ingredients.through, 'ingredient_id'),
+            ]:
+                removed = delete_links(through, column, ids)
+                adjust_recipe_counts(model, {pk: -count for pk, count in removed.items()})
+            with counted_manually(), invalidated_manually():
+                Recipe.objects.filter(id__in=ids).delete()
+
+        # Once for the whole delete instead of once per recipe
+        bump_data_version(request.user.id)
+        return Response({'deleted': len(ids)})
+
     # A specific receipe must be specified
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
@@ -94,7 +584,19 @@ class RecipeViewSet(viewsets.ModelViewSet):
             data=request.data,
         )
         if serializer.is_valid():
-            serializer.save()
+            # Saved as uploaded, processed in the background once committed
+            with transaction.atomic():
+                # Locked, so processing of the old image cannot record
+                # other files in the meantime
+                previous = images.image_files(
+                    Recipe.objects.select_for_update().only(
+                        'image', 'image_thumbnails',
+                    ).get(id=recipe.id)
+                )
+                recipe = serializer.save(**images.pending_fields())
+                images.schedule_processing(recipe)
+                # Nothing points at the old image and its thumbnails now
+                images.schedule_deletion(previous)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK,
@@ -112,17 +614,48 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 OpenApiTypes.INT, enum=[0, 1],
                 description='Filter by items assigned to recipes',
             ),
+            OpenApiParameter(
+                'q',
+                OpenApiTypes.STR,
+                description=(
+                    'Typeahead, return the first matches whose name starts '
+                    'with this text (case insensitive)'
+                ),
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='Maximum number of typeahead matches (default 10, max 50)',
+            ),
+            OpenApiParameter(
+                'recipe_count',
+                OpenApiTypes.INT, enum=[0, 1],
+                description='Include the number of recipes using each item',
+            ),
         ],
     )
 )
 class BaseRecipeAttrViewSet(
+    CachedResponseMixin,
     mixins.DestroyModelMixin,
     mixins.UpdateModelMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet):
     """Base viewset for recipe attributes."""
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    typeahead_limit = 10
+    max_typeahead_limit = 50
+
+    def _get_typeahead_limit(self):
+        """Return the number of typeahead matches requested."""
+        limit = self.request.query_params.get('limit', self.typeahead_limit) # type:ignore
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+
+        return max(1, min(limit, self.max_typeahead_limit))
 
     def get_queryset(self):
         """Retrieve tags for authenticated user."""
@@ -132,12 +665,45 @@ class BaseRecipeAttrViewSet(
         )
         queryset = self.queryset
         if assigned_only:
-            # Need to have recipe
-            queryset = queryset.filter(recipe__isnull=False) # type:ignore
+            # Need to have recipe. EXISTS stops at the first link, joining
+            # the through table would repeat rows and need a DISTINCT.
+            through, column = RELATED[queryset.model] # type:ignore
+            queryset = queryset.filter(Exists( # type:ignore
+                through.objects.filter(**{column: OuterRef('pk')})
+            ))
 
-        return queryset.filter( # type:ignore
+        queryset = queryset.filter( # type:ignore
             user=self.request.user
-        ).distinct().order_by('-name')
+        )
+
+        q = self.request.query_params.get('q') # type:ignore
+        if q and self.action == 'list':
+            # Matches the (user_id, upper(name) text_pattern_ops) index
+            return queryset.annotate(name_upper=Upper('name')).filter(
+                name_upper__startswith=q.upper(),
+            ).order_by('name_upper', 'id')[:self._get_typeahead_limit()]
+
+        return queryset.order_by('-name')
+
+    def get_serializer_class(self):
+        """Return the serializer class for request."""
+        recipe_count = bool(
+            # recipe_count = 0, by default
+            int(self.request.query_params.get('recipe_count', 0)) # type:ignore
+        )
+        if self.action == 'list' and recipe_count:
+            # Read from the denormalized counter, nothing is aggregated
+            return self.count_serializer_class
+
+        return self.serializer_class
+
+    def perform_update(self, serializer):
+        """Rename a tag or ingredient, names are unique per user."""
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError({'name': 'You already have an item with this name.'})
 
 
 # ListModelMixin - Listing functionality
@@ -145,10 +711,32 @@ class BaseRecipeAttrViewSet(
 class TagViewSet(BaseRecipeAttrViewSet):
     """Manage tags in the database."""
     serializer_class = serializers.TagSerializer
+    count_serializer_class = serializers.TagCountSerializer
     queryset = Tag.objects.all()
  
 
 class IngredientViewSet(BaseRecipeAttrViewSet):
     """Manage ingredients in the database."""
     serializer_class = serializers.IngredientSerializer
+    count_serializer_class = serializers.IngredientCountSerializer
     queryset = Ingredient.objects.all()
+
+
+@require_safe
+def resized_image(request: HttpRequest, stem: Any, width: int, extension: str):
+    """Serve a recipe image at one of the allowed widths and formats.
+
+    nginx serves copies that already exist, requests only get here to
+    make a missing one.
+    """
+    if width not in settings.RECIPE_IMAGE_RESIZE_WIDTHS or extension not in resize.FORMATS:
+        raise Http404('Unsupported width or format.')
+
+    image = resize.open_resized(str(stem), width, extension)
+    if image is None:
+        raise Http404('No such image.')
+
+    response = FileResponse(image, content_type=resize.FORMATS[extension][1])
+    # A new upload gets a new stem, a copy never changes
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
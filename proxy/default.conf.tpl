@@ -7,6 +7,31 @@ server {
         alias /vol/static;
     }
 
+    # Resized recipe images, existing copies are served from disk and only
+    # missing ones go to the app, which makes and stores them
+    location /static/media/resized/ {
+        root                    /vol;
+        try_files               $uri @resize_image;
+        # A copy never changes, a new upload gets a new URL
+        add_header              Cache-Control "public, max-age=31536000, immutable";
+    }
+
+    location @resize_image {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+    }
+
+    # Metrics are for the Prometheus scraper on the private network only
+    location = /metrics {
+        allow                   10.0.0.0/8;
+        allow                   172.16.0.0/12;
+        allow                   192.168.0.0/16;
+        allow                   127.0.0.1;
+        deny                    all;
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+    }
+
     # The rest of the requests
     location / {
         uwsgi_pass              ${APP_HOST}:${APP_PORT};
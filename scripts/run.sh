@@ -9,6 +9,12 @@ python manage.py collectstatic --noinput
 # Run all migrations automatically whenever the container starts
 python manage.py migrate
 
+# Every uwsgi worker writes its metrics here for /metrics to add up,
+# start from empty so values of the previous run are not counted
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # --workers: Set 4 diff workers for uwsgi
 # --master: Enable the master process
 # --enable-threads: Enable threads